@@ -0,0 +1,575 @@
+import asyncio
+import json
+import logging
+import ssl
+import time
+import urllib.parse
+from datetime import date
+from typing import Optional, Union
+
+import requests
+
+from core import (
+    RATE_UNAVAILABLE,
+    APIClient,
+    ConversionError,
+    ConversionResult,
+    CurrencyConverterCore,
+    NetworkChecker,
+    QuotePlan,
+    RequestHedger,
+    SteamConversionResult,
+    metrics,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHTTPError(Exception):
+    pass
+
+
+class AsyncResponse:
+    def __init__(
+        self, status_code: int, headers: dict, content: bytes, url: str
+    ):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AsyncHTTPError(f"HTTP {self.status_code} для {self.url}")
+
+
+class AsyncHTTPTransport:
+    def __init__(self, max_connections_per_host: int = 32):
+        self.max_connections_per_host = max_connections_per_host
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'application/json, text/javascript, */*; q=0.01',
+            'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+            'Accept-Encoding': 'identity',
+        }
+        self._idle: dict[tuple, list] = {}
+        self._limits: dict[tuple, asyncio.Semaphore] = {}
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    async def get(
+        self, url: str, headers: Optional[dict] = None, timeout: float = 2
+    ) -> AsyncResponse:
+        return await asyncio.wait_for(self._get(url, headers or {}), timeout)
+
+    async def _get(self, url: str, headers: dict) -> AsyncResponse:
+        parts = urllib.parse.urlsplit(url)
+        secure = parts.scheme == "https"
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        key = (host, port, secure)
+        target = parts.path or "/"
+        if parts.query:
+            target += f"?{parts.query}"
+        request = self._build_request(host, target, headers)
+
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(
+                self.max_connections_per_host
+            )
+        async with limit:
+            # Соединение из пула могло быть закрыто сервером, тогда
+            # запрос повторяется один раз на новом соединении
+            for attempt in range(2):
+                reader, writer, reused = await self._acquire(key)
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, response_headers, body, keep_alive = (
+                        await self._read_response(reader)
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._idle.setdefault(key, []).append((reader, writer))
+                else:
+                    writer.close()
+                return AsyncResponse(status, response_headers, body, url)
+        raise AsyncHTTPError(f"Не удалось выполнить запрос {url}")
+
+    def _build_request(self, host: str, target: str, headers: dict) -> bytes:
+        lines = [f"GET {target} HTTP/1.1", f"Host: {host}"]
+        for name, value in {**self.headers, **headers}.items():
+            lines.append(f"{name}: {value}")
+        lines.append("Connection: keep-alive")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def _acquire(self, key: tuple):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        host, port, secure = key
+        ssl_context = None
+        if secure:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl_context
+        )
+        return reader, writer, False
+
+    async def _read_response(self, reader: asyncio.StreamReader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Соединение закрыто сервером")
+        version, status, *_ = status_line.decode('latin-1').split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and (
+            version.upper() == "HTTP/1.1"
+        )
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), headers, body, keep_alive
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                # Завершающие заголовки после последнего блока
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def is_network_available(self, timeout: float = 1.0) -> bool:
+        results = await asyncio.gather(
+            *(
+                self._probe(host, port, timeout)
+                for host, port in NetworkChecker.PROBE_HOSTS
+            )
+        )
+        return any(results)
+
+    @staticmethod
+    async def _probe(host: str, port: int, timeout: float) -> bool:
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), timeout
+            )
+            writer.close()
+            result = True
+        except (OSError, asyncio.TimeoutError):
+            result = False
+        metrics.observe(
+            "network_probe_seconds", time.perf_counter() - start, host=host
+        )
+        metrics.inc(
+            "network_probes_total",
+            host=host,
+            result="ok" if result else "fail",
+        )
+        return result
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+class SyncTransportAdapter:
+    # Позволяет использовать RecordingTransport и ReplayTransport из core
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def get(
+        self, url: str, headers: Optional[dict] = None, timeout: float = 2
+    ) -> AsyncResponse:
+        try:
+            response = await asyncio.to_thread(
+                self.transport.get, url, headers, timeout
+            )
+        except requests.exceptions.RequestException as e:
+            raise AsyncHTTPError(str(e)) from e
+        return AsyncResponse(
+            response.status_code,
+            {k.lower(): v for k, v in response.headers.items()},
+            response.content,
+            url,
+        )
+
+    async def is_network_available(self, timeout: float = 1.0) -> bool:
+        return await asyncio.to_thread(
+            self.transport.is_network_available, timeout
+        )
+
+    async def close(self):
+        await asyncio.to_thread(self.transport.close)
+
+
+REQUEST_ERRORS = (
+    AsyncHTTPError,
+    OSError,
+    asyncio.TimeoutError,
+    asyncio.IncompleteReadError,
+)
+
+
+class AsyncAPIClient:
+    def __init__(
+        self,
+        cbr_url: str = APIClient.CBR_URL,
+        plati_url: str = APIClient.PLATI_URL,
+        transport: Optional[AsyncHTTPTransport] = None,
+        probe_ttl: float = 1.0,
+        hedger: Optional[RequestHedger] = None,
+        cbr_xml_url: str = APIClient.CBR_XML_URL,
+        nbu_url: str = APIClient.NBU_URL,
+        rate_mode: str = "first",
+    ):
+        # Построение URL, разбор ответов и источники курса общие с
+        # синхронным клиентом, он же используется для загрузки архива
+        self.sync_client = APIClient(
+            cbr_url,
+            plati_url,
+            cbr_xml_url=cbr_xml_url,
+            nbu_url=nbu_url,
+            rate_mode=rate_mode,
+        )
+        self.transport = transport or AsyncHTTPTransport()
+        self.probe_ttl = probe_ttl
+        self.hedger = hedger
+        self._probe_task: Optional[asyncio.Task] = None
+        self._probe_result: Optional[tuple[float, bool]] = None
+
+    async def is_network_available(self, timeout: float = 1.0) -> bool:
+        # Одновременные проверки сети объединяются в одну
+        if self._probe_result is not None:
+            checked_at, result = self._probe_result
+            if time.monotonic() - checked_at < self.probe_ttl:
+                return result
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.ensure_future(
+                self.transport.is_network_available(timeout)
+            )
+        result = await asyncio.shield(self._probe_task)
+        self._probe_result = (time.monotonic(), result)
+        return result
+
+    async def get_exchange_rate(
+        self, reference: Optional[float] = None
+    ) -> Optional[float]:
+        quote = await self.sync_client.rate_chain.afetch(
+            self.transport, reference
+        )
+        return quote.rate if quote else None
+
+    async def _fetch_steam(self, url: str) -> dict:
+        response = await self.transport.get(
+            url, headers={'X-Requested-With': 'XMLHttpRequest'}, timeout=2
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def get_steam_amount(
+        self, amount: float, currency: str = "RUB", check_network: bool = True
+    ) -> Optional[float]:
+        if check_network and not await self.is_network_available(0.5):
+            logger.info("Пропуск запроса к API Steam: нет подключения к сети")
+            metrics.inc("upstream_skipped_total", upstream="plati")
+            return None
+        try:
+            url = self.sync_client.steam_url(amount, currency)
+            with metrics.timer("upstream_latency_seconds", upstream="plati"):
+                if self.hedger is not None:
+                    data = await self.hedger.arun(
+                        lambda: self._fetch_steam(url)
+                    )
+                else:
+                    data = await self._fetch_steam(url)
+            return self.sync_client.parse_steam_response(data)
+        except REQUEST_ERRORS as e:
+            logger.warning(f"Ошибка получения данных Steam: {e!r}")
+            metrics.inc(
+                "upstream_errors_total", upstream="plati", kind="request"
+            )
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка обработки данных Steam: {e}")
+            metrics.inc(
+                "upstream_errors_total", upstream="plati", kind="parse"
+            )
+            return None
+
+    async def close(self):
+        await self.transport.close()
+        self.sync_client.close()
+
+
+class AsyncCurrencyConverterCore:
+    SAVE_DELAY = 0.05
+    MAX_PARALLEL_QUOTES = 64
+
+    def __init__(
+        self,
+        api_client: Optional[AsyncAPIClient] = None,
+        cache_file: str = "currency_cache.json",
+        history_file: str = "rate_history.bin",
+        remote_cache=None,
+    ):
+        self.api_client = api_client or AsyncAPIClient()
+        # Состояние, кэш и правила расчета общие с синхронным ядром,
+        # асинхронными здесь сделаны только сетевые и файловые операции
+        self.core = CurrencyConverterCore(
+            api_client=self.api_client.sync_client,
+            cache_file=cache_file,
+            history_file=history_file,
+            remote_cache=remote_cache,
+        )
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._save_task: Optional[asyncio.Task] = None
+        self._quote_limit: Optional[asyncio.Semaphore] = None
+
+    @property
+    def current_rate(self) -> Optional[float]:
+        return self.core.current_rate
+
+    @property
+    def is_online(self) -> bool:
+        return self.core.is_online
+
+    @property
+    def rate_source(self) -> str:
+        return self.core.rate_source
+
+    @property
+    def cache_manager(self):
+        return self.core.cache_manager
+
+    async def initialize(self) -> bool:
+        core = self.core
+        core.is_online = await self.api_client.is_network_available(1.0)
+        if core.is_online:
+            cache = core.cache_manager
+            shared_rate = (
+                await asyncio.to_thread(cache.shared_rate)
+                if cache.remote is not None
+                else None
+            )
+            if shared_rate:
+                core._apply_shared_rate(shared_rate)
+                return True
+            try:
+                new_rate = await self.api_client.get_exchange_rate(
+                    cache.reference_rate()
+                )
+                if new_rate:
+                    await asyncio.to_thread(core._apply_api_rate, new_rate)
+                    return True
+            finally:
+                if cache.remote is not None:
+                    await asyncio.to_thread(cache.release_rate_refresh)
+            core.is_online = False
+        return await asyncio.to_thread(core._apply_offline_rate)
+
+    def set_manual_rate(self, rate: float):
+        self.core.set_manual_rate(rate)
+
+    async def convert_currency(
+        self,
+        amount: float,
+        reverse: bool = False,
+        as_of: Optional[date] = None,
+    ) -> dict:
+        return (
+            await self.convert_currency_result(amount, reverse, as_of)
+        ).to_dict()
+
+    async def convert_currency_result(
+        self,
+        amount: float,
+        reverse: bool = False,
+        as_of: Optional[date] = None,
+    ) -> Union[ConversionResult, ConversionError]:
+        if as_of is not None and self.core._history is None:
+            # Первое обращение к истории читает файл с диска
+            await asyncio.to_thread(lambda: self.core.history.load())
+        return self.core.convert_currency_result(amount, reverse, as_of)
+
+    async def convert_many(
+        self, amounts: list[float], reverse: bool = False
+    ) -> list[dict]:
+        return [
+            self.core.convert_currency(amount, reverse) for amount in amounts
+        ]
+
+    async def convert_to_steam(
+        self, amount: float, from_uah: bool = False, currency: str = "RUB"
+    ) -> dict:
+        return (
+            await self.convert_to_steam_result(amount, from_uah, currency)
+        ).to_dict()
+
+    async def convert_to_steam_result(
+        self, amount: float, from_uah: bool = False, currency: str = "RUB"
+    ) -> Union[SteamConversionResult, ConversionError]:
+        return (
+            await self.convert_to_steam_batch_results(
+                [(amount, currency)], from_uah
+            )
+        )[0]
+
+    async def convert_to_steam_batch(
+        self,
+        items: list[Union[float, tuple[float, str]]],
+        from_uah: bool = False,
+    ) -> list[dict]:
+        return [
+            result.to_dict()
+            for result in await self.convert_to_steam_batch_results(
+                items, from_uah
+            )
+        ]
+
+    async def convert_to_steam_batch_results(
+        self,
+        items: list[Union[float, tuple[float, str]]],
+        from_uah: bool = False,
+    ) -> list[Union[SteamConversionResult, ConversionError]]:
+        core = self.core
+        if not core.current_rate:
+            return [RATE_UNAVAILABLE] * len(items)
+        prepared, quote_items = core._prepare_steam_batch(items, from_uah)
+        quotes = await self.quote_many(
+            quote_items, core._is_effectively_online()
+        )
+        return core._finish_steam_batch(prepared, quotes, from_uah)
+
+    async def quote_many(
+        self, items: list[tuple[float, str]], is_online: bool
+    ) -> dict[tuple[float, str], float]:
+        calculator = self.core.steam_calculator
+        # Первое обращение читает раздел котировок с диска, а промахи
+        # первого уровня читаются из общего кэша по сети
+        plan = await asyncio.to_thread(calculator.plan_quotes, items)
+        if (
+            plan.missing
+            and is_online
+            and await self.api_client.is_network_available(0.5)
+        ):
+            cache = self.core.cache_manager
+            if cache.remote is None:
+                await self._fetch_missing(plan)
+            else:
+                waiting = await asyncio.to_thread(
+                    calculator.claim_missing, plan
+                )
+                await self._fetch_missing(plan)
+                await asyncio.to_thread(cache.release_refresh, plan.missing)
+                if waiting:
+                    shared = await asyncio.to_thread(
+                        cache.wait_for_refresh, waiting
+                    )
+                    calculator.use_shared_quotes(plan, shared)
+                    plan.missing = [
+                        key for key in waiting if key not in plan.key_quotes
+                    ]
+                    await self._fetch_missing(plan)
+        if self.core.cache_manager.steam_dirty:
+            self._schedule_save()
+        return calculator.finish_quotes(plan, is_online)
+
+    async def _fetch_missing(self, plan: QuotePlan):
+        fetched = await asyncio.gather(
+            *(
+                self._fetch_coalesced(key, *plan.by_key[key])
+                for key in plan.missing
+            )
+        )
+        # Запись берет блокировку кэша, чистит устаревшие котировки и
+        # отправляет их в общий кэш по сети, поэтому идет в потоке
+        await asyncio.to_thread(
+            self.core.steam_calculator.store_quotes,
+            plan,
+            fetched,
+            persist=False,
+        )
+
+    async def _fetch_coalesced(
+        self, key: str, amount: float, currency: str
+    ) -> Optional[float]:
+        # Одинаковые запросы из разных задач ждут один ответ API
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(amount, currency))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            metrics.inc("steam_requests_coalesced_total", currency=currency)
+        return await asyncio.shield(future)
+
+    async def _fetch(self, amount: float, currency: str) -> Optional[float]:
+        if self._quote_limit is None:
+            self._quote_limit = asyncio.Semaphore(self.MAX_PARALLEL_QUOTES)
+        async with self._quote_limit:
+            return await self.api_client.get_steam_amount(
+                amount, currency, check_network=False
+            )
+
+    def _schedule_save(self):
+        # Новые котировки записываются на диск одним сохранением
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.ensure_future(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.SAVE_DELAY)
+        await asyncio.to_thread(self.core.cache_manager.save)
+
+    def get_status_info(self) -> dict:
+        return self.core.get_status_info()
+
+    async def aclose(self):
+        if self._save_task is not None:
+            await self._save_task
+        await self.api_client.close()
+        await asyncio.to_thread(self.core.close_shared_cache)
+
+    async def __aenter__(self) -> "AsyncCurrencyConverterCore":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
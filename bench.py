@@ -0,0 +1,971 @@
+"""
+Набор бенчмарков конвертера
+Использование:
+    python bench.py [флаги]
+
+Все запросы к API обслуживает локальный HTTP сервер, эмулирующий
+cbr-xml-daily и plati.market, поэтому сеть не требуется. Результаты
+выводятся в JSON, чтобы их можно было сравнивать между коммитами.
+
+Флаги:
+    --latency сек        Базовая задержка ответа сервера (по умолчанию 0.02)
+    --jitter сек         Случайное отклонение задержки (по умолчанию 0.01)
+    --error-rate доля    Доля ответов с ошибкой 500 (по умолчанию 0)
+    --tail-rate доля     Доля медленных ответов (по умолчанию 0)
+    --tail-latency сек   Задержка медленных ответов (по умолчанию 1.5)
+    --quick              Уменьшенные размеры для быстрой проверки
+    --only имя           Запустить только указанные бенчмарки (через запятую)
+    --replay путь        Брать ответы API из архива cli.py --record вместо сервера
+    --replay-speed x     Ускорение воспроизведения архива (по умолчанию 0 - без задержек)
+    -o, --output путь    Сохранить результаты в файл вместо вывода в консоль
+
+Примеры:
+    python bench.py --quick
+    python bench.py --latency 0.05 --error-rate 0.1 -o bench.json
+"""
+
+import argparse
+import asyncio
+import csv
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, replace
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from async_core import (
+    AsyncAPIClient,
+    AsyncCurrencyConverterCore,
+    SyncTransportAdapter,
+)
+from bundle import OfflineBundle
+from remote_cache import RESPServer, RemoteCache
+from steam_split import SplitOptimizer
+from core import (
+    APIClient,
+    CacheManager,
+    CBRJsonProvider,
+    CurrencyConverterCore,
+    NetworkChecker,
+    ReplayTransport,
+    RequestHedger,
+    SteamCalculator,
+    metrics,
+    results_to_csv_bytes,
+    results_to_json_bytes,
+)
+
+
+@dataclass
+class UpstreamProfile:
+    latency: float = 0.02
+    jitter: float = 0.01
+    error_rate: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 1.5
+    uah_rate: float = 2.2
+    seed: int = 42
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    # Очередь по умолчанию (5) не выдерживает пачку параллельных подключений
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeUpstream:
+    def __init__(self, profile: UpstreamProfile):
+        self.profile = profile
+        self.random = random.Random(profile.seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = UpstreamServer(("127.0.0.1", 0), self._make_handler())
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "FakeUpstream":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def api_urls(self) -> dict:
+        return {
+            "cbr_url": f"{self.base_url}/daily_json.js",
+            "cbr_xml_url": f"{self.base_url}/scripts/XML_daily.asp",
+            "nbu_url": f"{self.base_url}/statdirectory/exchange?json",
+            "plati_url": f"{self.base_url}/asp/price_options.asp",
+        }
+
+    def make_api_client(self) -> APIClient:
+        return APIClient(**self.api_urls())
+
+    def _next_delay(self) -> tuple[float, bool]:
+        profile = self.profile
+        with self._lock:
+            self.requests += 1
+            failed = self.random.random() < profile.error_rate
+            if self.random.random() < profile.tail_rate:
+                return profile.tail_latency, failed
+            jitter = self.random.uniform(-profile.jitter, profile.jitter)
+        return max(0.0, profile.latency + jitter), failed
+
+    def _make_handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                delay, failed = upstream._next_delay()
+                time.sleep(delay)
+                if failed:
+                    self._send(500, {"error": "emulated failure"})
+                    return
+                parsed = urllib.parse.urlsplit(self.path)
+                if parsed.path.endswith("daily_json.js"):
+                    self._send(200, upstream.cbr_payload())
+                elif parsed.path.endswith("XML_daily.asp"):
+                    self._send_body(
+                        200,
+                        upstream.cbr_xml_payload(),
+                        "application/xml; charset=windows-1251",
+                    )
+                elif parsed.path.endswith("exchange"):
+                    self._send(200, upstream.nbu_payload())
+                elif parsed.path.endswith("price_options.asp"):
+                    query = urllib.parse.parse_qs(parsed.query)
+                    amount = query.get("a", ["0"])[0].replace(',', '.')
+                    self._send(200, upstream.plati_payload(float(amount)))
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def _send(self, status: int, payload):
+                self._send_body(
+                    status, json.dumps(payload).encode(), "application/json"
+                )
+
+            def _send_body(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def cbr_payload(self) -> dict:
+        return {
+            "Date": datetime.now().isoformat(),
+            "Valute": {
+                "UAH": {
+                    "CharCode": "UAH",
+                    "Nominal": 10,
+                    "Value": self.profile.uah_rate * 10,
+                }
+            },
+        }
+
+    def cbr_xml_payload(self) -> bytes:
+        value = f"{self.profile.uah_rate * 10:.4f}".replace('.', ',')
+        return (
+            '<?xml version="1.0" encoding="windows-1251"?>'
+            f'<ValCurs Date="{datetime.now():%d.%m.%Y}" name="Foreign Currency Market">'
+            '<Valute ID="R01720"><NumCode>980</NumCode>'
+            '<CharCode>UAH</CharCode><Nominal>10</Nominal>'
+            '<Name>Украинских гривен</Name>'
+            f'<Value>{value}</Value></Valute></ValCurs>'
+        ).encode('windows-1251')
+
+    def nbu_payload(self) -> list:
+        return [
+            {
+                "r030": 643,
+                "txt": "Російський рубль",
+                "rate": round(1 / self.profile.uah_rate, 6),
+                "cc": "RUB",
+                "exchangedate": f"{datetime.now():%d.%m.%Y}",
+            }
+        ]
+
+    def plati_payload(self, amount: float) -> dict:
+        steam = int(amount * 0.935)
+        return {"err": "0", "cnt": str(steam).replace('.', ',')}
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(name: str, samples: list[float], **extra) -> dict:
+    total = sum(samples)
+    return {
+        "name": name,
+        "iterations": len(samples),
+        "total_s": round(total, 6),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "p50_ms": round(percentile(samples, 50) * 1000, 4),
+        "p95_ms": round(percentile(samples, 95) * 1000, 4),
+        "p99_ms": round(percentile(samples, 99) * 1000, 4),
+        "max_ms": round(max(samples) * 1000, 4),
+        "ops_per_s": round(len(samples) / total, 2) if total else None,
+        **extra,
+    }
+
+
+def hedge_counts() -> dict[str, float]:
+    counts = {"won": 0, "lost": 0, "no_budget": 0}
+    for counter in metrics.snapshot()["counters"]:
+        if counter["name"] == "hedge_requests_total":
+            counts[counter["labels"]["result"]] += counter["value"]
+    return counts
+
+
+def timed(fn, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class BenchmarkSuite:
+    def __init__(
+        self,
+        upstream: FakeUpstream,
+        workdir: str,
+        quick: bool,
+        replay: ReplayTransport | None = None,
+    ):
+        self.upstream = upstream
+        self.workdir = workdir
+        self.quick = quick
+        self.replay = replay
+        self._counter = 0
+
+    def _cache_file(self) -> str:
+        self._counter += 1
+        return os.path.join(self.workdir, f"cache_{self._counter}.json")
+
+    def _core(self, initialize: bool = True) -> CurrencyConverterCore:
+        core = CurrencyConverterCore(
+            api_client=(
+                APIClient(transport=self.replay)
+                if self.replay
+                else self.upstream.make_api_client()
+            ),
+            cache_file=self._cache_file(),
+        )
+        if initialize:
+            core.initialize()
+        return core
+
+    def cold_start(self) -> list[dict]:
+        def run():
+            self._core(initialize=True)
+
+        return [summarize("cold_start", timed(run, 5 if self.quick else 20))]
+
+    def single_conversion(self) -> list[dict]:
+        core = self._core()
+        iterations = 10_000 if self.quick else 100_000
+        results = [
+            summarize(
+                "convert_currency",
+                timed(lambda: core.convert_currency(123.45), iterations),
+            )
+        ]
+        amounts = iter(range(100, 100_000))
+        results.append(
+            summarize(
+                "convert_to_steam_upstream",
+                timed(
+                    lambda: core.convert_to_steam(float(next(amounts))),
+                    20 if self.quick else 100,
+                ),
+            )
+        )
+        core.convert_to_steam(500.0)
+        results.append(
+            summarize(
+                "convert_to_steam_cached",
+                timed(lambda: core.convert_to_steam(500.0), 1000),
+            )
+        )
+        return results
+
+    def batch_conversion(self) -> list[dict]:
+        core = self._core()
+        size = 10_000 if self.quick else 100_000
+        amounts = [round(10 + i * 0.37, 2) for i in range(size)]
+
+        def regular_batch():
+            for amount in amounts:
+                core.convert_currency(amount)
+
+        steam_amounts = [
+            float(100 + i) for i in range(50 if self.quick else 200)
+        ]
+
+        def steam_batch():
+            for amount in steam_amounts:
+                core.convert_to_steam(amount, from_uah=False)
+
+        batch_core = self._core()
+        items = [
+            (amount, currency)
+            for amount in steam_amounts
+            for currency in ("RUB", "KZT", "UAH", "USD")
+        ]
+
+        return [
+            summarize(
+                "batch_convert_currency", timed(regular_batch, 3), size=size
+            ),
+            summarize(
+                "batch_convert_to_steam",
+                timed(steam_batch, 1),
+                size=len(steam_amounts),
+            ),
+            summarize(
+                "convert_to_steam_batch_multi_currency",
+                timed(lambda: batch_core.convert_to_steam_batch(items), 1),
+                size=len(items),
+            ),
+        ]
+
+    def _prefilled_cache(
+        self, size: int, expired_share: float
+    ) -> CacheManager:
+        cache = CacheManager(self._cache_file())
+        # Здесь измеряется масштабирование, предел размера кэша мешает
+        cache.max_steam_entries = None
+        now = time.time()
+        expired_before = int(size * expired_share)
+        cache.steam_rates.update(
+            (
+                f"{float(i)}_RUB",
+                (
+                    i * 0.935,
+                    (
+                        now - cache.steam_cache_duration * 2
+                        if i < expired_before
+                        else now
+                    ),
+                ),
+            )
+            for i in range(size)
+        )
+        cache.save()
+        return cache
+
+    def cache_scaling(self) -> list[dict]:
+        results = []
+        for size in (1_000, 10_000) if self.quick else (10_000, 100_000):
+            cache = self._prefilled_cache(size, expired_share=0.0)
+            keys = iter(range(size, size * 2))
+            results.append(
+                summarize(
+                    "cache_insert",
+                    timed(
+                        lambda: cache.set_steam_amount(
+                            f"{float(next(keys))}_RUB", 1.0
+                        ),
+                        5,
+                    ),
+                    entries=size,
+                )
+            )
+            results.append(
+                summarize(
+                    "cache_lookup",
+                    timed(lambda: cache.get_steam_amount("1.0_RUB"), 1000),
+                    entries=size,
+                )
+            )
+            # Запуск только с курсом не должен зависеть от числа котировок
+            results.append(
+                summarize(
+                    "cache_load_rate",
+                    timed(
+                        lambda: CacheManager(
+                            cache.persistent_cache.cache_file
+                        ).get_rate(),
+                        20,
+                    ),
+                    entries=size,
+                )
+            )
+            results.append(
+                summarize(
+                    "cache_load_steam",
+                    timed(
+                        lambda: cache.persistent_cache.load_section(
+                            'steam_rates'
+                        ),
+                        3,
+                    ),
+                    entries=size,
+                )
+            )
+
+            samples = []
+            for _ in range(3):
+                cache = self._prefilled_cache(size, expired_share=0.5)
+                start = time.perf_counter()
+                cache._cleanup_steam_cache()
+                samples.append(time.perf_counter() - start)
+            results.append(summarize("cache_expire", samples, entries=size))
+        return results
+
+    def concurrent_steam(self) -> list[dict]:
+        core = self._core()
+        workers = 16
+        lookups = 200 if self.quick else 1000
+        amounts = [float(100 + i % 100) for i in range(lookups)]
+        samples = []
+
+        def lookup(amount: float):
+            start = time.perf_counter()
+            core.convert_to_steam(amount)
+            samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lookup, amounts))
+        wall = time.perf_counter() - start
+        return [
+            summarize(
+                "concurrent_steam",
+                samples,
+                workers=workers,
+                wall_s=round(wall, 6),
+                throughput_per_s=round(lookups / wall, 2),
+            )
+        ]
+
+    def async_steam(self) -> list[dict]:
+        lookups = 500 if self.quick else 5000
+        amounts = [float(100 + i % 500) for i in range(lookups)]
+
+        async def lookup(core: AsyncCurrencyConverterCore, amount: float):
+            start = time.perf_counter()
+            await core.convert_to_steam(amount)
+            return time.perf_counter() - start
+
+        async def run() -> tuple[list[float], float]:
+            async with AsyncCurrencyConverterCore(
+                AsyncAPIClient(
+                    transport=(
+                        SyncTransportAdapter(self.replay)
+                        if self.replay
+                        else None
+                    ),
+                    **self.upstream.api_urls(),
+                ),
+                cache_file=self._cache_file(),
+            ) as core:
+                await core.initialize()
+                start = time.perf_counter()
+                samples = await asyncio.gather(
+                    *(lookup(core, amount) for amount in amounts)
+                )
+                return samples, time.perf_counter() - start
+
+        samples, wall = asyncio.run(run())
+        return [
+            summarize(
+                "async_steam",
+                samples,
+                concurrency=lookups,
+                wall_s=round(wall, 6),
+                throughput_per_s=round(lookups / wall, 2),
+            )
+        ]
+
+    def rate_failover(self) -> list[dict]:
+        # Основной источник курса отвечает секунду, остальные - быстро
+        if self.replay:
+            return []
+        slow_profile = replace(self.upstream.profile, latency=1.0, jitter=0)
+        iterations = 3 if self.quick else 10
+        fast = self.upstream.api_urls()
+        results = []
+        with FakeUpstream(slow_profile) as slow:
+            slow_cbr = slow.api_urls()["cbr_url"]
+            clients = {
+                "rate_single_provider": APIClient(
+                    rate_providers=[CBRJsonProvider(slow_cbr)]
+                ),
+                "rate_chain_first": APIClient(**{**fast, "cbr_url": slow_cbr}),
+                "rate_chain_quorum": APIClient(
+                    **{**fast, "cbr_url": slow_cbr}, rate_mode="quorum"
+                ),
+            }
+            for name, client in clients.items():
+                samples = timed(client.get_exchange_rate, iterations)
+                stats = client.rate_chain.export_stats()
+                client.close()
+                results.append(
+                    summarize(
+                        name,
+                        samples,
+                        wins={
+                            provider: item["wins"]
+                            for provider, item in stats.items()
+                        },
+                    )
+                )
+        return results
+
+    def hedged_steam(self) -> list[dict]:
+        # Отдельный сервер с медленным хвостом: без него повторам
+        # нечего срезать. С архивом сравнение не имеет смысла
+        if self.replay:
+            return []
+        profile = replace(
+            self.upstream.profile,
+            tail_rate=self.upstream.profile.tail_rate or 0.05,
+            tail_latency=min(self.upstream.profile.tail_latency, 1.0),
+        )
+        workers = 16
+        lookups = 200 if self.quick else 1000
+        amounts = [float(100 + i % 100) for i in range(lookups)]
+        results = []
+        with FakeUpstream(profile) as upstream:
+            for hedged in (False, True):
+                hedger = RequestHedger() if hedged else None
+                client = APIClient(**upstream.api_urls(), hedger=hedger)
+                before = hedge_counts()
+                sent = upstream.requests
+                samples = []
+                fallbacks = 0
+
+                def lookup(amount: float):
+                    nonlocal fallbacks
+                    start = time.perf_counter()
+                    if (
+                        client.get_steam_amount(amount, check_network=False)
+                        is None
+                    ):
+                        fallbacks += 1
+                    samples.append(time.perf_counter() - start)
+
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    list(pool.map(lookup, amounts))
+                if hedger:
+                    hedger.close()
+                client.transport.close()
+                after = hedge_counts()
+                results.append(
+                    summarize(
+                        "hedged_steam" if hedged else "unhedged_steam",
+                        samples,
+                        workers=workers,
+                        tail_rate=profile.tail_rate,
+                        upstream_requests=upstream.requests - sent,
+                        hedges_won=after["won"] - before["won"],
+                        hedges_lost=after["lost"] - before["lost"],
+                        hedges_no_budget=(
+                            after["no_budget"] - before["no_budget"]
+                        ),
+                        fallbacks=fallbacks,
+                    )
+                )
+        return results
+
+    @staticmethod
+    def _allocations(build) -> tuple[object, int, int]:
+        # Память и число блоков, которые остаются занятыми результатом
+        gc.collect()
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+        try:
+            result = build()
+            blocks = sys.getallocatedblocks() - blocks_before
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, size, blocks
+
+    def result_allocations(self) -> list[dict]:
+        core = self._core()
+        size = 10_000 if self.quick else 100_000
+        amounts = [round(10 + i * 0.37, 2) for i in range(size)]
+        steam_items = [float(100 + i % 200) for i in range(size // 10)]
+        core.convert_to_steam_batch_results(steam_items)
+
+        paths = (
+            (
+                "convert_currency",
+                lambda: [core.convert_currency(a) for a in amounts],
+                lambda: [core.convert_currency_result(a) for a in amounts],
+            ),
+            (
+                "convert_to_steam_batch",
+                lambda: core.convert_to_steam_batch(steam_items),
+                lambda: core.convert_to_steam_batch_results(steam_items),
+            ),
+        )
+        results = []
+        for name, build_dicts, build_tuples in paths:
+            dicts, dict_bytes, dict_blocks = self._allocations(build_dicts)
+            tuples, tuple_bytes, tuple_blocks = self._allocations(build_tuples)
+            count = len(tuples)
+            for mode, build, data in (
+                ("dict", build_dicts, dicts),
+                ("tuple", build_tuples, tuples),
+            ):
+                samples = timed(build, 3)
+                results.append(
+                    summarize(
+                        f"{name}_{mode}",
+                        samples,
+                        size=count,
+                        bytes_per_result=round(
+                            (dict_bytes if mode == "dict" else tuple_bytes)
+                            / count,
+                            1,
+                        ),
+                        blocks_per_result=round(
+                            (dict_blocks if mode == "dict" else tuple_blocks)
+                            / count,
+                            2,
+                        ),
+                    )
+                )
+
+            serializers = (
+                (
+                    "json_dumps",
+                    lambda: json.dumps(dicts, ensure_ascii=False).encode(),
+                ),
+                ("json_bytes", lambda: results_to_json_bytes(tuples)),
+                ("csv_dictwriter", lambda: self._dict_csv(dicts)),
+                ("csv_bytes", lambda: results_to_csv_bytes(tuples)),
+            )
+            for serializer, serialize in serializers:
+                tracemalloc.start()
+                try:
+                    serialize()
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                results.append(
+                    summarize(
+                        f"{name}_{serializer}",
+                        timed(serialize, 3),
+                        size=count,
+                        peak_bytes=peak,
+                    )
+                )
+        return results
+
+    @staticmethod
+    def _dict_csv(rows: list[dict]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(
+            buffer,
+            fieldnames=list(dict.fromkeys(k for row in rows for k in row)),
+            lineterminator="\n",
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def steam_key_quantization(self) -> list[dict]:
+        lookups = 300 if self.quick else 2000
+        results = []
+        for mode, quanta in (("quantized", None), ("exact", {"RUB": 0})):
+            core = self._core()
+            if quanta:
+                core.steam_calculator.key_canonicalizer.quanta.update(quanta)
+            rnd = random.Random(7)
+            amounts = [round(rnd.uniform(50, 150), 2) for _ in range(lookups)]
+            hits_before = metrics.get("cache_hits_total", tier="steam")
+            samples = timed(
+                lambda: core.convert_to_steam(amounts.pop(), from_uah=True),
+                lookups,
+            )
+            hits = metrics.get("cache_hits_total", tier="steam") - hits_before
+            stats = core.steam_calculator.key_canonicalizer.stats()
+            results.append(
+                summarize(
+                    f"steam_uah_lookups_{mode}",
+                    samples,
+                    hit_ratio=round(hits / lookups, 4),
+                    mean_abs_error=round(stats["mean_abs_error"], 4),
+                    max_abs_error=stats["max_abs_error"],
+                )
+            )
+        return results
+
+    def shared_cache(self) -> list[dict]:
+        # Несколько узлов за балансировщиком считают одни и те же суммы:
+        # с общим кэшем каждую котировку запрашивает один узел
+        if self.replay:
+            return []
+        nodes = 4
+        amounts = [float(a) for a in range(200, 250 if self.quick else 400)]
+        results = []
+
+        def convert(core: CurrencyConverterCore) -> float:
+            return timed(lambda: core.convert_to_steam_batch(amounts), 1)[0]
+
+        for mode in ("local", "shared"):
+            with RESPServer() as server:
+                cores = [
+                    CurrencyConverterCore(
+                        api_client=self.upstream.make_api_client(),
+                        cache_file=self._cache_file(),
+                        remote_cache=(
+                            RemoteCache.from_url(server.url)
+                            if mode == "shared"
+                            else None
+                        ),
+                    )
+                    for _ in range(nodes)
+                ]
+                requests_before = self.upstream.requests
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=nodes) as pool:
+                    list(pool.map(lambda core: core.initialize(), cores))
+                    samples = list(pool.map(convert, cores))
+                wall = time.perf_counter() - start
+                results.append(
+                    summarize(
+                        f"cluster_steam_{mode}",
+                        samples,
+                        nodes=nodes,
+                        amounts=len(amounts),
+                        wall_s=round(wall, 4),
+                        upstream_requests=(
+                            self.upstream.requests - requests_before
+                        ),
+                    )
+                )
+                for core in cores:
+                    core.close()
+        return results
+
+    def _bundle_file(self, days: int) -> str:
+        path = os.path.join(self.workdir, f"bundle_{days}.bin")
+        day_numbers = array('i', range(700_000, 700_000 + days))
+        series = {
+            code: (
+                day_numbers,
+                array('d', (90.0 + i % 7 for i in range(days))),
+            )
+            for code in ("UAH", "USD", "EUR", "KZT", "CNY")
+        }
+        curves = {
+            currency: (
+                array('d', (pay for pay, _ in curve)),
+                array('d', (get for _, get in curve)),
+            )
+            for currency, curve in SteamCalculator.FALLBACK_CURVES.items()
+        }
+        OfflineBundle.write(path, 2.2, {"UAH": 2.2}, series, curves, curves)
+        return path
+
+    def offline_bundle(self) -> list[dict]:
+        # Открытие пакета читает только заголовок, поэтому не зависит от
+        # объема истории, а полная проверка суммы растет вместе с ним
+        results = []
+        for days in (365, 3650) if self.quick else (365, 3650, 36500):
+            path = self._bundle_file(days)
+
+            def first_quote():
+                bundle = OfflineBundle.open(path)
+                bundle.fallback_quote(777.0, "RUB")
+                bundle.close()
+
+            def verify():
+                with OfflineBundle.open(path) as bundle:
+                    bundle.verify()
+
+            size = os.path.getsize(path)
+            results.append(
+                summarize(
+                    "bundle_open_first_quote",
+                    timed(first_quote, 200),
+                    history_days=days,
+                    bytes=size,
+                )
+            )
+            results.append(
+                summarize(
+                    "bundle_verify",
+                    timed(verify, 20),
+                    history_days=days,
+                    bytes=size,
+                )
+            )
+        return results
+
+    def steam_split(self) -> list[dict]:
+        # Первый расчет уточняет разбиение живыми котировками, повторный
+        # берет их из кэша и сводится к динамическому программированию
+        results = []
+        core = self._core()
+        optimizer = SplitOptimizer(core)
+        for amount in (1000.0, 15000.0, 100000.0):
+            first = optimizer.optimize(amount)
+            results.append(
+                summarize(
+                    "steam_split",
+                    timed(lambda: optimizer.optimize(amount), 20),
+                    amount=amount,
+                    payments=len(first.payments),
+                    saving=first.saving,
+                    first_ms=first.elapsed_ms,
+                    upstream_calls=first.upstream_calls,
+                )
+            )
+        core.api_client.close()
+        return results
+
+    BENCHMARKS = (
+        "cold_start",
+        "single_conversion",
+        "batch_conversion",
+        "cache_scaling",
+        "concurrent_steam",
+        "async_steam",
+        "rate_failover",
+        "hedged_steam",
+        "result_allocations",
+        "steam_key_quantization",
+        "offline_bundle",
+        "shared_cache",
+        "steam_split",
+    )
+
+    def run(self, only: list[str] | None = None) -> list[dict]:
+        results = []
+        for name in self.BENCHMARKS:
+            if only and name not in only:
+                continue
+            print(f"⏱ {name}...", file=sys.stderr)
+            results.extend(getattr(self, name)())
+        return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарки конвертера с локальной заменой API",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--tail-rate', type=float, default=0.0)
+    parser.add_argument('--tail-latency', type=float, default=1.5)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--only', default=None)
+    parser.add_argument('--replay', default=None)
+    parser.add_argument('--replay-speed', type=float, default=0.0)
+    parser.add_argument('-o', '--output', default=None)
+    args = parser.parse_args()
+
+    logging.getLogger("core").setLevel(logging.CRITICAL)
+    logging.getLogger("urllib3").setLevel(logging.CRITICAL)
+    profile = UpstreamProfile(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+    )
+    only = args.only.split(',') if args.only else None
+    replay = (
+        ReplayTransport(args.replay, speed=args.replay_speed)
+        if args.replay
+        else None
+    )
+
+    with (
+        FakeUpstream(profile) as upstream,
+        tempfile.TemporaryDirectory() as workdir,
+    ):
+        port = upstream.server.server_address[1]
+        NetworkChecker.PROBE_HOSTS = [("127.0.0.1", port)]
+        metrics.reset()
+        results = BenchmarkSuite(upstream, workdir, args.quick, replay).run(
+            only
+        )
+        upstream_requests = upstream.requests
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "upstream": {**asdict(profile), "requests": upstream_requests},
+        "results": results,
+        "hit_ratio": metrics.snapshot()["hit_ratio"],
+    }
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
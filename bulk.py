@@ -0,0 +1,380 @@
+"""
+Пакетная конвертация больших файлов с ценами
+Использование:
+    python bulk.py входной_файл -o выходной_файл [флаги]
+
+Файл читается через mmap и делится на блоки по границам строк, блоки
+конвертируются параллельно в нескольких процессах с одним замороженным
+курсом. Результат пишется в исходном порядке, в памяти одновременно
+находится не больше нескольких блоков на процесс. К каждой строке
+добавляются колонки с результатом конвертации.
+
+Флаги:
+    -o, --output путь      Выходной файл (обязательно)
+    --column номер         Номер колонки с суммой, с нуля (по умолчанию 0)
+    --delimiter символ     Разделитель колонок (по умолчанию ,)
+    --header               Первая строка - заголовок
+    -r, --reverse          Конвертация из рублей в гривны
+    -s, --steam            Добавить колонки Steam пополнения
+    -sr, --steamreverse    Steam колонки для сумм в гривнах
+    -c, --currency код     Валюта кошелька Steam (по умолчанию RUB)
+    -w, --workers число    Количество процессов (по умолчанию по числу ядер)
+    --chunk-size МБ        Размер блока (по умолчанию 16)
+    -m, --manual-rate курс Использовать указанный курс вместо API
+
+Примеры:
+    python bulk.py prices.csv -o prices_rub.csv --column 2 --header
+    python bulk.py prices.csv -o steam.csv -s --workers 8
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+from core import (
+    CurrencyConverterCore,
+    SteamCalculator,
+    format_number,
+    metrics,
+    tracer,
+)
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ConversionSnapshot:
+    # Все, что нужно процессу для конвертации блока без обращения к ядру
+    rate: float
+    reverse: bool = False
+    column: int = 0
+    delimiter: bytes = b","
+    header: bool = False
+    steam: bool = False
+    steam_currency: str = "RUB"
+    from_uah: bool = False
+    quotes: dict[float, float] = field(default_factory=dict)
+
+    def header_columns(self) -> list[bytes]:
+        columns = [b"UAH" if self.reverse else b"RUB"]
+        if self.steam:
+            code = self.steam_currency.encode('ascii')
+            columns += [b"steam_" + code, b"commission_" + code]
+        return columns
+
+
+_worker_snapshot: Optional[ConversionSnapshot] = None
+
+
+def _init_worker(snapshot: ConversionSnapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _read_chunk(path: str, start: int, end: int) -> bytes:
+    with (
+        open(path, 'rb') as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+    ):
+        return mm[start:end]
+
+
+def _parse_amount(line: bytes, snapshot: ConversionSnapshot) -> float:
+    value = line.split(snapshot.delimiter)[snapshot.column].strip()
+    if snapshot.delimiter != b",":
+        value = value.replace(b",", b".")
+    return float(value)
+
+
+def _chunk_lines(data: bytes, start: int, snapshot: ConversionSnapshot):
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    first = 1 if snapshot.header and start == 0 else 0
+    return lines, first
+
+
+def _format(value: float) -> bytes:
+    return repr(format_number(value)).encode('ascii')
+
+
+def scan_chunk(path: str, start: int, end: int) -> set[float]:
+    # Первый проход: уникальные суммы для запроса котировок Steam
+    snapshot = _worker_snapshot
+    lines, first = _chunk_lines(_read_chunk(path, start, end), start, snapshot)
+    amounts = set()
+    for line in lines[first:]:
+        try:
+            amount = _parse_amount(line, snapshot)
+        except (ValueError, IndexError):
+            continue
+        if amount > 0:
+            amounts.add(
+                CurrencyConverterCore.steam_pay_amount(
+                    amount,
+                    snapshot.rate,
+                    snapshot.from_uah,
+                    snapshot.steam_currency,
+                )
+            )
+    return amounts
+
+
+def convert_chunk(path: str, start: int, end: int) -> tuple[bytes, int, int]:
+    snapshot = _worker_snapshot
+    lines, first = _chunk_lines(_read_chunk(path, start, end), start, snapshot)
+    delimiter = snapshot.delimiter
+    empty_columns = delimiter * len(snapshot.header_columns())
+    out = []
+    rows = errors = 0
+    if first:
+        header = lines[0].rstrip(b"\r")
+        out.append(
+            delimiter.join([header, *snapshot.header_columns()]) + b"\n"
+        )
+    for line in lines[first:]:
+        line = line.rstrip(b"\r")
+        if not line.strip():
+            out.append(line + b"\n")
+            continue
+        rows += 1
+        try:
+            amount = _parse_amount(line, snapshot)
+            if amount <= 0:
+                raise ValueError(amount)
+        except (ValueError, IndexError):
+            errors += 1
+            out.append(line + empty_columns + b"\n")
+            continue
+
+        parts = [
+            line,
+            _format(
+                CurrencyConverterCore.convert_amount(
+                    amount, snapshot.rate, snapshot.reverse
+                )
+            ),
+        ]
+        if snapshot.steam:
+            pay_amount = CurrencyConverterCore.steam_pay_amount(
+                amount,
+                snapshot.rate,
+                snapshot.from_uah,
+                snapshot.steam_currency,
+            )
+            data = SteamCalculator.build_commission(
+                pay_amount,
+                snapshot.quotes[pay_amount],
+                snapshot.steam_currency,
+            )
+            parts += [_format(data.result), _format(data.commission_amount)]
+        out.append(delimiter.join(parts) + b"\n")
+    return b"".join(out), rows, errors
+
+
+def split_chunks(path: str, chunk_size: int) -> list[tuple[int, int]]:
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    chunks = []
+    with (
+        open(path, 'rb') as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+    ):
+        start = 0
+        while start < size:
+            end = mm.find(b"\n", min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+class BulkConverter:
+    def __init__(
+        self,
+        converter: CurrencyConverterCore,
+        workers: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self.converter = converter
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    @tracer.traced("bulk.convert_file")
+    def convert_file(
+        self,
+        input_path: str,
+        output_path: str,
+        column: int = 0,
+        delimiter: str = ",",
+        header: bool = False,
+        reverse: bool = False,
+        steam: bool = False,
+        steam_currency: str = "RUB",
+        from_uah: bool = False,
+    ) -> dict:
+        if not self.converter.current_rate:
+            raise ValueError("Курс валют недоступен")
+        error = CurrencyConverterCore.steam_wallet_error(
+            steam_currency, from_uah
+        )
+        if steam and error is not None:
+            raise ValueError(error.error)
+
+        start_time = time.perf_counter()
+        snapshot = ConversionSnapshot(
+            rate=self.converter.current_rate,
+            reverse=reverse,
+            column=column,
+            delimiter=delimiter.encode('utf-8'),
+            header=header,
+            steam=steam,
+            steam_currency=steam_currency,
+            from_uah=from_uah,
+        )
+        chunks = split_chunks(input_path, self.chunk_size)
+        parallel = self.workers > 1 and len(chunks) > 1
+
+        unique_amounts = 0
+        if steam:
+            amounts = set()
+            for found in self._map(scan_chunk, input_path, chunks, snapshot):
+                amounts.update(found)
+            unique_amounts = len(amounts)
+            snapshot = replace(snapshot, quotes=self._quote(amounts, snapshot))
+
+        rows = errors = 0
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, 'wb') as out:
+            for data, chunk_rows, chunk_errors in self._map(
+                convert_chunk, input_path, chunks, snapshot
+            ):
+                out.write(data)
+                rows += chunk_rows
+                errors += chunk_errors
+        os.replace(tmp_path, output_path)
+
+        metrics.inc("bulk_rows_total", rows, result="ok")
+        metrics.inc("bulk_rows_total", errors, result="error")
+        return {
+            "rows": rows,
+            "errors": errors,
+            "chunks": len(chunks),
+            "workers": self.workers if parallel else 1,
+            "unique_steam_amounts": unique_amounts,
+            "rate": snapshot.rate,
+            "seconds": round(time.perf_counter() - start_time, 3),
+        }
+
+    def _quote(
+        self, amounts: set[float], snapshot: ConversionSnapshot
+    ) -> dict[float, float]:
+        # Одна дедуплицированная выборка котировок на весь файл
+        currency = snapshot.steam_currency
+        quotes = self.converter.steam_calculator.quote_many(
+            [(amount, currency) for amount in amounts],
+            self.converter._is_effectively_online(),
+        )
+        return {amount: quote for (amount, _), quote in quotes.items()}
+
+    def _map(self, fn, path: str, chunks: list, snapshot: ConversionSnapshot):
+        if self.workers <= 1 or len(chunks) <= 1:
+            _init_worker(snapshot)
+            for start, end in chunks:
+                yield fn(path, start, end)
+            return
+
+        # Окно задач ограничивает память: результаты выдаются по порядку,
+        # новый блок отправляется только после выдачи самого старого
+        window = self.workers * 2
+        pending: deque[Future] = deque()
+        queue = iter(chunks)
+        with ProcessPoolExecutor(
+            max_workers=min(self.workers, len(chunks)),
+            initializer=_init_worker,
+            initargs=(snapshot,),
+        ) as pool:
+            for start, end in itertools.islice(queue, window):
+                pending.append(pool.submit(fn, path, start, end))
+            while pending:
+                result = pending.popleft().result()
+                for start, end in itertools.islice(queue, 1):
+                    pending.append(pool.submit(fn, path, start, end))
+                yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Пакетная конвертация файлов с ценами",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument('input')
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument('--column', type=int, default=0)
+    parser.add_argument('--delimiter', default=",")
+    parser.add_argument('--header', action='store_true')
+    parser.add_argument('-r', '--reverse', action='store_true')
+    parser.add_argument('-s', '--steam', action='store_true')
+    parser.add_argument('-sr', '--steamreverse', action='store_true')
+    parser.add_argument(
+        '-c',
+        '--currency',
+        default="RUB",
+        choices=sorted(SteamCalculator.FALLBACK_CURVES),
+    )
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=float, default=16)
+    parser.add_argument('-m', '--manual-rate', type=float, default=None)
+    args = parser.parse_args()
+
+    converter = CurrencyConverterCore()
+    if args.manual_rate:
+        converter.set_manual_rate(args.manual_rate)
+    else:
+        converter.initialize()
+
+    bulk = BulkConverter(
+        converter,
+        workers=args.workers,
+        chunk_size=max(1, int(args.chunk_size * 1024 * 1024)),
+    )
+    try:
+        stats = bulk.convert_file(
+            args.input,
+            args.output,
+            column=args.column,
+            delimiter=args.delimiter,
+            header=args.header,
+            reverse=args.reverse,
+            steam=args.steam or args.steamreverse,
+            steam_currency=args.currency,
+            from_uah=args.steamreverse,
+        )
+    except (OSError, ValueError) as e:
+        print(f"❌ Ошибка: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(
+        f"✅ Строк: {stats['rows']} | Ошибок: {stats['errors']} | "
+        f"Блоков: {stats['chunks']} | Процессов: {stats['workers']} | "
+        f"Курс: {stats['rate']} | {stats['seconds']} с",
+        file=sys.stderr,
+    )
+    if stats['unique_steam_amounts']:
+        print(
+            f"🎮 Уникальных сумм Steam: {stats['unique_steam_amounts']}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from core import CurrencyConverterCore, SteamCalculator, metrics, tracer
+
+logger = logging.getLogger(__name__)
+
+# Точка встроенной кривой заменяется живой котировкой, если та ближе
+# этой доли суммы
+CURVE_TOLERANCE = 0.1
+
+
+class OfflineBundle:
+    # Переносимый снимок для хостов без сети: курс, матрица курсов ЦБ,
+    # недавняя история, свежие котировки Steam и откалиброванная по ним
+    # кривая комиссий. При открытии читается только заголовок, разделы
+    # отображаются через mmap и разбираются при первом обращении
+    MAGIC = b"CCOB"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHdd32s")
+    SECTION = struct.Struct("<8sQQ")
+    SERIES_HEADER = struct.Struct("<8sI")
+    COUNT = struct.Struct("<I")
+    SECTIONS = ("rates", "history", "quotes", "curves")
+    # Котировка соседней суммы используется, если отличается не больше
+    QUOTE_TOLERANCE = 0.01
+    CURVE_POINTS = 64
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+        self.created_at = 0.0
+        self.rate = 0.0
+        self.checksum = b""
+        self._sections: dict[str, tuple[int, int]] = {}
+        self._parsed: dict[str, dict] = {}
+        self._curves: dict[str, list[tuple[float, float]]] = {}
+        self._views: list[memoryview] = []
+
+    @classmethod
+    @tracer.traced("bundle.open")
+    def open(cls, path: str) -> Optional["OfflineBundle"]:
+        if not os.path.exists(path):
+            return None
+        bundle = cls(path)
+        try:
+            bundle._map()
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Ошибка загрузки офлайн-пакета {path}: {e}")
+            metrics.inc("bundle_loads_total", result="error")
+            bundle.close()
+            return None
+        metrics.inc("bundle_loads_total", result="ok")
+        return bundle
+
+    def _map(self):
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, created_at, rate, checksum = (
+            self.HEADER.unpack_from(self._mm, 0)
+        )
+        if magic != self.MAGIC:
+            raise ValueError("не является офлайн-пакетом")
+        if version != self.VERSION:
+            raise ValueError(f"неподдерживаемая версия {version}")
+        self.created_at, self.rate, self.checksum = created_at, rate, checksum
+        offset = self.HEADER.size
+        for _ in range(count):
+            raw_name, start, length = self.SECTION.unpack_from(
+                self._mm, offset
+            )
+            offset += self.SECTION.size
+            if start + length > len(self._mm):
+                raise ValueError("пакет обрезан")
+            self._sections[raw_name.rstrip(b"\0").decode('ascii')] = (
+                start,
+                length,
+            )
+
+    def verify(self) -> bool:
+        # Полная проверка читает весь файл, поэтому выполняется при
+        # импорте, а не при каждом запуске
+        digest = hashlib.sha256(self._mm[self.HEADER.size :]).digest()
+        return digest == self.checksum
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._parsed.clear()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _view(self, start: int, length: int, fmt: str) -> memoryview:
+        view = memoryview(self._mm)[start : start + length].cast(fmt)
+        self._views.append(view)
+        return view
+
+    def _series(self, name: str, key_format: str) -> dict:
+        # Разбирается только оглавление раздела, массивы остаются в mmap
+        parsed = self._parsed.get(name)
+        if parsed is not None:
+            return parsed
+        parsed = {}
+        if name in self._sections:
+            offset, _ = self._sections[name]
+            (count,) = self.COUNT.unpack_from(self._mm, offset)
+            offset += self.COUNT.size
+            key_size = struct.calcsize(key_format)
+            for _ in range(count):
+                raw_code, rows = self.SERIES_HEADER.unpack_from(
+                    self._mm, offset
+                )
+                offset += self.SERIES_HEADER.size
+                keys = self._view(offset, rows * key_size, key_format)
+                offset += rows * key_size
+                values = self._view(offset, rows * 8, 'd')
+                offset += rows * 8
+                parsed[raw_code.rstrip(b"\0").decode('ascii')] = (keys, values)
+        self._parsed[name] = parsed
+        return parsed
+
+    def rates(self) -> dict[str, float]:
+        series = self._series("rates", 'd')
+        return {code: values[0] for code, (_, values) in series.items()}
+
+    def history_rate(
+        self, currency: str, day: date
+    ) -> Optional[tuple[date, float]]:
+        series = self._series("history", 'i').get(currency)
+        if series is None:
+            return None
+        days, values = series
+        index = bisect_left(days, day.toordinal() + 1) - 1
+        if index < 0:
+            return None
+        return date.fromordinal(days[index]), values[index]
+
+    def curve(self, currency: str) -> Optional[list[tuple[float, float]]]:
+        curve = self._curves.get(currency)
+        if curve is None:
+            series = self._series("curves", 'd').get(currency)
+            if series is None:
+                return None
+            curve = self._curves[currency] = list(zip(*series))
+        return curve
+
+    def fallback_quote(self, amount: float, currency: str) -> Optional[float]:
+        series = self._series("quotes", 'd').get(currency)
+        if series is not None:
+            amounts, quotes = series
+            index = bisect_left(amounts, amount)
+            for near in (index - 1, index):
+                if 0 <= near < len(amounts):
+                    quoted = amounts[near]
+                    if abs(quoted - amount) <= amount * self.QUOTE_TOLERANCE:
+                        return quotes[near] * amount / quoted
+        curve = self.curve(currency)
+        if not curve:
+            return None
+        return SteamCalculator.interpolate(
+            curve, amount, SteamCalculator.RESULT_PRECISION.get(currency, 0)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(
+                timespec='seconds'
+            ),
+            "rate": self.rate,
+            "sections": {
+                name: length for name, (_, length) in self._sections.items()
+            },
+        }
+
+    @classmethod
+    def write(
+        cls,
+        path: str,
+        rate: float,
+        rates: dict[str, float],
+        history: dict[str, tuple[array, array]],
+        quotes: dict[str, tuple[array, array]],
+        curves: dict[str, tuple[array, array]],
+        created_at: Optional[float] = None,
+    ) -> int:
+        payloads = {
+            "rates": cls._pack_series(
+                {
+                    code: (array('d', [0.0]), array('d', [value]))
+                    for code, value in rates.items()
+                }
+            ),
+            "history": cls._pack_series(history),
+            "quotes": cls._pack_series(quotes),
+            "curves": cls._pack_series(curves),
+        }
+        table_size = cls.SECTION.size * len(payloads)
+        offset = cls.HEADER.size + table_size
+        table = []
+        for name, payload in payloads.items():
+            table.append(
+                cls.SECTION.pack(name.encode('ascii'), offset, len(payload))
+            )
+            offset += len(payload)
+        body = b"".join(table) + b"".join(payloads.values())
+        header = cls.HEADER.pack(
+            cls.MAGIC,
+            cls.VERSION,
+            len(payloads),
+            created_at or time.time(),
+            rate,
+            hashlib.sha256(body).digest(),
+        )
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(body)
+        os.replace(tmp_path, path)
+        return len(header) + len(body)
+
+    @classmethod
+    def _pack_series(cls, series: dict[str, tuple[array, array]]) -> bytes:
+        chunks = [cls.COUNT.pack(len(series))]
+        for code, (keys, values) in sorted(series.items()):
+            chunks.append(
+                cls.SERIES_HEADER.pack(code.encode('ascii'), len(keys))
+            )
+            chunks.append(keys.tobytes())
+            chunks.append(values.tobytes())
+        return b"".join(chunks)
+
+
+def fresh_quotes(
+    converter: CurrencyConverterCore,
+) -> dict[str, tuple[array, array]]:
+    points = converter.cache_manager.fresh_steam_amounts()
+    return {
+        currency: (
+            array('d', sorted(by_amount)),
+            array('d', (by_amount[a] for a in sorted(by_amount))),
+        )
+        for currency, by_amount in points.items()
+    }
+
+
+def calibrate_curve(
+    currency: str, quotes: Optional[tuple[array, array]], points: int
+) -> tuple[array, array]:
+    # Живые котировки (не больше points опорных точек) заменяют точки
+    # встроенной кривой рядом с собой. Остальные точки встроенной кривой
+    # сохраняют ее форму между редкими котировками, а внутри их диапазона
+    # масштабируются к уровню соседних котировок
+    builtin = SteamCalculator.FALLBACK_CURVES[currency]
+    if not quotes or not quotes[0]:
+        return array('d', (p for p, _ in builtin)), array(
+            'd', (g for _, g in builtin)
+        )
+    amounts, values = quotes
+    step = max(1, len(amounts) // points)
+    chosen = list(range(0, len(amounts), step))
+    if chosen[-1] != len(amounts) - 1:
+        chosen.append(len(amounts) - 1)
+    curve = {amounts[i]: values[i] for i in chosen}
+    live = sorted(curve)
+    digits = SteamCalculator.RESULT_PRECISION.get(currency, 0)
+    # Отношение живой котировки к встроенной кривой в каждой опорной точке
+    ratios = [
+        curve[a] / (SteamCalculator.interpolate(builtin, a, digits) or 1)
+        for a in live
+    ]
+    for pay, get in builtin:
+        index = bisect_left(live, pay)
+        near = [live[i] for i in (index - 1, index) if 0 <= i < len(live)]
+        if any(abs(a - pay) <= pay * CURVE_TOLERANCE for a in near):
+            continue
+        if 0 < index < len(live):
+            low, high = live[index - 1], live[index]
+            share = (pay - low) / (high - low)
+            ratio = ratios[index - 1] + share * (
+                ratios[index] - ratios[index - 1]
+            )
+            curve[pay] = get * ratio
+        else:
+            curve[pay] = get
+    ordered = sorted(curve)
+    return array('d', ordered), array('d', (curve[p] for p in ordered))
+
+
+@tracer.traced("bundle.export")
+def export_bundle(
+    converter: CurrencyConverterCore,
+    path: str,
+    history_days: int = 90,
+    refresh_quotes: bool = True,
+) -> dict:
+    if not converter.current_rate or converter.rate_source == "default":
+        raise ValueError(
+            f"Нет актуального курса для экспорта ({converter.rate_source})"
+        )
+    online = converter._is_effectively_online()
+    if refresh_quotes and online:
+        # Живые котировки в опорных точках встроенной кривой для калибровки
+        converter.steam_calculator.quote_many(
+            [
+                (float(pay), currency)
+                for currency, curve in SteamCalculator.FALLBACK_CURVES.items()
+                for pay, _ in curve
+            ],
+            online,
+        )
+
+    rates = {}
+    history = {}
+    if os.path.exists(converter.history_file):
+        since = date.today() - timedelta(days=history_days)
+        history = converter.history.series_since(since)
+        rates = {code: values[-1] for code, (_, values) in history.items()}
+    live = converter.api_client.get_rates() if online else None
+    rates.update(live or {})
+    rates["UAH"] = converter.current_rate
+
+    quotes = fresh_quotes(converter)
+    curves = {
+        currency: calibrate_curve(
+            currency, quotes.get(currency), OfflineBundle.CURVE_POINTS
+        )
+        for currency in SteamCalculator.FALLBACK_CURVES
+    }
+    size = OfflineBundle.write(
+        path, converter.current_rate, rates, history, quotes, curves
+    )
+    metrics.inc("bundle_exports_total")
+    return {
+        "path": path,
+        "bytes": size,
+        "rate": converter.current_rate,
+        "rate_source": converter.rate_source,
+        "currencies": len(rates),
+        "history_rows": sum(len(days) for days, _ in history.values()),
+        "quotes": sum(len(amounts) for amounts, _ in quotes.values()),
+        "calibrated": sorted(quotes),
+    }
+
+
+@tracer.traced("bundle.import")
+def import_bundle(converter: CurrencyConverterCore, source: str) -> dict:
+    bundle = OfflineBundle.open(source)
+    if bundle is None:
+        raise ValueError(f"Не удалось открыть пакет {source}")
+    with bundle:
+        if not bundle.verify():
+            metrics.inc("bundle_imports_total", result="checksum")
+            raise ValueError("Контрольная сумма пакета не совпадает")
+        stats = bundle.stats()
+        history = bundle._series("history", 'i')
+        rows: dict[int, dict[str, float]] = {}
+        for code, (days, values) in history.items():
+            for day, value in zip(days, values):
+                rows.setdefault(day, {})[code] = value
+
+    # Пакет копируется целиком и на запуске открывается через mmap
+    target = converter.bundle_file
+    if os.path.abspath(source) != os.path.abspath(target):
+        tmp_path = f"{target}.tmp"
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+    converter.reset_bundle()
+    if rows:
+        converter.history.add_many(
+            (date.fromordinal(day), rates) for day, rates in rows.items()
+        )
+        converter.history.save()
+    metrics.inc("bundle_imports_total", result="ok")
+    return {**stats, "installed": target, "history_days": len(rows)}
@@ -10,7 +10,23 @@
     -r, --reverse        Для обычной конвертации: RUB -> UAH
     -s, --steam          Расчет для Steam (исходная валюта RUB)
     -sr, --steam-reverse Расчет для Steam (исходная валюта UAH). Включает режим Steam
+    -c, --currency код   Валюта кошелька Steam: RUB, KZT, UAH, USD (по умолчанию RUB)
+    --split [N]          Разбить пополнение Steam на платежи (до N, по умолчанию 5) с наименьшей комиссией
     -m, --manual-rate    Установить курс UAH/RUB вручную. Если курс не указан, запросит ввод
+    --stats [формат]     Показать метрики кэша и API после расчета (text, json, prometheus)
+    --stats-file путь    Сохранить метрики в файл (.json - JSON, иначе Prometheus)
+    --timings            Показать время выполнения каждой фазы (сеть, API, кэш)
+    --profile [путь]     Сохранить профиль cProfile всего запуска (по умолчанию converter.prof)
+    --as-of дата         Конвертировать по курсу ЦБ на указанную дату (ГГГГ-ММ-ДД)
+    --backfill от [до]   Загрузить архив курсов ЦБ за период в локальную историю
+    --export-bundle путь Сохранить офлайн-пакет (курсы, история, котировки Steam)
+    --import-bundle путь Установить офлайн-пакет, созданный на другом компьютере
+    --record путь        Записать ответы API и их задержки в архив
+    --replay путь        Отвечать на запросы к API из архива без обращения к сети
+    --replay-speed x     Ускорение воспроизведения (1 - исходные задержки, 0 - без задержек)
+    --hedge              Дублировать медленные запросы к plati.market (снижает хвост задержек)
+    --rate-mode режим    Выбор курса из источников: first - первый ответ, quorum - согласие двух
+    --remote-cache адрес Общий кэш узлов по протоколу Redis (redis://хост:порт/база)
     -h, --help           Показать справку
 
 Примеры:
@@ -22,6 +38,22 @@
 
     # Запустить с запросом ручного ввода курса
    .\сonverterCLI.exe 100 -m
+
+    # Конвертировать 100 UAH по курсу на 1 марта 2024 года
+    .\сonverterCLI.exe 100 --as-of 2024-03-01
+
+    # Загрузить историю курсов за 2024 год
+    .\сonverterCLI.exe --backfill 2024-01-01 2024-12-31
+
+    # Подготовить офлайн-пакет и установить его на компьютере без сети
+    .\сonverterCLI.exe --export-bundle converter.bundle
+    .\сonverterCLI.exe --import-bundle converter.bundle
+
+    # Как пополнить Steam на 5000 RUB не больше чем тремя платежами
+    .\сonverterCLI.exe 5000 -s --split 3
+
+    # Показать метрики в формате Prometheus
+    .\сonverterCLI.exe 100 -s --stats prometheus
 """
 
 WHITE = "\033[0m"
@@ -34,7 +66,23 @@ BLUE = "\033[34m"
 try:
     import sys
     import argparse
-    from core import CurrencyConverterCore
+    import cProfile
+    from datetime import date
+    from core import (
+        APIClient,
+        ConversionError,
+        CurrencyConverterCore,
+        HTTPTransport,
+        SteamCalculator,
+        RecordingTransport,
+        ReplayTransport,
+        RequestHedger,
+        metrics,
+        tracer,
+    )
+    from bundle import export_bundle, import_bundle
+    from steam_split import SplitResult, optimize_split
+    from remote_cache import RemoteCache
     import os
 except KeyboardInterrupt:
     print(f"{MAGENTA}Работа программы завершена")
@@ -72,14 +120,79 @@ def get_numeric_input(prompt: str) -> float:
 
 def format_currency_result(result: dict) -> str:
     rate_info = f"1 UAH = {round(result['rate'], 3)} RUB"
+    if 'rate_date' in result:
+        rate_info += f" на {result['rate_date']}"
     return f"{result['amount']} {result['from_currency']} = {result['result']} {result['to_currency']} ({rate_info})"
 
 
 def format_steam_result(result: dict) -> str:
-    if result['from_currency'] == 'UAH':
+    if 'rub_amount' in result:
         return f"{result['amount']} UAH ({result['rub_amount']} RUB) ⇒ {result['steam_result']} Steam RUB | Комиссия: {result['commission_amount']} RUB ({result['commission']}%)"
     else:
-        return f"{result['amount']} RUB ⇒ {result['steam_result']} Steam RUB | Комиссия: {result['commission_amount']} RUB ({result['commission']}%)"
+        currency = result['steam_currency']
+        return f"{result['amount']} {currency} ⇒ {result['steam_result']} Steam {currency} | Комиссия: {result['commission_amount']} {currency} ({result['commission']}%)"
+
+
+def format_split_result(result: SplitResult) -> str:
+    currency = result.currency
+    payments = " + ".join(str(p) for p in result.payments)
+    lines = [
+        f"{len(result.payments)} платеж(а): {payments} {currency} ⇒ "
+        f"{result.steam_result} Steam {currency} | Комиссия: "
+        f"{result.commission}%",
+        f"   Одним платежом: {result.single_result} Steam {currency}, "
+        f"выгода: {result.saving} {currency}",
+        f"   Живых котировок: {result.live_quotes}, запросов к API: "
+        f"{result.upstream_calls}, {result.elapsed_ms} мс",
+    ]
+    return "\n".join(lines)
+
+
+def format_stats_text(snapshot: dict) -> str:
+    lines = ["📊 Метрики:"]
+    for tier, ratio in snapshot['hit_ratio'].items():
+        ratio_text = f"{round(ratio * 100, 1)}%" if ratio is not None else "-"
+        lines.append(f"   Попадания в кэш [{tier}]: {ratio_text}")
+    for counter in snapshot['counters']:
+        labels = ", ".join(f"{k}={v}" for k, v in counter['labels'].items())
+        lines.append(f"   {counter['name']}{{{labels}}}: {counter['value']}")
+    for gauge in snapshot['gauges']:
+        labels = ", ".join(f"{k}={v}" for k, v in gauge['labels'].items())
+        lines.append(f"   {gauge['name']}{{{labels}}}: {gauge['value']}")
+    for hist in snapshot['histograms']:
+        labels = ", ".join(f"{k}={v}" for k, v in hist['labels'].items())
+        avg = hist['sum'] / hist['count'] if hist['count'] else 0
+        average = (
+            f"{round(avg * 1000, 1)} мс"
+            if hist['name'].endswith('_seconds')
+            else f"{round(avg, 4)}"
+        )
+        lines.append(
+            f"   {hist['name']}{{{labels}}}: {hist['count']} шт., "
+            f"среднее {average}"
+        )
+    return "\n".join(lines)
+
+
+def format_timings(breakdown: list[dict]) -> str:
+    lines = ["⏱ Время выполнения:"]
+    for entry in breakdown:
+        indent = "  " * entry['depth']
+        name = f"{indent}{entry['name']}"
+        count = f" ({entry['count']}×)" if entry['count'] > 1 else ""
+        lines.append(f"   {name:<32} {entry['total_ms']:>9.1f} мс{count}")
+    if len(lines) == 1:
+        lines.append("   Нет данных")
+    return "\n".join(lines)
+
+
+def print_stats(fmt: str) -> None:
+    if fmt == 'json':
+        print(metrics.to_json())
+    elif fmt == 'prometheus':
+        print(metrics.to_prometheus(), end="")
+    else:
+        print(f"\n{format_stats_text(metrics.snapshot())}")
 
 
 def wait_for_exit():
@@ -120,6 +233,23 @@ def main():
         action='store_true',
         help='Расчет для Steam (исходная валюта UAH). Этот флаг включает режим Steam',
     )
+    parser.add_argument(
+        '-c',
+        '--currency',
+        type=str.upper,
+        default='RUB',
+        choices=list(SteamCalculator.FALLBACK_CURVES),
+        help='Валюта кошелька Steam (по умолчанию RUB)',
+    )
+    parser.add_argument(
+        '--split',
+        nargs='?',
+        const=5,
+        default=None,
+        type=int,
+        metavar='N',
+        help='Разбить пополнение Steam на платежи (до N) с минимальной комиссией',
+    )
 
     parser.add_argument(
         '-m',
@@ -130,6 +260,96 @@ def main():
         help='Установить курс UAH/RUB вручную. Если курс не указан, запросит ввод',
     )
 
+    parser.add_argument(
+        '--stats',
+        nargs='?',
+        const='text',
+        default=None,
+        choices=['text', 'json', 'prometheus'],
+        help='Показать метрики кэша и API после расчета',
+    )
+    parser.add_argument(
+        '--stats-file',
+        default=None,
+        help='Сохранить метрики в файл (.json - JSON, иначе Prometheus)',
+    )
+
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Показать время выполнения каждой фазы',
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='converter.prof',
+        default=None,
+        help='Сохранить профиль cProfile в файл (по умолчанию converter.prof)',
+    )
+
+    parser.add_argument(
+        '--as-of',
+        type=date.fromisoformat,
+        default=None,
+        help='Конвертировать по курсу ЦБ на указанную дату (ГГГГ-ММ-ДД)',
+    )
+    parser.add_argument(
+        '--backfill',
+        nargs='+',
+        type=date.fromisoformat,
+        default=None,
+        metavar='ДАТА',
+        help='Загрузить архив курсов ЦБ за период: начало [конец]',
+    )
+    bundle_group = parser.add_mutually_exclusive_group()
+    bundle_group.add_argument(
+        '--export-bundle',
+        default=None,
+        metavar='ПУТЬ',
+        help='Сохранить офлайн-пакет для компьютера без сети',
+    )
+    bundle_group.add_argument(
+        '--import-bundle',
+        default=None,
+        metavar='ПУТЬ',
+        help='Установить офлайн-пакет, созданный на другом компьютере',
+    )
+
+    transport_group = parser.add_mutually_exclusive_group()
+    transport_group.add_argument(
+        '--record',
+        default=None,
+        help='Записать ответы API и их задержки в архив',
+    )
+    transport_group.add_argument(
+        '--replay',
+        default=None,
+        help='Отвечать на запросы к API из архива без обращения к сети',
+    )
+    parser.add_argument(
+        '--replay-speed',
+        type=float,
+        default=1.0,
+        help='Ускорение воспроизведения (1 - исходные задержки, 0 - без задержек)',
+    )
+    parser.add_argument(
+        '--rate-mode',
+        choices=['first', 'quorum'],
+        default='first',
+        help='Выбор курса из нескольких источников: первый ответ или согласие двух',
+    )
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        help='Дублировать медленные запросы к plati.market',
+    )
+    parser.add_argument(
+        '--remote-cache',
+        default=None,
+        metavar='АДРЕС',
+        help='Общий кэш узлов по протоколу Redis (redis://хост:порт/база)',
+    )
+
     parser.add_argument(
         '-h', '--help', action='store_true', help='Показать эту справку'
     )
@@ -141,8 +361,126 @@ def main():
         wait_for_exit()
         return
 
+    if args.timings:
+        tracer.enable()
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        transport = build_transport(args)
+    except (OSError, ValueError) as e:
+        print(f"{RED}❌ Ошибка чтения архива: {e}{WHITE}")
+        wait_for_exit()
+        return
+
+    try:
+        converter = build_converter(args, transport)
+    except ValueError as e:
+        print(f"{RED}❌ Некорректный адрес общего кэша: {e}{WHITE}")
+        transport.close()
+        wait_for_exit()
+        return
+
+    try:
+        run(args, converter)
+    finally:
+        # Вместе с клиентом API закрываются транспорт, пулы запросов и
+        # соединение с общим кэшем
+        converter.close()
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        report_run(args)
+
+    wait_for_exit()
+
+
+def build_transport(args: argparse.Namespace):
+    if args.record:
+        return RecordingTransport(args.record)
+    if args.replay:
+        return ReplayTransport(args.replay, speed=args.replay_speed)
+    return HTTPTransport()
+
+
+def run_backfill(converter: CurrencyConverterCore, dates: list[date]) -> None:
+    start = dates[0]
+    end = dates[-1] if len(dates) > 1 else date.today()
+    if start > end:
+        print(f"{YELLOW}❌ Начало периода позже конца{WHITE}")
+        return
+    print(f"\n📚 Загрузка истории курсов: {start} — {end}")
+    summary = converter.backfill_history(start, end)
+    print(
+        f"   Сохранено дней: {summary['stored']}, уже было: {summary['skipped']}, "
+        f"без курса: {summary['no_rate']}, ошибок: {summary['failed']}"
+    )
+    date_range = converter.history.date_range()
+    if date_range:
+        print(f"   История UAH: {date_range[0]} — {date_range[1]}")
+
+
+def run_export_bundle(converter: CurrencyConverterCore, path: str) -> None:
+    converter.initialize()
+    print(f"\n📦 Экспорт офлайн-пакета: {path}")
+    try:
+        summary = export_bundle(converter, path)
+    except (OSError, ValueError) as e:
+        print(f"{RED}❌ Ошибка экспорта: {e}{WHITE}")
+        return
+    print(
+        f"   Курс: {summary['rate']} ({summary['rate_source']}), "
+        f"валют: {summary['currencies']}, дней истории: "
+        f"{summary['history_rows']}, котировок Steam: {summary['quotes']}"
+    )
+    calibrated = ", ".join(summary['calibrated']) or "нет живых котировок"
+    print(f"   Кривая комиссий откалибрована: {calibrated}")
+    print(f"   Размер: {summary['bytes'] / 1024:.1f} КБ")
+
+
+def run_import_bundle(converter: CurrencyConverterCore, path: str) -> None:
+    print(f"\n📦 Импорт офлайн-пакета: {path}")
+    try:
+        summary = import_bundle(converter, path)
+    except (OSError, ValueError) as e:
+        print(f"{RED}❌ Ошибка импорта: {e}{WHITE}")
+        return
+    print(
+        f"   Пакет от {summary['created_at']}, курс: {summary['rate']}, "
+        f"дней истории: {summary['history_days']}"
+    )
+    print(f"   Установлен в {summary['installed']}")
+
+
+def build_converter(
+    args: argparse.Namespace, transport
+) -> CurrencyConverterCore:
+    remote_cache = None
+    if args.remote_cache:
+        remote_cache = RemoteCache.from_url(args.remote_cache)
+    return CurrencyConverterCore(
+        api_client=APIClient(
+            transport=transport,
+            hedger=RequestHedger() if args.hedge else None,
+            rate_mode=args.rate_mode,
+        ),
+        remote_cache=remote_cache,
+    )
+
+
+def run(args: argparse.Namespace, converter: CurrencyConverterCore) -> None:
     print("🔄 Инициализация конвертера...")
-    converter = CurrencyConverterCore()
+    if args.backfill:
+        run_backfill(converter, args.backfill)
+        return
+    if args.export_bundle:
+        run_export_bundle(converter, args.export_bundle)
+        return
+    if args.import_bundle:
+        run_import_bundle(converter, args.import_bundle)
+        return
     rate_was_set_manually = False
 
     if args.manual_rate is not None:
@@ -157,13 +495,11 @@ def main():
                     print(
                         f"{YELLOW}❌ Ошибка: Курс должен быть положительным числом{WHITE}"
                     )
-                    wait_for_exit()
                     return
             except ValueError:
                 print(
                     f"{RED}❌ Ошибка: {YELLOW}'{args.manual_rate}'{RED} не является корректным числом для курса{WHITE}"
                 )
-                wait_for_exit()
                 return
 
         if rate_to_set is not None:
@@ -173,7 +509,6 @@ def main():
     if not rate_was_set_manually:
         if not converter.initialize():
             print(f"{RED}❌ Ошибка инициализации конвертера{RED}")
-            wait_for_exit()
             return
 
         status = converter.get_status_info()
@@ -203,6 +538,8 @@ def main():
         details_info = " | Актуальные данные"
     elif status['rate_source'] == 'cache' and status['cache_age']:
         details_info = f" | Кэш: {status['cache_age']}"
+    elif status['rate_source'] == 'bundle' and status['bundle']:
+        details_info = f" | Офлайн-пакет от {status['bundle']['created_at']}"
     elif status['rate_source'] == 'manual':
         details_info = " | Ручной ввод"
     elif status['rate_source'] == 'default':
@@ -222,17 +559,18 @@ def main():
         )
         amount = get_numeric_input(prompt)
 
-    regular_result = converter.convert_currency(amount, reverse=args.reverse)
+    regular_result = converter.convert_currency(
+        amount, reverse=args.reverse, as_of=args.as_of
+    )
     if 'error' in regular_result:
         print(f"{RED}❌ {regular_result['error']}{WHITE}")
-        wait_for_exit()
         return
 
     print(f"💱 {format_currency_result(regular_result)}")
 
-    if args.steam or args.steam_reverse:
+    if args.steam or args.steam_reverse or args.split:
         steam_result = converter.convert_to_steam(
-            amount, from_uah=args.steam_reverse
+            amount, from_uah=args.steam_reverse, currency=args.currency
         )
         if 'error' in steam_result:
             print(
@@ -241,7 +579,30 @@ def main():
         else:
             print(f"🎮 {format_steam_result(steam_result)}")
 
-    wait_for_exit()
+    if args.split:
+        split = optimize_split(
+            converter,
+            amount,
+            currency=args.currency,
+            from_uah=args.steam_reverse,
+            max_payments=args.split,
+        )
+        if type(split) is ConversionError:
+            print(f"{RED}❌ Ошибка в расчете разбиения: {split.error}{WHITE}")
+        else:
+            print(f"🧩 {format_split_result(split)}")
+
+
+def report_run(args: argparse.Namespace) -> None:
+    if args.timings:
+        print(f"\n{format_timings(tracer.breakdown())}")
+    if args.profile:
+        print(f"\n🧪 Профиль сохранен: {args.profile}")
+    if args.stats:
+        print_stats(args.stats)
+    if args.stats_file:
+        fmt = 'json' if args.stats_file.endswith('.json') else 'prometheus'
+        metrics.dump(args.stats_file, fmt)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,44 @@
 import requests
 import urllib.parse
-from typing import Optional, Union
+from typing import (
+    Awaitable,
+    Callable,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
 import time
 import json
 import os
-from dataclasses import dataclass, asdict
-from functools import lru_cache
-from datetime import datetime
+import gzip
+import csv
+import io
+import itertools
+import heapq
+import math
+import statistics
+from dataclasses import dataclass, asdict, field
+from functools import lru_cache, wraps
+from operator import itemgetter
+from bisect import bisect_right
+from datetime import date, datetime
+from contextlib import contextmanager, nullcontext
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from xml.etree import ElementTree
+import asyncio
 import logging
 import socket
+import threading
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
@@ -36,24 +66,403 @@ class CacheEntry:
         return cls(**data)
 
 
-@dataclass
-class CommissionData:
-
-    result: int
+class CommissionData(NamedTuple):
+    result: Union[int, float]
     commission: float
     commission_amount: float
 
 
+_encode_json_string = json.encoder.encode_basestring
+
+
+def _result_to_dict(result: tuple) -> dict:
+    # Необязательные поля со значением None в словарь не попадают,
+    # так форма совпадает с прежними словарями результатов
+    return {
+        name: value
+        for name, value in zip(result._fields, result)
+        if value is not None
+    }
+
+
+_json_keys: dict[type, tuple[str, ...]] = {}
+
+
+def _result_to_json(result: tuple) -> str:
+    keys = _json_keys.get(type(result))
+    if keys is None:
+        keys = _json_keys[type(result)] = tuple(
+            f'"{name}":' for name in result._fields
+        )
+    return (
+        "{"
+        + ",".join(
+            [
+                key
+                + (
+                    _encode_json_string(value)
+                    if type(value) is str
+                    else repr(value)
+                )
+                for key, value in zip(keys, result)
+                if value is not None
+            ]
+        )
+        + "}"
+    )
+
+
+class ConversionResult(NamedTuple):
+    amount: float
+    result: float
+    from_currency: str
+    to_currency: str
+    rate: float
+    rate_date: Optional[str] = None
+
+    to_dict = _result_to_dict
+    to_json = _result_to_json
+
+
+class SteamConversionResult(NamedTuple):
+    amount: float
+    from_currency: str
+    rub_amount: Optional[float]
+    steam_result: Union[int, float]
+    steam_currency: str
+    commission: Union[int, float]
+    commission_amount: Union[int, float]
+    rate: Optional[float] = None
+
+    to_dict = _result_to_dict
+    to_json = _result_to_json
+
+
+class ConversionError(NamedTuple):
+    error: str
+
+    to_dict = _result_to_dict
+    to_json = _result_to_json
+
+
+RATE_UNAVAILABLE = ConversionError("Курс валют недоступен")
+# Кошельки, для которых известна сумма пополнения в гривнах
+UAH_STEAM_WALLETS = ("RUB", "UAH")
+
+AnyResult = Union[ConversionResult, SteamConversionResult, ConversionError]
+
+
+def results_to_json_bytes(results: Iterable[AnyResult]) -> bytes:
+    return (
+        "[" + ",".join(result.to_json() for result in results) + "]"
+    ).encode('utf-8')
+
+
+def results_to_csv_bytes(results: Iterable[AnyResult]) -> bytes:
+    # Колонки берутся из первого успешного результата, ошибки
+    # записываются в последнюю колонку error
+    results = list(results)
+    result_type = next(
+        (type(r) for r in results if type(r) is not ConversionError),
+        ConversionError,
+    )
+    columns = result_type._fields
+    if result_type is not ConversionError:
+        columns += ConversionError._fields
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    error_padding = ("",) * (len(columns) - 1)
+    result_padding = ("",) * (len(columns) - len(result_type._fields))
+    for result in results:
+        if type(result) is ConversionError:
+            writer.writerow(error_padding + result)
+        elif type(result) is result_type:
+            writer.writerow(result + result_padding)
+        else:
+            raise ValueError(
+                f"Нельзя записать {type(result).__name__} в одну таблицу "
+                f"с {result_type.__name__}"
+            )
+    return buffer.getvalue().encode('utf-8')
+
+
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class MetricsRegistry:
+    PREFIX = "converter_"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name: str, **labels) -> float:
+        return self.counters.get(self._key(name, labels), 0)
+
+    def hit_ratio(self, tier: str) -> Optional[float]:
+        hits = self.get("cache_hits_total", tier=tier)
+        total = hits + self.get("cache_misses_total", tier=tier)
+        return round(hits / total, 4) if total else None
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            gauges = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.gauges.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), **hist.to_dict()}
+                for (name, labels), hist in sorted(self.histograms.items())
+            ]
+        tiers = sorted(
+            {
+                c["labels"]["tier"]
+                for c in counters
+                if c["name"] in ("cache_hits_total", "cache_misses_total")
+            }
+        )
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+            "hit_ratio": {tier: self.hit_ratio(tier) for tier in tiers},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        def fmt_labels(labels: dict) -> str:
+            if not labels:
+                return ""
+            pairs = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            return "{" + pairs + "}"
+
+        snapshot = self.snapshot()
+        lines, declared = [], set()
+        for counter in snapshot["counters"]:
+            name = self.PREFIX + counter["name"]
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(
+                f"{name}{fmt_labels(counter['labels'])} {counter['value']}"
+            )
+        for gauge in snapshot["gauges"]:
+            name = self.PREFIX + gauge["name"]
+            if name not in declared:
+                lines.append(f"# TYPE {name} gauge")
+                declared.add(name)
+            lines.append(
+                f"{name}{fmt_labels(gauge['labels'])} {gauge['value']}"
+            )
+        for hist in snapshot["histograms"]:
+            name = self.PREFIX + hist["name"]
+            if name not in declared:
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            for bound, count in hist["buckets"].items():
+                labels = {**hist["labels"], "le": bound}
+                lines.append(f"{name}_bucket{fmt_labels(labels)} {count}")
+            labels = fmt_labels(hist["labels"])
+            lines.append(f"{name}_sum{labels} {hist['sum']}")
+            lines.append(f"{name}_count{labels} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str, fmt: str = "prometheus"):
+        payload = self.to_json() if fmt == "json" else self.to_prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+
+metrics = MetricsRegistry()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.spans: list[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name: str):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+        path = "/".join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                self.spans.append(
+                    {
+                        "path": path,
+                        "depth": len(stack),
+                        "start": start,
+                        "duration": duration,
+                        "thread": threading.current_thread().name,
+                    }
+                )
+
+    def traced(self, name: str):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self._span(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def breakdown(self) -> list[dict]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        totals: dict[str, dict] = {}
+        for span in spans:
+            entry = totals.setdefault(
+                span["path"],
+                {
+                    "path": span["path"],
+                    "name": span["path"].rsplit("/", 1)[-1],
+                    "depth": span["depth"],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                },
+            )
+            duration_ms = span["duration"] * 1000
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+        first_start = {}
+        for span in spans:
+            first_start.setdefault(span["path"], span["start"])
+
+        # Фазы в порядке запуска, дочерние сразу после родительской
+        def order(entry: dict) -> list:
+            parts = entry["path"].split("/")
+            return [
+                first_start.get("/".join(parts[: i + 1]), 0)
+                for i in range(len(parts))
+            ]
+
+        return sorted(totals.values(), key=order)
+
+
+tracer = Tracer()
+
+
 class PersistentCache:
+    VERSION = 2
+    # Разделы хранятся в отдельных файлах рядом с основным и читаются
+    # только при первом обращении, основной файл содержит лишь курс
+    SECTIONS = ("steam_rates",)
 
     def __init__(self, cache_file="currency_cache.json"):
         self.cache_file = cache_file
         self.default_data = {
             "exchange_rate": {"value": 2, "timestamp": 0},
-            "steam_rates": {},
             "last_update": None,
         }
 
+    def section_path(self, name: str) -> str:
+        root, ext = os.path.splitext(self.cache_file)
+        return f"{root}.{name}{ext or '.json'}"
+
+    @tracer.traced("cache.load")
     def load_cache(self) -> dict:
         try:
             if os.path.exists(self.cache_file):
@@ -61,31 +470,95 @@ class PersistentCache:
                     data = json.load(f)
                     if self._validate_cache_structure(data):
                         logger.info("Кэш успешно загружен из файла")
+                        metrics.inc(
+                            "cache_loads_total", section="rate", result="ok"
+                        )
                         return data
                     else:
                         logger.warning(
                             "Некорректная структура кэша, используем значения по умолчанию"
                         )
-                        return self.default_data.copy()
+                        metrics.inc(
+                            "cache_loads_total",
+                            section="rate",
+                            result="invalid",
+                        )
+                        return self._defaults()
             else:
                 logger.info(
                     "Файл кэша не найден, используем значения по умолчанию"
                 )
-                return self.default_data.copy()
+                metrics.inc(
+                    "cache_loads_total", section="rate", result="missing"
+                )
+                return self._defaults()
         except Exception as e:
             logger.error(f"Ошибка загрузки кэша: {e}")
-            return self.default_data.copy()
+            metrics.inc("cache_loads_total", section="rate", result="error")
+            return self._defaults()
+
+    @tracer.traced("cache.load_section")
+    def load_section(self, name: str) -> dict:
+        path = self.section_path(name)
+        try:
+            if not os.path.exists(path):
+                metrics.inc(
+                    "cache_loads_total", section=name, result="missing"
+                )
+                return {}
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = data.get("entries") if isinstance(data, dict) else None
+            if not isinstance(entries, dict):
+                logger.warning(f"Некорректный раздел кэша {name}, пропускаем")
+                metrics.inc(
+                    "cache_loads_total", section=name, result="invalid"
+                )
+                return {}
+            metrics.inc("cache_loads_total", section=name, result="ok")
+            return entries
+        except Exception as e:
+            logger.error(f"Ошибка загрузки раздела кэша {name}: {e}")
+            metrics.inc("cache_loads_total", section=name, result="error")
+            return {}
 
+    def _defaults(self) -> dict:
+        data = self.default_data.copy()
+        data["exchange_rate"] = dict(data["exchange_rate"])
+        return data
+
+    @tracer.traced("cache.save")
     def save_cache(self, data: dict):
+        data["last_update"] = datetime.now().isoformat()
+        data["version"] = self.VERSION
+        self._write(self.cache_file, data, section="rate")
+
+    @tracer.traced("cache.save_section")
+    def save_section(self, name: str, entries: dict):
+        self._write(
+            self.section_path(name),
+            {
+                "version": self.VERSION,
+                "last_update": datetime.now().isoformat(),
+                "entries": entries,
+            },
+            section=name,
+        )
+
+    def _write(self, path: str, data: dict, section: str):
         try:
-            data["last_update"] = datetime.now().isoformat()
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with metrics.timer("cache_save_seconds", section=section):
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, path)
+            metrics.inc("cache_saves_total", section=section, result="ok")
         except Exception as e:
             logger.error(f"Ошибка сохранения кэша: {e}")
+            metrics.inc("cache_saves_total", section=section, result="error")
 
     def _validate_cache_structure(self, data: dict) -> bool:
-        if not all(key in data for key in ['exchange_rate', 'steam_rates']):
+        if 'exchange_rate' not in data:
             return False
         if not isinstance(data['exchange_rate'], dict):
             return False
@@ -97,20 +570,36 @@ class PersistentCache:
 
 
 class NetworkChecker:
+    PROBE_HOSTS = [("8.8.8.8", 53), ("1.1.1.1", 53)]
+
     @staticmethod
+    @tracer.traced("network_probe")
     def is_internet_available(timeout: float = 1.0) -> bool:
+        return any(
+            NetworkChecker._probe(host, port, timeout)
+            for host, port in NetworkChecker.PROBE_HOSTS
+        )
+
+    @staticmethod
+    def _probe(host: str, port: int, timeout: float) -> bool:
+        start = time.perf_counter()
         try:
-            socket.create_connection(("8.8.8.8", 53), timeout=timeout)
-            return True
+            with socket.create_connection((host, port), timeout=timeout):
+                result = True
         except (socket.timeout, socket.error, OSError):
-            try:
-                socket.create_connection(("1.1.1.1", 53), timeout=timeout)
-                return True
-            except (socket.timeout, socket.error, OSError):
-                return False
+            result = False
+        metrics.observe(
+            "network_probe_seconds", time.perf_counter() - start, host=host
+        )
+        metrics.inc(
+            "network_probes_total",
+            host=host,
+            result="ok" if result else "fail",
+        )
+        return result
 
 
-class APIClient:
+class HTTPTransport:
     def __init__(self):
         self.session = requests.Session()
         self.session.headers.update(
@@ -121,29 +610,751 @@ class APIClient:
             }
         )
 
-    def get_exchange_rate(self) -> Optional[float]:
+    def get(
+        self, url: str, headers: Optional[dict] = None, timeout: float = 2
+    ) -> requests.Response:
+        return self.session.get(url, headers=headers, timeout=timeout)
+
+    def is_network_available(self, timeout: float = 1.0) -> bool:
+        return NetworkChecker.is_internet_available(timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+def request_key(url: str) -> str:
+    # Параметр rnd меняется при каждом запросе и не влияет на ответ
+    parts = urllib.parse.urlsplit(url)
+    query = sorted(
+        (k, v)
+        for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if k != "rnd"
+    )
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query))
+    )
+
+
+class RecordingTransport:
+    VERSION = 1
+
+    def __init__(
+        self, archive_path: str, inner: Optional[HTTPTransport] = None
+    ):
+        self.archive_path = archive_path
+        self.inner = inner or HTTPTransport()
+        self.records: list[dict] = []
+        self._lock = threading.Lock()
+
+    def get(
+        self, url: str, headers: Optional[dict] = None, timeout: float = 2
+    ) -> requests.Response:
+        record = {"key": request_key(url)}
+        start = time.perf_counter()
         try:
-            response = self.session.get(
-                "https://www.cbr-xml-daily.ru/daily_json.js", timeout=2
-            )
-            response.raise_for_status()
-            data = response.json()
-            rates = data['Valute']
-            return rates['UAH']['Value'] / rates['UAH']['Nominal']
+            response = self.inner.get(url, headers=headers, timeout=timeout)
         except requests.exceptions.RequestException as e:
-            logger.warning(f"Ошибка получения курса валют: {e}")
+            record.update(
+                elapsed=time.perf_counter() - start,
+                error=type(e).__name__,
+                message=str(e),
+            )
+            self._append(record)
+            raise
+        record.update(
+            elapsed=time.perf_counter() - start,
+            status=response.status_code,
+            content_type=response.headers.get("Content-Type", ""),
+            body=response.text,
+        )
+        self._append(record)
+        return response
+
+    def is_network_available(self, timeout: float = 1.0) -> bool:
+        start = time.perf_counter()
+        result = self.inner.is_network_available(timeout=timeout)
+        self._append(
+            {
+                "key": "probe",
+                "elapsed": time.perf_counter() - start,
+                "result": result,
+            }
+        )
+        return result
+
+    def _append(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+
+    def save(self):
+        with self._lock:
+            payload = {"version": self.VERSION, "records": self.records}
+            data = json.dumps(
+                payload, ensure_ascii=False, separators=(",", ":")
+            )
+        with gzip.open(self.archive_path, 'wt', encoding='utf-8') as f:
+            f.write(data)
+        logger.info(
+            f"Записано {len(self.records)} ответов в {self.archive_path}"
+        )
+
+    def close(self):
+        self.save()
+        self.inner.close()
+
+
+class ReplayTransport:
+    def __init__(self, archive_path: str, speed: float = 1.0):
+        # speed=1 воспроизводит исходные задержки, 0 отвечает мгновенно
+        self.speed = speed
+        with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get("version") != RecordingTransport.VERSION:
+            raise ValueError(
+                f"Неподдерживаемая версия архива: {payload.get('version')}"
+            )
+        grouped: dict[str, list[dict]] = {}
+        for record in payload["records"]:
+            grouped.setdefault(record["key"], []).append(record)
+        self._lock = threading.Lock()
+        self._cycles = {
+            key: itertools.cycle(recs) for key, recs in grouped.items()
+        }
+
+    def _next(self, key: str) -> Optional[dict]:
+        with self._lock:
+            cycle = self._cycles.get(key)
+            return next(cycle) if cycle else None
+
+    def _wait(self, record: dict):
+        if self.speed > 0:
+            time.sleep(record.get("elapsed", 0) / self.speed)
+
+    def get(
+        self, url: str, headers: Optional[dict] = None, timeout: float = 2
+    ) -> requests.Response:
+        record = self._next(request_key(url))
+        if record is None:
+            raise requests.exceptions.ConnectionError(
+                f"Нет записанного ответа для {url}"
+            )
+        self._wait(record)
+        if "error" in record:
+            error_cls = getattr(
+                requests.exceptions,
+                record["error"],
+                requests.exceptions.RequestException,
+            )
+            raise error_cls(record.get("message", ""))
+        response = requests.Response()
+        response.status_code = record["status"]
+        response._content = record["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = record.get("content_type", "")
+        response.url = url
+        return response
+
+    def is_network_available(self, timeout: float = 1.0) -> bool:
+        record = self._next("probe")
+        if record is None:
+            return True
+        self._wait(record)
+        return record["result"]
+
+    def close(self):
+        pass
+
+
+T = TypeVar("T")
+
+
+class RequestHedger:
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        budget: float = 0.1,
+        min_delay: float = 0.05,
+        max_delay: float = 1.0,
+        initial_delay: float = 0.5,
+        window: int = 200,
+        min_samples: int = 20,
+        burst: float = 10.0,
+        upstream: str = "plati",
+    ):
+        # Повторный запрос отправляется, если ответ не пришел за время,
+        # в которое укладывается percentile последних ответов. Бюджет
+        # ограничивает долю повторов от числа основных запросов
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.burst = burst
+        self.upstream = upstream
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def delay(self) -> float:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+        return min(self.max_delay, max(self.min_delay, ordered[index]))
+
+    def observe(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _start_request(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def _acquire_hedge(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        # Ошибки и таймауты тоже учитываются: без них перцентиль занижает
+        # хвост задержек и повтор отправляется слишком рано
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def run(self, fn: Callable[[], T]) -> T:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=32, thread_name_prefix="hedge"
+                    )
+        self._start_request()
+        delay = self.delay()
+        primary = self._pool.submit(self._timed, fn)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._acquire_hedge():
+            if not done:
+                metrics.inc(
+                    "hedge_requests_total",
+                    upstream=self.upstream,
+                    result="no_budget",
+                )
+            return primary.result()
+
+        metrics.observe("hedge_delay_seconds", delay, upstream=self.upstream)
+        hedge = self._pool.submit(self._timed, fn)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # Блокирующий запрос нельзя прервать: проигравший
+                # отменяется, если еще не начат, иначе его ответ
+                # отбрасывается
+                for other in pending:
+                    other.cancel()
+                metrics.inc(
+                    "hedge_requests_total",
+                    upstream=self.upstream,
+                    result="won" if future is hedge else "lost",
+                )
+                return future.result()
+        raise error
+
+    async def arun(self, fn: Callable[[], Awaitable[T]]) -> T:
+        self._start_request()
+        delay = self.delay()
+
+        async def timed():
+            # Отмененный проигравший ответа не дождался, поэтому его время
+            # не учитывается, в отличие от ошибок и таймаутов
+            start = time.perf_counter()
+            try:
+                result = await fn()
+            except Exception:
+                self.observe(time.perf_counter() - start)
+                raise
+            self.observe(time.perf_counter() - start)
+            return result
+
+        primary = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self._acquire_hedge():
+            if not done:
+                metrics.inc(
+                    "hedge_requests_total",
+                    upstream=self.upstream,
+                    result="no_budget",
+                )
+            return await primary
+
+        metrics.observe("hedge_delay_seconds", delay, upstream=self.upstream)
+        hedge = asyncio.ensure_future(timed())
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    metrics.inc(
+                        "hedge_requests_total",
+                        upstream=self.upstream,
+                        result="won" if task is hedge else "lost",
+                    )
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class RateQuote(NamedTuple):
+    rate: float
+    provider: str
+    agreed: int = 1
+
+
+class RateProvider:
+    name = ""
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def parse(self, content: bytes) -> float:
+        raise NotImplementedError
+
+
+class CBRJsonProvider(RateProvider):
+    name = "cbr"
+
+    def parse(self, content: bytes) -> float:
+        return APIClient.parse_cbr_rates(json.loads(content))['UAH']
+
+
+class CBRXmlProvider(RateProvider):
+    name = "cbr_xml"
+
+    def parse(self, content: bytes) -> float:
+        root = ElementTree.fromstring(content)
+        for valute in root.iter('Valute'):
+            if valute.findtext('CharCode') == 'UAH':
+                value = float(valute.findtext('Value').replace(',', '.'))
+                return value / int(valute.findtext('Nominal'))
+        raise ValueError("В ответе нет курса UAH")
+
+
+class NBUProvider(RateProvider):
+    name = "nbu"
+
+    def parse(self, content: bytes) -> float:
+        for item in json.loads(content):
+            if item.get('cc') == 'RUB':
+                # НБУ публикует гривны за рубль, нужен обратный курс
+                return 1 / float(item['rate'])
+        raise ValueError("В ответе нет курса RUB")
+
+
+@dataclass
+class ProviderStats:
+    requests: int = 0
+    successes: int = 0
+    failures: int = 0
+    outliers: int = 0
+    wins: int = 0
+    latency: Optional[float] = None
+
+    def reliability(self) -> float:
+        return (self.successes + 1) / (self.requests + 2)
+
+    def score(self) -> float:
+        # Ожидаемое время до годного ответа: медленный, но надежный
+        # источник может оказаться лучше быстрого и нестабильного.
+        # Источники без успешных ответов идут последними
+        if self.latency is None:
+            return math.inf
+        return self.latency / self.reliability()
+
+
+class RateProviderChain:
+    MODES = ("first", "quorum")
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(
+        self,
+        providers: Iterable[RateProvider],
+        mode: str = "first",
+        quorum: int = 2,
+        tolerance: float = 0.01,
+        max_deviation: float = 0.25,
+        timeout: float = 2.0,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Неизвестный режим выбора курса: {mode}")
+        # first - первый корректный ответ, quorum - курс, на котором
+        # сошлись quorum источников с точностью tolerance
+        self.providers = list(providers)
+        self.mode = mode
+        self.quorum = quorum
+        self.tolerance = tolerance
+        self.max_deviation = max_deviation
+        self.timeout = timeout
+        self.stats = {p.name: ProviderStats() for p in self.providers}
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._inflight: dict[str, Future] = {}
+        self._background: set[asyncio.Task] = set()
+
+    def ordered(self) -> list[RateProvider]:
+        with self._lock:
+            return sorted(
+                self.providers, key=lambda p: self.stats[p.name].score()
+            )
+
+    def export_stats(self) -> dict:
+        with self._lock:
+            return {name: asdict(stats) for name, stats in self.stats.items()}
+
+    def load_stats(self, data: dict):
+        with self._lock:
+            for name, values in (data or {}).items():
+                if name not in self.stats or not isinstance(values, dict):
+                    continue
+                try:
+                    self.stats[name] = ProviderStats(**values)
+                except TypeError:
+                    logger.warning(f"Некорректная статистика источника {name}")
+
+    def _request_failed(self, provider: RateProvider, error: Exception):
+        logger.warning(f"Ошибка получения курса ({provider.name}): {error}")
+        metrics.inc(
+            "upstream_errors_total", upstream=provider.name, kind="request"
+        )
+
+    def _parse(self, provider: RateProvider, content: bytes):
+        try:
+            return provider.parse(content)
+        except Exception as e:
+            logger.error(f"Ошибка обработки курса ({provider.name}): {e}")
+            metrics.inc(
+                "upstream_errors_total", upstream=provider.name, kind="parse"
+            )
             return None
+
+    def _record(
+        self,
+        provider: RateProvider,
+        latency: float,
+        rate: Optional[float],
+        reference: Optional[float],
+    ) -> Optional[tuple[float, bool]]:
+        if rate is None:
+            result = "error"
+        elif not (math.isfinite(rate) and rate > 0):
+            result = "invalid"
+        elif reference and abs(rate / reference - 1) > self.max_deviation:
+            logger.warning(
+                f"Курс {provider.name} {rate} слишком далек от "
+                f"последнего известного {reference}"
+            )
+            result = "outlier"
+        else:
+            result = "ok"
+        metrics.inc(
+            "rate_provider_results_total",
+            provider=provider.name,
+            result=result,
+        )
+        with self._lock:
+            stats = self.stats[provider.name]
+            stats.requests += 1
+            if result in ("ok", "outlier"):
+                stats.successes += 1
+                stats.latency = (
+                    latency
+                    if stats.latency is None
+                    else stats.latency
+                    + self.LATENCY_SMOOTHING * (latency - stats.latency)
+                )
+                stats.outliers += result == "outlier"
+            else:
+                stats.failures += 1
+        if result in ("error", "invalid"):
+            return None
+        return rate, result == "outlier"
+
+    def _fetch_one(
+        self, transport, provider: RateProvider, reference: Optional[float]
+    ):
+        start = time.perf_counter()
+        rate = None
+        try:
+            with metrics.timer(
+                "upstream_latency_seconds", upstream=provider.name
+            ):
+                response = transport.get(provider.url, timeout=self.timeout)
+                response.raise_for_status()
         except Exception as e:
-            logger.error(f"Ошибка обработки данных курса валют: {e}")
+            self._request_failed(provider, e)
+        else:
+            rate = self._parse(provider, response.content)
+        return self._record(
+            provider, time.perf_counter() - start, rate, reference
+        )
+
+    async def _afetch_one(
+        self, transport, provider: RateProvider, reference: Optional[float]
+    ):
+        start = time.perf_counter()
+        rate = None
+        try:
+            with metrics.timer(
+                "upstream_latency_seconds", upstream=provider.name
+            ):
+                response = await transport.get(
+                    provider.url, timeout=self.timeout
+                )
+                response.raise_for_status()
+        except Exception as e:
+            self._request_failed(provider, e)
+        else:
+            rate = self._parse(provider, response.content)
+        return self._record(
+            provider, time.perf_counter() - start, rate, reference
+        )
+
+    def _decide(self, answers: list[tuple[str, float, bool]]):
+        if self.mode == "first":
+            for name, rate, outlier in answers:
+                if not outlier:
+                    return RateQuote(rate, name)
             return None
+        # Совпадение нескольких независимых источников перевешивает
+        # расхождение с кэшем, поэтому выбросы участвуют в кворуме
+        need = min(self.quorum, len(self.providers))
+        for name, rate, _ in answers:
+            group = [
+                value
+                for _, value, _ in answers
+                if abs(value / rate - 1) <= self.tolerance
+            ]
+            if len(group) >= need:
+                return RateQuote(statistics.median(group), name, len(group))
+        return None
 
-    def get_steam_amount(
-        self, amount: float, currency: str = "RUB"
+    def _finish(self, quote: Optional[RateQuote], answers: list):
+        if quote is None:
+            logger.warning(
+                f"Курс не получен ({self.mode}): "
+                + (
+                    ", ".join(f"{name}={rate}" for name, rate, _ in answers)
+                    or "нет ответов"
+                )
+            )
+            metrics.inc("rate_chain_total", mode=self.mode, result="fail")
+            return None
+        with self._lock:
+            self.stats[quote.provider].wins += 1
+        metrics.inc(
+            "rate_chain_total",
+            mode=self.mode,
+            result="ok",
+            provider=quote.provider,
+        )
+        return quote
+
+    def fetch(
+        self, transport, reference: Optional[float] = None
+    ) -> Optional[RateQuote]:
+        # Источники опрашиваются одновременно, ответ возвращается, как
+        # только принято решение. Оставшиеся запросы доходят в фоне и
+        # обновляют статистику
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=max(1, len(self.providers)),
+                        thread_name_prefix="rate",
+                    )
+        providers = self.ordered()
+        futures = {}
+        with self._lock:
+            for provider in providers:
+                # Зависший источник не получает новых запросов, пока
+                # не завершится предыдущий: его ответ используется снова
+                future = self._inflight.get(provider.name)
+                if future is None or future.done():
+                    future = self._pool.submit(
+                        self._fetch_one, transport, provider, reference
+                    )
+                    self._inflight[provider.name] = future
+                futures[future] = provider
+        answers = []
+        for future in as_completed(futures):
+            answer = future.result()
+            if answer is None:
+                continue
+            answers.append((futures[future].name, *answer))
+            quote = self._decide(answers)
+            if quote:
+                return self._finish(quote, answers)
+        return self._finish(None, answers)
+
+    async def afetch(
+        self, transport, reference: Optional[float] = None
+    ) -> Optional[RateQuote]:
+        tasks = {
+            asyncio.ensure_future(self._afetch_one(transport, p, reference)): p
+            for p in self.ordered()
+        }
+        pending = set(tasks)
+        answers = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    answer = task.result()
+                    if answer is None:
+                        continue
+                    answers.append((tasks[task].name, *answer))
+                    quote = self._decide(answers)
+                    if quote:
+                        return self._finish(quote, answers)
+            return self._finish(None, answers)
+        finally:
+            # Незавершенные запросы не отменяются, чтобы учесть их
+            # в статистике источников
+            for task in pending:
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class APIClient:
+    CBR_URL = "https://www.cbr-xml-daily.ru/daily_json.js"
+    CBR_ARCHIVE_URL = (
+        "https://www.cbr-xml-daily.ru/archive/{day:%Y/%m/%d}/daily_json.js"
+    )
+    CBR_XML_URL = "https://www.cbr.ru/scripts/XML_daily.asp"
+    NBU_URL = (
+        "https://bank.gov.ua/NBUStatService/v1/statdirectory/exchange"
+        "?valcode=RUB&json"
+    )
+    PLATI_URL = "https://plati.market/asp/price_options.asp"
+
+    def __init__(
+        self,
+        cbr_url: str = CBR_URL,
+        plati_url: str = PLATI_URL,
+        transport: Optional[HTTPTransport] = None,
+        cbr_archive_url: str = CBR_ARCHIVE_URL,
+        hedger: Optional[RequestHedger] = None,
+        cbr_xml_url: str = CBR_XML_URL,
+        nbu_url: str = NBU_URL,
+        rate_providers: Optional[list[RateProvider]] = None,
+        rate_mode: str = "first",
+    ):
+        self.cbr_url = cbr_url
+        self.cbr_archive_url = cbr_archive_url
+        self.plati_url = plati_url
+        self.transport = transport or HTTPTransport()
+        self.hedger = hedger
+        if rate_providers is None:
+            rate_providers = [
+                CBRJsonProvider(cbr_url),
+                CBRXmlProvider(cbr_xml_url),
+                NBUProvider(nbu_url),
+            ]
+        self.rate_chain = RateProviderChain(rate_providers, mode=rate_mode)
+
+    def is_network_available(self, timeout: float = 1.0) -> bool:
+        return self.transport.is_network_available(timeout=timeout)
+
+    def close(self):
+        self.rate_chain.close()
+        if self.hedger is not None:
+            self.hedger.close()
+        self.transport.close()
+
+    @tracer.traced("api.rate")
+    def get_exchange_rate(
+        self, reference: Optional[float] = None
     ) -> Optional[float]:
-        if not NetworkChecker.is_internet_available(timeout=0.5):
-            logger.info("Пропуск запроса к API Steam: нет подключения к сети")
+        quote = self.rate_chain.fetch(self.transport, reference)
+        return quote.rate if quote else None
+
+    @staticmethod
+    def parse_cbr_rates(data: dict) -> dict[str, float]:
+        return {
+            code: item['Value'] / item['Nominal']
+            for code, item in data['Valute'].items()
+        }
+
+    @tracer.traced("api.cbr_rates")
+    def get_rates(self) -> Optional[dict[str, float]]:
+        # Полная матрица курсов ЦБ на сегодня, в рублях за единицу валюты
+        return self._get_cbr_rates(self.cbr_url, "cbr", "курсов ЦБ")
+
+    @tracer.traced("api.cbr_archive")
+    def get_archive_rates(self, day: date) -> Optional[dict[str, float]]:
+        return self._get_cbr_rates(
+            self.cbr_archive_url.format(day=day),
+            "cbr_archive",
+            f"архивного курса за {day}",
+        )
+
+    def _get_cbr_rates(
+        self, url: str, upstream: str, what: str
+    ) -> Optional[dict[str, float]]:
+        try:
+            with metrics.timer("upstream_latency_seconds", upstream=upstream):
+                response = self.transport.get(url, timeout=5)
+                # В выходные и праздники ЦБ не устанавливает курс
+                if response.status_code == 404:
+                    return {}
+                response.raise_for_status()
+                data = response.json()
+            return self.parse_cbr_rates(data)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Ошибка получения {what}: {e}")
+            metrics.inc(
+                "upstream_errors_total", upstream=upstream, kind="request"
+            )
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка обработки {what}: {e}")
+            metrics.inc(
+                "upstream_errors_total", upstream=upstream, kind="parse"
+            )
             return None
 
+    def steam_url(self, amount: float, currency: str) -> str:
         params = {
             "p": "4100297",
             "a": str(amount).replace('.', ','),
@@ -151,97 +1362,572 @@ class APIClient:
             "x": "<response></response>",
             "rnd": time.time(),
         }
+        return f"{self.plati_url}?{urllib.parse.urlencode(params)}"
+
+    def _fetch_steam(self, url: str) -> dict:
+        response = self.transport.get(
+            url,
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+            timeout=2,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def parse_steam_response(data: dict) -> Optional[float]:
+        if data.get("err") not in ["0", None]:
+            metrics.inc("upstream_errors_total", upstream="plati", kind="api")
+            return None
+        amount_steam = data.get("cnt")
+        return (
+            float(amount_steam.replace(',', '.'))
+            if isinstance(amount_steam, str)
+            else amount_steam
+        )
+
+    @tracer.traced("api.plati")
+    def get_steam_amount(
+        self, amount: float, currency: str = "RUB", check_network: bool = True
+    ) -> Optional[float]:
+        if check_network and not self.is_network_available(timeout=0.5):
+            logger.info("Пропуск запроса к API Steam: нет подключения к сети")
+            metrics.inc("upstream_skipped_total", upstream="plati")
+            return None
+
         try:
-            url = f"https://plati.market/asp/price_options.asp?{urllib.parse.urlencode(params)}"
-            response = self.session.get(
-                url, headers={'X-Requested-With': 'XMLHttpRequest'}, timeout=2
-            )
-            response.raise_for_status()
-            data = response.json()
-            if data.get("err") not in ["0", None]:
-                return None
-            amount_steam = data.get("cnt")
-            return (
-                float(amount_steam.replace(',', '.'))
-                if isinstance(amount_steam, str)
-                else amount_steam
-            )
+            url = self.steam_url(amount, currency)
+            with metrics.timer("upstream_latency_seconds", upstream="plati"):
+                if self.hedger is not None:
+                    data = self.hedger.run(lambda: self._fetch_steam(url))
+                else:
+                    data = self._fetch_steam(url)
+            return self.parse_steam_response(data)
         except requests.exceptions.RequestException as e:
             logger.warning(f"Ошибка получения данных Steam: {e}")
+            metrics.inc(
+                "upstream_errors_total", upstream="plati", kind="request"
+            )
             return None
         except Exception as e:
             logger.error(f"Ошибка обработки данных Steam: {e}")
+            metrics.inc(
+                "upstream_errors_total", upstream="plati", kind="parse"
+            )
             return None
 
 
+@dataclass
+class TTLBand:
+    ttl: float
+    refreshes: int = 0
+    changes: int = 0
+
+
+class AdaptiveSteamTTL:
+    # Котировки plati.market для диапазона сумм часами не меняются, а потом
+    # сдвигаются все сразу. Время жизни диапазона растет, пока обновления
+    # возвращают то же значение, и сокращается после изменения
+    def __init__(
+        self,
+        min_ttl: float = 60,
+        max_ttl: float = 3600,
+        growth: float = 2.0,
+        shrink: float = 0.25,
+        tolerance: float = 0.0,
+    ):
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.growth = growth
+        self.shrink = shrink
+        self.tolerance = tolerance
+        self.bands: dict[str, TTLBand] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    @lru_cache(maxsize=65_536)
+    def band(key: str) -> str:
+        # Диапазон сумм - степень двойки: "RUB_256" - от 256 до 512
+        amount, _, currency = key.rpartition('_')
+        try:
+            exponent = math.frexp(float(amount))[1]
+        except ValueError:
+            return currency
+        return f"{currency}_{format_number(2.0 ** (exponent - 1))}"
+
+    def ttl(self, key: str, base: float) -> float:
+        state = self.bands.get(self.band(key))
+        return base if state is None else state.ttl
+
+    def observe(
+        self, key: str, base: float, old: float, new: float, age: float
+    ) -> bool:
+        band = self.band(key)
+        currency = key.rpartition('_')[2]
+        changed = abs(new - old) > self.tolerance * abs(old)
+        with self._lock:
+            state = self.bands.get(band)
+            if state is None:
+                state = self.bands[band] = TTLBand(base)
+            previous = state.ttl
+            state.refreshes += 1
+            if changed:
+                state.changes += 1
+                state.ttl = max(self.min_ttl, state.ttl * self.shrink)
+            else:
+                state.ttl = min(self.max_ttl, state.ttl * self.growth)
+            ttl = state.ttl
+        metrics.inc(
+            "steam_refreshes_total",
+            currency=currency,
+            result="changed" if changed else "unchanged",
+        )
+        metrics.gauge("steam_ttl_seconds", ttl, band=band)
+        if changed and age > base and old:
+            # Ошибка устаревшей котировки, которую отдавали дольше
+            # постоянного времени жизни
+            metrics.observe(
+                "steam_staleness_error",
+                abs(new - old) / old,
+                currency=currency,
+            )
+        return ttl != previous
+
+    def export_stats(self) -> dict:
+        with self._lock:
+            return {band: asdict(state) for band, state in self.bands.items()}
+
+    def load_stats(self, data: dict):
+        with self._lock:
+            for band, values in (data or {}).items():
+                if not isinstance(values, dict):
+                    continue
+                try:
+                    state = TTLBand(**values)
+                except TypeError:
+                    logger.warning(f"Некорректная статистика TTL {band}")
+                    continue
+                state.ttl = min(self.max_ttl, max(self.min_ttl, state.ttl))
+                self.bands[band] = state
+
+
 class CacheManager:
-    def __init__(self):
-        self.persistent_cache = PersistentCache()
-        self.cache_data = self.persistent_cache.load_cache()
+    RATE_KEY = "rate"
+
+    def __init__(self, cache_file: str = "currency_cache.json", remote=None):
+        self._lock = threading.RLock()
+        self.persistent_cache = PersistentCache(cache_file)
+        # Общий для узлов кэш (remote_cache.RemoteCache), локальный служит
+        # для него первым уровнем
+        self.remote = remote
         self.rate_cache_duration = 600
         self.steam_cache_duration = 180
+        self.steam_cache_durations: dict[str, int] = {}
         self.offline_rate_duration = 86400
+        self.reference_rate_duration = 7 * 86400
+        # Предел числа котировок Steam в памяти, None - без ограничения
+        self.max_steam_entries: Optional[int] = 20_000
+        # None - постоянное время жизни котировок Steam
+        self.steam_ttl_policy: Optional[AdaptiveSteamTTL] = AdaptiveSteamTTL()
+        # Истекшие котировки до обновления, чтобы сравнить с новыми
+        self._expired: dict[str, tuple[float, float]] = {}
+        self._saved_windows: dict[str, int] = {}
+        # Раздел котировок изменен в памяти и еще не записан на диск
+        self.steam_dirty = False
+        self._load_header()
+
+    def _load_header(self):
+        self.cache_data = self.persistent_cache.load_cache()
+        # Котировки Steam: ключ -> (значение, время), читаются при первом
+        # обращении к Steam
+        self._steam_rates: Optional[dict[str, tuple[float, float]]] = None
+        legacy = self.cache_data.pop('steam_rates', None)
+        if legacy is not None:
+            self._migrate_legacy(legacy)
+        if self.steam_ttl_policy is not None:
+            self.steam_ttl_policy.load_stats(self.cache_data.get('steam_ttl'))
+
+    def _migrate_legacy(self, legacy: dict):
+        # Старый формат хранил котировки Steam в основном файле
+        logger.info("Перенос котировок Steam в отдельный раздел кэша")
+        self._steam_rates = {
+            key: (entry['value'], entry['timestamp'])
+            for key, entry in legacy.items()
+            if isinstance(entry, dict) and 'value' in entry
+        }
+        self.persistent_cache.save_section('steam_rates', self.steam_rates)
+        self.persistent_cache.save_cache(self.cache_data)
 
     def reload_from_disk(self):
         logger.info("Принудительная перезагрузка кэша с диска")
-        self.cache_data = self.persistent_cache.load_cache()
+        with self._lock:
+            self._load_header()
 
-    def get_rate(self, allow_offline: bool = True) -> Optional[float]:
+    @property
+    def steam_rates(self) -> dict[str, tuple[float, float]]:
+        if self._steam_rates is None:
+            with self._lock:
+                if self._steam_rates is None:
+                    self._steam_rates = {
+                        key: (entry[0], entry[1])
+                        for key, entry in self.persistent_cache.load_section(
+                            'steam_rates'
+                        ).items()
+                    }
+        return self._steam_rates
+
+    @tracer.traced("cache.rate_lookup")
+    def get_rate(
+        self, allow_offline: bool = True, probe_network: bool = True
+    ) -> Optional[float]:
         rate_data = self.cache_data.get('exchange_rate', {})
         timestamp = rate_data.get('timestamp', 0)
         value = rate_data.get('value')
         if not timestamp or not value:
+            metrics.inc("cache_misses_total", tier="rate")
             return None
         if time.time() - timestamp < self.rate_cache_duration:
+            metrics.inc("cache_hits_total", tier="rate")
             return value
         if (
             allow_offline
             and time.time() - timestamp < self.offline_rate_duration
         ):
+            metrics.inc("cache_hits_total", tier="rate_offline")
             return value
-        if allow_offline and not NetworkChecker.is_internet_available():
+        # Проверка сети может занять секунды, probe_network=False
+        # оставляет ее вызывающему
+        if (
+            allow_offline
+            and probe_network
+            and not NetworkChecker.is_internet_available()
+        ):
+            metrics.inc("cache_hits_total", tier="rate_offline")
             return value
+        metrics.inc("cache_misses_total", tier="rate")
         return None
 
-    def set_rate(self, rate: float):
-        self.cache_data['exchange_rate'] = {
-            'value': rate,
-            'timestamp': time.time(),
-        }
-        self.persistent_cache.save_cache(self.cache_data)
+    def reference_rate(self) -> Optional[float]:
+        # Последний курс из API для отсева выбросов, без учета срока
+        # годности кэша, но не старше недели
+        rate_data = self.cache_data.get('exchange_rate', {})
+        timestamp = rate_data.get('timestamp', 0)
+        if not timestamp:
+            return None
+        if time.time() - timestamp > self.reference_rate_duration:
+            return None
+        return rate_data.get('value')
+
+    def set_rate(self, rate: float, providers: Optional[dict] = None):
+        now = time.time()
+        with self._lock:
+            self.cache_data['exchange_rate'] = {
+                'value': rate,
+                'timestamp': now,
+            }
+            if providers is not None:
+                self.cache_data['rate_providers'] = providers
+            self.persistent_cache.save_cache(self.cache_data)
+        if self.remote is not None:
+            self.remote.set_many(
+                {self.RATE_KEY: (rate, now, self.offline_rate_duration)}
+            )
+
+    def _fresh_rate(self, key: str, entry: tuple[float, float]) -> bool:
+        return time.time() - entry[1] < self.rate_cache_duration
 
+    def _use_shared_rate(self, entry: tuple[float, float]) -> float:
+        # Курс другого узла сохраняется со временем его получения
+        value, timestamp = entry
+        with self._lock:
+            self.cache_data['exchange_rate'] = {
+                'value': value,
+                'timestamp': timestamp,
+            }
+            self.persistent_cache.save_cache(self.cache_data)
+        metrics.inc("cache_hits_total", tier="rate_remote")
+        return value
+
+    def shared_rate(self) -> Optional[float]:
+        # Свежий курс, уже полученный другим узлом. Если его нет, курс
+        # обновляет узел, взявший аренду, а остальные ждут его результата
+        if self.remote is None:
+            return None
+        entry = self.remote.get_many([self.RATE_KEY]).get(self.RATE_KEY)
+        if entry is not None and self._fresh_rate(self.RATE_KEY, entry):
+            return self._use_shared_rate(entry)
+        if self.remote.acquire([self.RATE_KEY]):
+            metrics.inc("cache_misses_total", tier="rate_remote")
+            return None
+        entry = self.remote.wait([self.RATE_KEY], self._fresh_rate).get(
+            self.RATE_KEY
+        )
+        if entry is None:
+            metrics.inc("cache_misses_total", tier="rate_remote")
+            return None
+        return self._use_shared_rate(entry)
+
+    def release_rate_refresh(self):
+        if self.remote is not None:
+            self.remote.release([self.RATE_KEY])
+
+    def steam_ttl(self, currency: str) -> int:
+        return self.steam_cache_durations.get(
+            currency, self.steam_cache_duration
+        )
+
+    def _key_ttl(self, key: str) -> float:
+        base = self.steam_ttl(key.rsplit('_', 1)[-1])
+        if self.steam_ttl_policy is None:
+            return base
+        return self.steam_ttl_policy.ttl(key, base)
+
+    def _count_saved_refresh(self, key: str, age: float):
+        # При постоянном времени жизни первое обращение в каждом новом
+        # окне steam_ttl стоило бы запроса к API
+        currency = key.rsplit('_', 1)[-1]
+        base = self.steam_ttl(currency)
+        if age <= base:
+            return
+        window = int(age // base)
+        if window > self._saved_windows.get(key, 0):
+            self._saved_windows[key] = window
+            metrics.inc("steam_refreshes_saved_total", currency=currency)
+
+    def _forget(self, key: str, expired: bool = False):
+        entry = self.steam_rates.pop(key)
+        self._saved_windows.pop(key, None)
+        if expired and self.steam_ttl_policy is not None:
+            self._expired[key] = entry
+            limit = self.max_steam_entries
+            if limit is not None and len(self._expired) > limit:
+                del self._expired[next(iter(self._expired))]
+
+    @tracer.traced("cache.steam_lookup")
     def get_steam_amount(self, key: str) -> Optional[float]:
-        steam_data = self.cache_data.get('steam_rates', {}).get(key)
-        if not steam_data:
+        value = self._get_local_steam_amount(key)
+        if value is None and self.remote is not None:
+            value = self._read_remote([key]).get(key)
+        return value
+
+    def get_steam_amounts(self, keys: list[str]) -> dict[str, float]:
+        # Промахи первого уровня запрашиваются из общего кэша одним запросом
+        found, missed = {}, []
+        for key in keys:
+            value = self._get_local_steam_amount(key)
+            if value is None:
+                missed.append(key)
+            else:
+                found[key] = value
+        if missed and self.remote is not None:
+            found.update(self._read_remote(missed))
+        return found
+
+    def _remote_steam_key(self, key: str) -> str:
+        return f"steam:{key}"
+
+    def _fresh_remote_steam(self, name: str, entry: tuple) -> bool:
+        key = name.split(':', 1)[1]
+        return time.time() - entry[1] <= self._key_ttl(key)
+
+    def _fill_from_remote(self, entries: dict) -> dict[str, float]:
+        # Котировки других узлов попадают в первый уровень со временем
+        # получения, поэтому их срок годности не продлевается
+        found = {}
+        steam_rates = self.steam_rates
+        with self._lock:
+            for name, entry in entries.items():
+                key = name.split(':', 1)[1]
+                steam_rates[key] = entry
+                found[key] = entry[0]
+        return found
+
+    def _read_remote(self, keys: list[str]) -> dict[str, float]:
+        names = [self._remote_steam_key(key) for key in keys]
+        entries = {
+            name: entry
+            for name, entry in self.remote.get_many(names).items()
+            if self._fresh_remote_steam(name, entry)
+        }
+        metrics.inc("cache_hits_total", len(entries), tier="steam_remote")
+        metrics.inc(
+            "cache_misses_total", len(keys) - len(entries), tier="steam_remote"
+        )
+        return self._fill_from_remote(entries)
+
+    def claim_refresh(self, keys: list[str]) -> list[str]:
+        # Ключи, которые этот узел обновляет сам. Без общего кэша - все
+        if self.remote is None:
+            return list(keys)
+        names = self.remote.acquire(
+            [self._remote_steam_key(key) for key in keys]
+        )
+        return [name.split(':', 1)[1] for name in names]
+
+    def release_refresh(self, keys: list[str]):
+        if self.remote is not None and keys:
+            self.remote.release([self._remote_steam_key(key) for key in keys])
+
+    def wait_for_refresh(self, keys: list[str]) -> dict[str, float]:
+        if self.remote is None or not keys:
+            return {}
+        entries = self.remote.wait(
+            [self._remote_steam_key(key) for key in keys],
+            self._fresh_remote_steam,
+        )
+        return self._fill_from_remote(entries)
+
+    def _get_local_steam_amount(self, key: str) -> Optional[float]:
+        steam_rates = self.steam_rates
+        with self._lock:
+            entry = steam_rates.get(key)
+            if entry is None:
+                metrics.inc("cache_misses_total", tier="steam")
+                return None
+            value, timestamp = entry
+            age = time.time() - timestamp
+            if age <= self._key_ttl(key):
+                metrics.inc("cache_hits_total", tier="steam")
+                self._count_saved_refresh(key, age)
+                return value
+            # Чтение не переписывает раздел на диске: удаление просроченной
+            # записи сохранится вместе со следующей записью котировок
+            self._forget(key, expired=True)
+            self.steam_dirty = True
+            metrics.inc("cache_misses_total", tier="steam")
+            metrics.inc("cache_expired_total", tier="steam")
             return None
-        entry = CacheEntry.from_dict(steam_data)
-        if not entry.is_expired(self.steam_cache_duration):
-            return entry.value
-        else:
-            if key in self.cache_data['steam_rates']:
-                del self.cache_data['steam_rates'][key]
-                self.persistent_cache.save_cache(self.cache_data)
-        return None
 
+    @tracer.traced("cache.steam_store")
     def set_steam_amount(self, key: str, amount: float):
-        if 'steam_rates' not in self.cache_data:
-            self.cache_data['steam_rates'] = {}
-        entry = CacheEntry(amount, time.time())
-        self.cache_data['steam_rates'][key] = entry.to_dict()
-        self._cleanup_steam_cache()
+        self.set_steam_amounts({key: amount})
+
+    def set_steam_amounts(
+        self, amounts: dict[str, float], persist: bool = True
+    ):
+        if not amounts:
+            return
+        steam_rates = self.steam_rates
+        policy = self.steam_ttl_policy
+        with self._lock:
+            now = time.time()
+            ttl_changed = False
+            for key, amount in amounts.items():
+                previous = steam_rates.get(key) or self._expired.pop(key, None)
+                if previous is not None and policy is not None:
+                    ttl_changed |= policy.observe(
+                        key,
+                        self.steam_ttl(key.rsplit('_', 1)[-1]),
+                        previous[0],
+                        amount,
+                        now - previous[1],
+                    )
+                self._saved_windows.pop(key, None)
+                steam_rates[key] = (amount, now)
+            self._cleanup_steam_cache()
+            if persist:
+                self.persistent_cache.save_section(
+                    'steam_rates', self.steam_rates
+                )
+                self.steam_dirty = False
+                if ttl_changed:
+                    self._save_header()
+            else:
+                self.steam_dirty = True
+            shared = {
+                self._remote_steam_key(key): (amount, now, self._key_ttl(key))
+                for key, amount in amounts.items()
+            }
+        if self.remote is not None:
+            self.remote.set_many(shared)
+
+    def _save_header(self):
+        if self.steam_ttl_policy is not None:
+            self.cache_data['steam_ttl'] = self.steam_ttl_policy.export_stats()
         self.persistent_cache.save_cache(self.cache_data)
 
+    def save(self):
+        with self._lock:
+            self._save_header()
+            if self._steam_rates is not None:
+                self.persistent_cache.save_section(
+                    'steam_rates', self.steam_rates
+                )
+                self.steam_dirty = False
+
+    def flush_steam(self):
+        with self._lock:
+            if self.steam_dirty and self._steam_rates is not None:
+                self.persistent_cache.save_section(
+                    'steam_rates', self._steam_rates
+                )
+                self.steam_dirty = False
+
     def _cleanup_steam_cache(self):
-        steam_rates = self.cache_data.get('steam_rates', {})
+        steam_rates = self.steam_rates
+        now = time.time()
+        # Записи моложе наименьшего возможного срока не проверяются
+        durations = [
+            self.steam_cache_duration,
+            *self.steam_cache_durations.values(),
+        ]
+        if self.steam_ttl_policy is not None:
+            durations.append(self.steam_ttl_policy.min_ttl)
+        shortest = min(durations)
         expired_keys = [
             key
-            for key, entry_data in steam_rates.items()
-            if CacheEntry.from_dict(entry_data).is_expired(
-                self.steam_cache_duration
-            )
+            for key, (_, timestamp) in steam_rates.items()
+            if now - timestamp > shortest
+            and now - timestamp > self._key_ttl(key)
         ]
         for key in expired_keys:
-            del self.cache_data['steam_rates'][key]
+            self._forget(key, expired=True)
+        limit = self.max_steam_entries
+        if limit is not None and len(steam_rates) > limit:
+            # Вытесняется с запасом, чтобы не сортировать кэш на каждой
+            # вставке у границы
+            self._evict_oldest(len(steam_rates) - int(limit * 0.9))
+
+    def _evict_oldest(self, count: int) -> int:
+        steam_rates = self.steam_rates
+        oldest = heapq.nsmallest(
+            count, steam_rates.items(), key=lambda item: item[1][1]
+        )
+        for key, _ in oldest:
+            self._forget(key)
+        metrics.inc("cache_evicted_total", len(oldest), tier="steam")
+        return len(oldest)
+
+    def fresh_steam_amounts(self) -> dict[str, dict[float, float]]:
+        # Непросроченные котировки по валютам: валюта -> сумма -> котировка
+        now = time.time()
+        points: dict[str, dict[float, float]] = {}
+        for key, (value, timestamp) in list(self.steam_rates.items()):
+            if now - timestamp > self._key_ttl(key):
+                continue
+            amount, _, currency = key.rpartition('_')
+            try:
+                points.setdefault(currency, {})[float(amount)] = value
+            except ValueError:
+                continue
+        return points
+
+    def trim_steam_cache(self, keep: int) -> int:
+        # Сжатие по требованию, например при превышении бюджета памяти
+        if self._steam_rates is None:
+            return 0
+        with self._lock:
+            before = len(self._steam_rates)
+            self._cleanup_steam_cache()
+            if len(self._steam_rates) > keep:
+                self._evict_oldest(len(self._steam_rates) - keep)
+            removed = before - len(self._steam_rates)
+            self._expired.clear()
+            if removed:
+                self.persistent_cache.save_section(
+                    'steam_rates', self._steam_rates
+                )
+                self.steam_dirty = False
+        return removed
 
     def get_cache_age_info(self) -> Optional[str]:
         rate_data = self.cache_data.get('exchange_rate', {})
@@ -261,6 +1947,118 @@ class CacheManager:
         return f"{time_diff.days} дн назад"
 
 
+@dataclass
+class QuotePlan:
+    canonical: dict = field(default_factory=dict)
+    by_key: dict = field(default_factory=dict)
+    key_quotes: dict = field(default_factory=dict)
+    missing: list = field(default_factory=list)
+    # Число запросов к API, выполненных по плану
+    fetched: int = 0
+    # Ключи с котировкой, полученной от API этим или другим узлом
+    live: set = field(default_factory=set)
+
+
+class SteamKeyCanonicalizer:
+    # Средняя доля суммы, зачисляемая в Steam, пока нет живых котировок
+    DEFAULT_SLOPE = 0.935
+
+    def __init__(
+        self,
+        resolutions: dict[str, float],
+        quanta: Optional[dict[str, float]] = None,
+    ):
+        self.resolutions = resolutions
+        self.quanta = dict(quanta or {})
+        self._slopes: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.quantized = 0
+        self.abs_error = 0.0
+        self.rel_error = 0.0
+        self.max_abs_error = 0.0
+
+    @staticmethod
+    def normalize(amount: float) -> str:
+        text = f"{round(amount, 6):.6f}".rstrip('0').rstrip('.')
+        return text or "0"
+
+    @staticmethod
+    def _nice_floor(value: float) -> float:
+        scale = 10 ** math.floor(math.log10(value))
+        for multiplier in (5, 2, 1):
+            if multiplier * scale <= value:
+                return multiplier * scale
+        return scale
+
+    def quantum(self, currency: str) -> float:
+        if currency in self.quanta:
+            return self.quanta[currency]
+        # Шаг суммы, при котором котировка меняется не больше чем на
+        # единицу точности результата
+        resolution = self.resolutions.get(currency, 1.0)
+        slope = self._slopes.get(currency, self.DEFAULT_SLOPE)
+        return self._nice_floor(resolution / slope)
+
+    def observe(self, amount: float, quote: float, currency: str):
+        if amount <= 0 or quote <= 0:
+            return
+        with self._lock:
+            slope = self._slopes.get(currency, quote / amount)
+            self._slopes[currency] = 0.9 * slope + 0.1 * (quote / amount)
+
+    def canonicalize(self, amount: float, currency: str) -> tuple[float, str]:
+        quantum = self.quantum(currency)
+        quantized = amount
+        if quantum > 0:
+            quantized = round(round(amount / quantum) * quantum, 6)
+            if quantized <= 0:
+                quantized = amount
+        error = abs(amount - quantized)
+        with self._lock:
+            self.lookups += 1
+            if error:
+                self.quantized += 1
+                self.abs_error += error
+                self.rel_error += error / amount
+                self.max_abs_error = max(self.max_abs_error, error)
+        if error:
+            metrics.inc("steam_keys_quantized_total", currency=currency)
+            metrics.inc(
+                "steam_quantization_error_total", error, currency=currency
+            )
+        return quantized, f"{self.normalize(quantized)}_{currency}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "quantized": self.quantized,
+                "mean_abs_error": (
+                    self.abs_error / self.lookups if self.lookups else 0.0
+                ),
+                "mean_rel_error": (
+                    self.rel_error / self.lookups if self.lookups else 0.0
+                ),
+                "max_abs_error": self.max_abs_error,
+                "quanta": {
+                    currency: self.quantum(currency)
+                    for currency in self.resolutions
+                },
+            }
+
+
+def _scale_fallback_curves(
+    points: list[tuple[float, float]], rub_per_unit: dict[str, float]
+) -> dict[str, list[tuple[float, float]]]:
+    return {
+        currency: [
+            (round(pay / k, 2), round(get / k, 2)) for pay, get in points
+        ]
+        for currency, k in rub_per_unit.items()
+    }
+
+
 class SteamCalculator:
     FALLBACK_DATA = [
         (30, 29),
@@ -282,84 +2080,400 @@ class SteamCalculator:
         (8000, 7477),
         (15000, 14019),
     ]
+    # Примерная стоимость единицы валюты кошелька в рублях. Используется
+    # только для масштабирования резервной кривой комиссий
+    FALLBACK_RUB_PER_UNIT = {"RUB": 1.0, "KZT": 0.17, "UAH": 2.2, "USD": 90.0}
+    FALLBACK_CURVES = _scale_fallback_curves(
+        FALLBACK_DATA, FALLBACK_RUB_PER_UNIT
+    )
+    RESULT_PRECISION = {"USD": 2}
+    MAX_PARALLEL_QUOTES = 8
 
-    def __init__(self, api_client: APIClient, cache_manager: CacheManager):
+    def __init__(
+        self,
+        api_client: APIClient,
+        cache_manager: CacheManager,
+        quanta: Optional[dict[str, float]] = None,
+    ):
         self.api_client = api_client
         self.cache_manager = cache_manager
+        self.key_canonicalizer = SteamKeyCanonicalizer(
+            {
+                currency: 10 ** -self.RESULT_PRECISION.get(currency, 0)
+                for currency in self.FALLBACK_CURVES
+            },
+            quanta,
+        )
+        # Источник котировок без сети до встроенной кривой (офлайн-пакет):
+        # (сумма, валюта) -> котировка или None
+        self.fallback_source: Optional[
+            Callable[[float, str], Optional[float]]
+        ] = None
+
+    @classmethod
+    def supports(cls, currency: str) -> bool:
+        return currency in cls.FALLBACK_CURVES
+
+    def cache_key(self, amount: float, currency: str = "RUB") -> str:
+        return self.key_canonicalizer.canonicalize(amount, currency)[1]
 
     def calculate_commission(
-        self, amount: float, is_online: bool
+        self, amount: float, is_online: bool, currency: str = "RUB"
+    ) -> CommissionData:
+        result = self._get_steam_amount_with_cache(amount, is_online, currency)
+        return self.build_commission(amount, result, currency)
+
+    @classmethod
+    def build_commission(
+        cls, amount: float, result: float, currency: str = "RUB"
     ) -> CommissionData:
-        result = self._get_steam_amount_with_cache(amount, is_online)
-        commission = (amount - result) / amount if amount > 0 else 0
+        digits = cls.RESULT_PRECISION.get(currency, 0)
+        credited = int(result) if digits == 0 else round(result, digits)
+        commission = (amount - credited) / amount if amount > 0 else 0
+        # Процент комиссии и сумма сразу приводятся к виду для вывода
         return CommissionData(
-            result=int(result),
-            commission=round(commission, 4),
-            commission_amount=round(amount - result, 2),
+            credited,
+            format_number(round(round(commission, 4) * 100, 2)),
+            format_number(round(amount - credited, 2)),
         )
 
     def _get_steam_amount_with_cache(
-        self, amount: float, is_online: bool
+        self, amount: float, is_online: bool, currency: str = "RUB"
+    ) -> float:
+        return self.quote_many([(amount, currency)], is_online)[
+            (amount, currency)
+        ]
+
+    def _count_fallbacks(self, fallbacks: dict[str, int], is_online: bool):
+        reason = "api_error" if is_online else "offline"
+        for currency, count in fallbacks.items():
+            metrics.inc(
+                "steam_quotes_total",
+                count,
+                source="fallback",
+                currency=currency,
+            )
+            metrics.inc("fallback_total", count, reason=reason)
+
+    @tracer.traced("steam.quote_many")
+    def quote_many(
+        self,
+        items: list[tuple[float, str]],
+        is_online: bool,
+        persist: bool = True,
+    ) -> dict[tuple[float, str], float]:
+        return self.quote_plan(items, is_online, persist)[1]
+
+    def quote_plan(
+        self,
+        items: list[tuple[float, str]],
+        is_online: bool,
+        persist: bool = True,
+    ) -> tuple[QuotePlan, dict[tuple[float, str], float]]:
+        plan = self.plan_quotes(items)
+        if (
+            plan.missing
+            and is_online
+            and self.api_client.is_network_available(0.5)
+        ):
+            cache = self.cache_manager
+            waiting = self.claim_missing(plan)
+            fetched = self._fetch_quotes(
+                [plan.by_key[key] for key in plan.missing]
+            )
+            self.store_quotes(plan, fetched, persist=persist)
+            cache.release_refresh(plan.missing)
+            if waiting:
+                self.use_shared_quotes(plan, cache.wait_for_refresh(waiting))
+                plan.missing = [
+                    key for key in waiting if key not in plan.key_quotes
+                ]
+                fetched = self._fetch_quotes(
+                    [plan.by_key[key] for key in plan.missing]
+                )
+                self.store_quotes(plan, fetched, persist=persist)
+        if persist:
+            self.cache_manager.flush_steam()
+        return plan, self.finish_quotes(plan, is_online)
+
+    def claim_missing(self, plan: QuotePlan) -> list[str]:
+        # С общим кэшем ключ обновляет один узел: plan.missing сужается до
+        # взятых в аренду ключей, остальные возвращаются для ожидания
+        claimed = set(self.cache_manager.claim_refresh(plan.missing))
+        waiting = [key for key in plan.missing if key not in claimed]
+        plan.missing = [key for key in plan.missing if key in claimed]
+        return waiting
+
+    def use_shared_quotes(self, plan: QuotePlan, shared: dict[str, float]):
+        for key, value in shared.items():
+            metrics.inc(
+                "steam_quotes_total",
+                source="remote",
+                currency=plan.by_key[key][1],
+            )
+            plan.key_quotes[key] = value
+            plan.live.add(key)
+
+    def plan_quotes(self, items: list[tuple[float, str]]) -> QuotePlan:
+        # Несколько сумм могут попасть в один канонический ключ, поэтому
+        # запрос к кэшу и API выполняется один раз на ключ
+        plan = QuotePlan()
+        for amount, currency in dict.fromkeys(items):
+            quantized, key = self.key_canonicalizer.canonicalize(
+                amount, currency
+            )
+            plan.canonical[(amount, currency)] = (quantized, key)
+            plan.by_key.setdefault(key, (quantized, currency))
+
+        found = self.cache_manager.get_steam_amounts(list(plan.by_key))
+        for key, (quantized, currency) in plan.by_key.items():
+            cached = found.get(key)
+            if cached is not None:
+                metrics.inc(
+                    "steam_quotes_total", source="cache", currency=currency
+                )
+                plan.key_quotes[key] = cached
+            else:
+                plan.missing.append(key)
+        return plan
+
+    def store_quotes(
+        self,
+        plan: QuotePlan,
+        fetched: list[Optional[float]],
+        persist: bool = True,
+    ):
+        if not plan.missing:
+            return
+        plan.fetched += len(plan.missing)
+        fresh = {}
+        for key, value in zip(plan.missing, fetched):
+            if value is None:
+                continue
+            quantized, currency = plan.by_key[key]
+            metrics.inc("steam_quotes_total", source="api", currency=currency)
+            self.key_canonicalizer.observe(quantized, value, currency)
+            plan.key_quotes[key] = fresh[key] = value
+        plan.live.update(fresh)
+        self.cache_manager.set_steam_amounts(fresh, persist=persist)
+
+    def finish_quotes(
+        self, plan: QuotePlan, is_online: bool
+    ) -> dict[tuple[float, str], float]:
+        quotes: dict[tuple[float, str], float] = {}
+        # Метрики резервного расчета пишутся одним вызовом на валюту
+        fallbacks: dict[str, int] = {}
+        for (amount, currency), (quantized, key) in plan.canonical.items():
+            quote = plan.key_quotes.get(key)
+            if quote is None:
+                fallbacks[currency] = fallbacks.get(currency, 0) + 1
+                quotes[(amount, currency)] = self._offline_quote(
+                    amount, currency
+                )
+            elif quantized != amount:
+                # Поправка котировки соседней суммы пропорционально разнице
+                quotes[(amount, currency)] = quote * amount / quantized
+            else:
+                quotes[(amount, currency)] = quote
+        self._count_fallbacks(fallbacks, is_online)
+        return quotes
+
+    def _fetch_quotes(
+        self, items: list[tuple[float, str]]
+    ) -> list[Optional[float]]:
+        def fetch(item: tuple[float, str]) -> Optional[float]:
+            amount, currency = item
+            return self.api_client.get_steam_amount(
+                format_number(amount), currency, check_network=False
+            )
+
+        if len(items) == 1:
+            return [fetch(items[0])]
+        if not items:
+            return []
+        workers = min(self.MAX_PARALLEL_QUOTES, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fetch, items))
+
+    def _offline_quote(self, amount: float, currency: str) -> float:
+        if self.fallback_source is not None:
+            quote = self.fallback_source(amount, currency)
+            if quote is not None:
+                return quote
+        return self._calculate_fallback(amount, currency)
+
+    @classmethod
+    @tracer.traced("steam.fallback")
+    def _calculate_fallback(
+        cls, amount: float, currency: str = "RUB"
     ) -> float:
-        cache_key = f"{amount}_RUB"
-        cached_amount = self.cache_manager.get_steam_amount(cache_key)
-        if cached_amount is not None:
-            return cached_amount
-        if is_online:
-            api_amount = self.api_client.get_steam_amount(amount)
-            if api_amount is not None:
-                self.cache_manager.set_steam_amount(cache_key, api_amount)
-                return api_amount
-        return self._calculate_fallback(amount)
+        return cls._fallback_quote(amount, currency)
+
+    @classmethod
+    def clear_fallback_cache(cls):
+        cls._fallback_quote.cache_clear()
 
+    # Кэш на уровне класса: lru_cache на методе экземпляра держал ссылки
+    # на все калькуляторы и не давал им освободиться
+    @classmethod
     @lru_cache(maxsize=128)
-    def _calculate_fallback(self, amount: float) -> float:
-        for pay, get in self.FALLBACK_DATA:
-            if pay == amount:
-                return get
-        if amount < 30:
-            return round(amount * (29.0 / 30.0), 0)
-        if amount > 15000:
-            return round(amount * (14019.0 / 15000.0), 0)
-        for i in range(len(self.FALLBACK_DATA) - 1):
-            pay1, get1 = self.FALLBACK_DATA[i]
-            pay2, get2 = self.FALLBACK_DATA[i + 1]
-            if pay1 <= amount <= pay2:
-                ratio = (amount - pay1) / (pay2 - pay1)
-                return round(get1 + ratio * (get2 - get1), 0)
-        return round(amount * 0.935, 0)
+    def _fallback_quote(cls, amount: float, currency: str) -> float:
+        return cls.interpolate(
+            cls.FALLBACK_CURVES[currency],
+            amount,
+            cls.RESULT_PRECISION.get(currency, 0),
+        )
+
+    @staticmethod
+    def interpolate(
+        curve: Sequence[tuple[float, float]], amount: float, digits: int
+    ) -> float:
+        index = bisect_right(curve, amount, key=itemgetter(0))
+        if index and curve[index - 1][0] == amount:
+            return curve[index - 1][1]
+        if index == 0:
+            first_pay, first_get = curve[0]
+            return round(amount * (first_get / first_pay), digits)
+        if index == len(curve):
+            last_pay, last_get = curve[-1]
+            return round(amount * (last_get / last_pay), digits)
+        (pay1, get1), (pay2, get2) = curve[index - 1], curve[index]
+        ratio = (amount - pay1) / (pay2 - pay1)
+        return round(get1 + ratio * (get2 - get1), digits)
 
 
 class CurrencyConverterCore:
-    def __init__(self):
-        self.api_client = APIClient()
-        self.cache_manager = CacheManager()
+    def __init__(
+        self,
+        api_client: Optional[APIClient] = None,
+        cache_file: str = "currency_cache.json",
+        history_file: str = "rate_history.bin",
+        bundle_file: str = "offline_bundle.bin",
+        remote_cache=None,
+    ):
+        self.api_client = api_client or APIClient()
+        self.cache_manager = CacheManager(cache_file, remote_cache)
         self.steam_calculator = SteamCalculator(
             self.api_client, self.cache_manager
         )
         self.current_rate: Optional[float] = None
         self.is_online: bool = False
         self.rate_source: str = (
-            "uninitialized"  # 'api', 'cache', 'default', 'manual'
+            "uninitialized"  # 'api', 'cache', 'bundle', 'default', 'manual'
+        )
+        self.history_file = history_file
+        self._history = None
+        self.bundle_file = bundle_file
+        self._bundle = None
+        self._bundle_checked = False
+        self.steam_calculator.fallback_source = self._bundle_quote
+        self.api_client.rate_chain.load_stats(
+            self.cache_manager.cache_data.get('rate_providers')
         )
 
+    def close(self):
+        self.api_client.close()
+        self.close_shared_cache()
+
+    def close_shared_cache(self):
+        # Общий для синхронного и асинхронного ядра шаг закрытия
+        if self.cache_manager.remote is not None:
+            self.cache_manager.remote.close()
+
+    @property
+    def history(self):
+        # История загружается только при первом обращении к архиву курсов
+        if self._history is None:
+            from history import RateHistory
+
+            self._history = RateHistory(self.history_file)
+        return self._history
+
+    @property
+    def bundle(self):
+        # Офлайн-пакет открывается при первом обращении, читается только
+        # заголовок, разделы отображаются через mmap
+        if not self._bundle_checked:
+            from bundle import OfflineBundle
+
+            self._bundle = OfflineBundle.open(self.bundle_file)
+            self._bundle_checked = True
+        return self._bundle
+
+    def reset_bundle(self):
+        if self._bundle is not None:
+            self._bundle.close()
+        self._bundle = None
+        self._bundle_checked = False
+
+    def _bundle_quote(self, amount: float, currency: str) -> Optional[float]:
+        bundle = self.bundle
+        if bundle is None:
+            return None
+        quote = bundle.fallback_quote(amount, currency)
+        if quote is not None:
+            metrics.inc("bundle_quotes_total", currency=currency)
+        return quote
+
+    def backfill_history(
+        self, start: date, end: date, workers: int = 8
+    ) -> dict:
+        return self.history.backfill(self.api_client, start, end, workers)
+
+    @tracer.traced("initialize")
     def initialize(self) -> bool:
-        self.is_online = NetworkChecker.is_internet_available(timeout=1.0)
+        self.is_online = self.api_client.is_network_available(timeout=1.0)
 
         if self.is_online:
-            new_rate = self.api_client.get_exchange_rate()
-            if new_rate:
-                self.cache_manager.set_rate(new_rate)
-                self.current_rate = new_rate
-                self.rate_source = "api"
+            shared_rate = self.cache_manager.shared_rate()
+            if shared_rate:
+                self._apply_shared_rate(shared_rate)
                 return True
-            else:
-                self.is_online = False
+            try:
+                new_rate = self.api_client.get_exchange_rate(
+                    self.cache_manager.reference_rate()
+                )
+                if new_rate:
+                    self._apply_api_rate(new_rate)
+                    return True
+            finally:
+                self.cache_manager.release_rate_refresh()
+            self.is_online = False
+
+        return self._apply_offline_rate()
+
+    def _apply_api_rate(self, rate: float):
+        self.cache_manager.set_rate(
+            rate, self.api_client.rate_chain.export_stats()
+        )
+        self.current_rate = rate
+        self.rate_source = "api"
+
+    def _apply_shared_rate(self, rate: float):
+        # Курс из API, полученный другим узлом через общий кэш
+        self.current_rate = rate
+        self.rate_source = "api"
 
-        cached_rate = self.cache_manager.get_rate(allow_offline=True)
-        if cached_rate:
-            self.current_rate = cached_rate
-            self.rate_source = "cache"
+    def load_cached_rate(self, probe_network: bool = True) -> bool:
+        # С probe_network=False курс читается из кэша без обращения к
+        # сети, для быстрого старта интерфейса
+        cached_rate = self.cache_manager.get_rate(
+            allow_offline=True, probe_network=probe_network
+        )
+        if not cached_rate:
+            return False
+        self.current_rate = cached_rate
+        self.rate_source = "cache"
+        return True
+
+    def _apply_offline_rate(self) -> bool:
+        if self.load_cached_rate():
+            return True
+
+        bundle = self.bundle
+        if bundle is not None and bundle.rate:
+            self.current_rate = bundle.rate
+            self.rate_source = "bundle"
             return True
 
         self.current_rate = self.cache_manager.persistent_cache.default_data[
@@ -373,61 +2487,215 @@ class CurrencyConverterCore:
         self.rate_source = "manual"
         logger.info(f"Курс установлен вручную: {rate}")
 
-    def convert_currency(self, amount: float, reverse: bool = False) -> dict:
+    def convert_currency(
+        self,
+        amount: float,
+        reverse: bool = False,
+        as_of: Optional[date] = None,
+    ) -> dict:
+        return self.convert_currency_result(amount, reverse, as_of).to_dict()
+
+    def convert_currency_result(
+        self,
+        amount: float,
+        reverse: bool = False,
+        as_of: Optional[date] = None,
+    ) -> Union[ConversionResult, ConversionError]:
+        if as_of is not None:
+            return self._convert_as_of(amount, reverse, as_of)
         if not self.current_rate:
-            return {"error": "Курс валют недоступен"}
+            return RATE_UNAVAILABLE
+        return self._convert_with_rate(amount, reverse, self.current_rate)
 
+    def _convert_as_of(
+        self, amount: float, reverse: bool, as_of: date
+    ) -> Union[ConversionResult, ConversionError]:
+        found = self.history.rate_as_of("UAH", as_of)
+        if found is None:
+            return ConversionError(
+                f"Нет исторического курса на {as_of.isoformat()}"
+            )
+        rate_date, rate = found
+        return self._convert_with_rate(
+            amount, reverse, rate, rate_date.isoformat()
+        )
+
+    def _convert_with_rate(
+        self,
+        amount: float,
+        reverse: bool,
+        rate: float,
+        rate_date: Optional[str] = None,
+    ) -> ConversionResult:
+        result = self.convert_amount(amount, rate, reverse)
         if reverse:
-            result = round(amount / self.current_rate, 2)
-            return {
-                "amount": amount,
-                "result": result,
-                "from_currency": "RUB",
-                "to_currency": "UAH",
-                "rate": self.current_rate,
-            }
+            return ConversionResult(
+                amount, result, "RUB", "UAH", rate, rate_date
+            )
         else:
-            result = round(amount * self.current_rate, 2)
-            return {
-                "amount": amount,
-                "result": result,
-                "from_currency": "UAH",
-                "to_currency": "RUB",
-                "rate": self.current_rate,
-            }
+            return ConversionResult(
+                amount, result, "UAH", "RUB", rate, rate_date
+            )
+
+    @staticmethod
+    def convert_amount(amount: float, rate: float, reverse: bool) -> float:
+        return round(amount / rate, 2) if reverse else round(amount * rate, 2)
+
+    @staticmethod
+    def steam_pay_amount(
+        amount: float, rate: float, from_uah: bool, currency: str
+    ) -> float:
+        # Пересчет из гривен нужен только для рублевого кошелька, для
+        # гривневого сумма уже в валюте кошелька
+        if from_uah and currency == "RUB":
+            return round(amount * rate, 2)
+        return amount
 
-    def convert_to_steam(self, amount: float, from_uah: bool = False) -> dict:
+    @staticmethod
+    def steam_wallet_error(
+        currency: str, from_uah: bool
+    ) -> Optional[ConversionError]:
+        if not SteamCalculator.supports(currency):
+            return ConversionError(f"Валюта {currency} не поддерживается")
+        # Кросс-курса UAH к KZT и USD нет, поэтому сумму в гривнах нельзя
+        # молча считать суммой в валюте кошелька
+        if from_uah and currency not in UAH_STEAM_WALLETS:
+            return ConversionError(
+                f"Пересчет из UAH для кошелька {currency} не поддерживается"
+            )
+        return None
+
+    def convert_to_steam(
+        self, amount: float, from_uah: bool = False, currency: str = "RUB"
+    ) -> dict:
+        return self.convert_to_steam_result(
+            amount, from_uah, currency
+        ).to_dict()
+
+    @tracer.traced("convert_to_steam")
+    def convert_to_steam_result(
+        self, amount: float, from_uah: bool = False, currency: str = "RUB"
+    ) -> Union[SteamConversionResult, ConversionError]:
         if not self.current_rate:
-            return {"error": "Курс валют недоступен"}
+            return RATE_UNAVAILABLE
+        error = self.steam_wallet_error(currency, from_uah)
+        if error is not None:
+            return error
+
+        pay_amount = self._steam_pay_amount(amount, from_uah, currency)
+        data = self.steam_calculator.calculate_commission(
+            pay_amount, self._is_effectively_online(), currency
+        )
+        return self._steam_result(amount, from_uah, currency, pay_amount, data)
+
+    def convert_to_steam_batch(
+        self,
+        items: list[Union[float, tuple[float, str]]],
+        from_uah: bool = False,
+    ) -> list[dict]:
+        return [
+            result.to_dict()
+            for result in self.convert_to_steam_batch_results(items, from_uah)
+        ]
+
+    @tracer.traced("convert_to_steam_batch")
+    def convert_to_steam_batch_results(
+        self,
+        items: list[Union[float, tuple[float, str]]],
+        from_uah: bool = False,
+        persist: bool = True,
+    ) -> list[Union[SteamConversionResult, ConversionError]]:
+        # persist=False откладывает запись кэша, вызывающий сохраняет его
+        # сам через cache_manager.save() после серии пакетов
+        if not self.current_rate:
+            return [RATE_UNAVAILABLE] * len(items)
+        prepared, quote_items = self._prepare_steam_batch(items, from_uah)
+        quotes = self.steam_calculator.quote_many(
+            quote_items, self._is_effectively_online(), persist
+        )
+        return self._finish_steam_batch(prepared, quotes, from_uah)
+
+    def _prepare_steam_batch(
+        self,
+        items: list[Union[float, tuple[float, str]]],
+        from_uah: bool,
+    ) -> tuple[list[tuple[float, str, float]], list[tuple[float, str]]]:
+        prepared = []
+        for item in items:
+            amount, currency = (
+                item if isinstance(item, tuple) else (item, "RUB")
+            )
+            pay_amount = self._steam_pay_amount(amount, from_uah, currency)
+            prepared.append((amount, currency, pay_amount))
+        quote_items = [
+            (pay_amount, currency)
+            for _, currency, pay_amount in prepared
+            if self.steam_wallet_error(currency, from_uah) is None
+        ]
+        return prepared, quote_items
 
+    def _finish_steam_batch(
+        self,
+        prepared: list[tuple[float, str, float]],
+        quotes: dict[tuple[float, str], float],
+        from_uah: bool,
+    ) -> list[Union[SteamConversionResult, ConversionError]]:
+        results = []
+        for amount, currency, pay_amount in prepared:
+            error = self.steam_wallet_error(currency, from_uah)
+            if error is not None:
+                results.append(error)
+                continue
+            data = self.steam_calculator.build_commission(
+                pay_amount, quotes[(pay_amount, currency)], currency
+            )
+            results.append(
+                self._steam_result(
+                    amount, from_uah, currency, pay_amount, data
+                )
+            )
+        return results
+
+    def _is_effectively_online(self) -> bool:
         # В ручном режиме считаем, что мы онлайн для расчетов комиссии
-        is_effectively_online = self.is_online or self.rate_source == 'manual'
+        return self.is_online or self.rate_source == 'manual'
 
-        if from_uah:
-            rub_amount = round(amount * self.current_rate, 2)
-            data = self.steam_calculator.calculate_commission(
-                rub_amount, is_effectively_online
+    def _steam_pay_amount(
+        self, amount: float, from_uah: bool, currency: str
+    ) -> float:
+        return self.steam_pay_amount(
+            amount, self.current_rate, from_uah, currency
+        )
+
+    def _steam_result(
+        self,
+        amount: float,
+        from_uah: bool,
+        currency: str,
+        pay_amount: float,
+        data: CommissionData,
+    ) -> SteamConversionResult:
+        if from_uah and currency == "RUB":
+            return SteamConversionResult(
+                amount,
+                "UAH",
+                pay_amount,
+                data.result,
+                currency,
+                data.commission,
+                data.commission_amount,
+                self.current_rate,
             )
-            return {
-                "amount": amount,
-                "from_currency": "UAH",
-                "rub_amount": rub_amount,
-                "steam_result": data.result,
-                "commission": format_number(round(data.commission * 100, 2)),
-                "commission_amount": format_number(data.commission_amount),
-                "rate": self.current_rate,
-            }
         else:
-            data = self.steam_calculator.calculate_commission(
-                amount, is_effectively_online
+            return SteamConversionResult(
+                amount,
+                currency,
+                None,
+                data.result,
+                currency,
+                data.commission,
+                data.commission_amount,
             )
-            return {
-                "amount": amount,
-                "from_currency": "RUB",
-                "steam_result": data.result,
-                "commission": format_number(round(data.commission * 100, 2)),
-                "commission_amount": format_number(data.commission_amount),
-            }
 
     def get_status_info(self) -> dict:
         cache_age = self.cache_manager.get_cache_age_info()
@@ -444,4 +2712,23 @@ class CurrencyConverterCore:
             "cache_age": cache_age,
             "rate_source": self.rate_source,
             "rate_display": rate_display,
+            "metrics": metrics.snapshot(),
+            "steam_keys": self.steam_calculator.key_canonicalizer.stats(),
+            "rate_providers": self._rate_provider_stats(),
+            "steam_ttl": self._steam_ttl_stats(),
+            "bundle": (
+                self._bundle.stats() if self._bundle is not None else None
+            ),
+        }
+
+    def _steam_ttl_stats(self) -> Optional[dict]:
+        policy = self.cache_manager.steam_ttl_policy
+        return policy.export_stats() if policy is not None else None
+
+    def _rate_provider_stats(self) -> dict:
+        # В порядке, в котором источники будут опрошены
+        chain = self.api_client.rate_chain
+        stats = chain.export_stats()
+        return {
+            provider.name: stats[provider.name] for provider in chain.ordered()
         }
@@ -1,7 +1,24 @@
 import customtkinter as ctk
+import csv
+import logging
+import queue
 import threading
 import sys
-from core import CurrencyConverterCore, format_number
+import time
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from tkinter import filedialog
+from core import (
+    ConversionError,
+    CurrencyConverterCore,
+    format_number,
+    metrics,
+)
+from memory_watchdog import MemoryWatchdog
+from ui_watchdog import TkWatchdog
+
+logger = logging.getLogger(__name__)
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
@@ -104,11 +121,523 @@ class ManualRateDialog(ctk.CTkToplevel):
         return self.result
 
 
+class VirtualTable(ctk.CTkFrame):
+    ROW_HEIGHT = 24
+    BG_COLOR = "#242424"
+    STRIPE_COLOR = "#2b2b2b"
+    HEADER_COLOR = "#333333"
+    TEXT_COLOR = "#DCE4EE"
+
+    def __init__(self, master, columns: list[tuple[str, int]], row_source):
+        super().__init__(master)
+        # Отрисовываются только видимые строки: набор элементов Canvas
+        # постоянный, при прокрутке меняется только их текст
+        self.columns = columns
+        self.row_source = row_source
+        self.row_count = 0
+        self.first_row = 0
+        self.on_scroll = None
+        self._rows: list[tuple[int, list[int]]] = []
+        self.font = ctk.CTkFont(size=13)
+        self.header_font = ctk.CTkFont(size=13, weight="bold")
+
+        self.canvas = tk.Canvas(
+            self, bg=self.BG_COLOR, highlightthickness=0, bd=0
+        )
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.pack(side='right', fill='y')
+        self.canvas.pack(side='left', fill='both', expand=True)
+
+        self.canvas.bind("<Configure>", self._layout)
+        for widget in (self.canvas, self.scrollbar):
+            widget.bind("<MouseWheel>", self._on_mousewheel)
+            widget.bind("<Button-4>", lambda e: self.scroll_by(-3))
+            widget.bind("<Button-5>", lambda e: self.scroll_by(3))
+
+    @property
+    def visible_rows(self) -> int:
+        return len(self._rows)
+
+    def visible_range(self) -> range:
+        return range(
+            self.first_row,
+            min(self.first_row + self.visible_rows, self.row_count),
+        )
+
+    def set_row_count(self, count: int):
+        self.row_count = count
+        self.first_row = 0
+        self.refresh()
+
+    def _layout(self, event=None):
+        self.canvas.delete("all")
+        height = self.canvas.winfo_height()
+        width = self.canvas.winfo_width()
+
+        self.canvas.create_rectangle(
+            0, 0, width, self.ROW_HEIGHT, fill=self.HEADER_COLOR, width=0
+        )
+        x = 8
+        for title, column_width in self.columns:
+            self.canvas.create_text(
+                x,
+                self.ROW_HEIGHT // 2,
+                text=title,
+                anchor='w',
+                fill=self.TEXT_COLOR,
+                font=self.header_font,
+            )
+            x += column_width
+
+        self._rows = []
+        visible = max(0, height // self.ROW_HEIGHT - 1)
+        for i in range(visible):
+            top = (i + 1) * self.ROW_HEIGHT
+            stripe = self.canvas.create_rectangle(
+                0, top, width, top + self.ROW_HEIGHT, width=0
+            )
+            cells, x = [], 8
+            for _, column_width in self.columns:
+                cells.append(
+                    self.canvas.create_text(
+                        x,
+                        top + self.ROW_HEIGHT // 2,
+                        anchor='w',
+                        fill=self.TEXT_COLOR,
+                        font=self.font,
+                    )
+                )
+                x += column_width
+            self._rows.append((stripe, cells))
+        self.refresh()
+
+    def refresh(self):
+        self.first_row = max(
+            0, min(self.first_row, self.row_count - self.visible_rows)
+        )
+        for offset, (stripe, cells) in enumerate(self._rows):
+            index = self.first_row + offset
+            if index < self.row_count:
+                values = self.row_source(index)
+                fill = self.STRIPE_COLOR if index % 2 else self.BG_COLOR
+            else:
+                values = ("",) * len(cells)
+                fill = self.BG_COLOR
+            self.canvas.itemconfigure(stripe, fill=fill)
+            for cell, value in zip(cells, values):
+                self.canvas.itemconfigure(cell, text=value)
+        self._update_scrollbar()
+
+    def refresh_rows(self, indices):
+        visible = self.visible_range()
+        if any(index in visible for index in indices):
+            self.refresh()
+
+    def scroll_to(self, first_row: int):
+        first_row = max(
+            0, min(int(first_row), self.row_count - self.visible_rows)
+        )
+        if first_row != self.first_row:
+            self.first_row = first_row
+            self.refresh()
+            if self.on_scroll:
+                self.on_scroll()
+
+    def scroll_by(self, rows: int):
+        self.scroll_to(self.first_row + rows)
+
+    def _on_mousewheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(float(value) * self.row_count)
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_by(int(value) * step)
+
+    def _update_scrollbar(self):
+        if not self.row_count:
+            self.scrollbar.set(0, 1)
+            return
+        self.scrollbar.set(
+            self.first_row / self.row_count,
+            min(1.0, (self.first_row + self.visible_rows) / self.row_count),
+        )
+
+
+def parse_amounts(text: str) -> list[Optional[float]]:
+    # Из каждой строки берется первая ячейка, как при вставке колонки
+    # из таблицы. Пробелы внутри числа считаются разделителями разрядов
+    amounts = []
+    for line in text.splitlines():
+        cell = line.split('\t')[0].split(';')[0].strip()
+        if not cell:
+            continue
+        cell = cell.replace('\u00a0', '').replace(' ', '').replace(',', '.')
+        try:
+            amount = float(cell)
+        except ValueError:
+            amounts.append(None)
+            continue
+        amounts.append(amount if amount > 0 else None)
+    return amounts
+
+
+class BulkConversionWindow(ctk.CTkToplevel):
+    BATCH_SIZE = 200
+    DRAIN_INTERVAL = 50
+    COLUMNS = [
+        ("#", 70),
+        ("Сумма", 130),
+        ("Результат", 140),
+        ("Steam", 120),
+        ("Комиссия", 160),
+    ]
+
+    def __init__(self, parent, converter: CurrencyConverterCore):
+        super().__init__(parent)
+        self.converter = converter
+        self.amounts: list[Optional[float]] = []
+        self.invalid = 0
+        self.regular: list[str] = []
+        self.steam: dict[float, tuple[str, str]] = {}
+        self._rows_by_amount: dict[float, list[int]] = {}
+        self._results: queue.SimpleQueue = queue.SimpleQueue()
+        self._priority: queue.SimpleQueue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._pipeline: Optional[threading.Thread] = None
+        self._generation = 0
+        self._drain_id: Optional[str] = None
+
+        self.title("Пакетная конвертация")
+        self.geometry("720x620")
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        toolbar = ctk.CTkFrame(self, fg_color="transparent")
+        toolbar.pack(fill='x', padx=15, pady=(15, 5))
+        ctk.CTkButton(
+            toolbar, text="📋 Вставить", width=110, command=self.paste
+        ).pack(side='left', padx=(0, 5))
+        ctk.CTkButton(
+            toolbar, text="📂 Открыть", width=110, command=self.open_file
+        ).pack(side='left', padx=5)
+        ctk.CTkButton(
+            toolbar,
+            text="💾 Экспорт",
+            width=110,
+            command=self.export,
+            fg_color="#555555",
+            hover_color="#666666",
+        ).pack(side='right')
+
+        options = ctk.CTkFrame(self, fg_color="transparent")
+        options.pack(fill='x', padx=15, pady=5)
+        self.mode = ctk.StringVar(value="uah_to_rub")
+        ctk.CTkRadioButton(
+            options,
+            text="Гривны → Рубли",
+            variable=self.mode,
+            value="uah_to_rub",
+            command=self._recalculate,
+        ).pack(side='left', padx=(0, 20))
+        ctk.CTkRadioButton(
+            options,
+            text="Рубли → Гривны",
+            variable=self.mode,
+            value="rub_to_uah",
+            command=self._recalculate,
+        ).pack(side='left', padx=(0, 20))
+        self.steam_enabled = ctk.CTkCheckBox(
+            options,
+            text="Steam",
+            command=self._recalculate,
+            text_color="#1f9eff",
+        )
+        self.steam_enabled.pack(side='left')
+
+        self.table = VirtualTable(self, self.COLUMNS, self._row)
+        self.table.on_scroll = self._prioritize_visible
+        self.table.pack(fill='both', expand=True, padx=15, pady=5)
+
+        self.status_label = ctk.CTkLabel(
+            self,
+            text="Вставьте колонку сумм или откройте файл",
+            font=ctk.CTkFont(size=12),
+            text_color="#888888",
+        )
+        self.status_label.pack(pady=(0, 10))
+
+    def paste(self):
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            self.status_label.configure(text="❌ Буфер обмена пуст")
+            return
+        self.load(parse_amounts(text))
+
+    def open_file(self):
+        path = filedialog.askopenfilename(
+            parent=self,
+            filetypes=[("Текст и CSV", "*.txt *.csv"), ("Все файлы", "*.*")],
+        )
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self.status_label.configure(text=f"❌ Ошибка чтения: {e}")
+            return
+        self.load(parse_amounts(text))
+
+    def load(self, amounts: list[Optional[float]]):
+        self.amounts = amounts
+        self._recalculate()
+
+    def _recalculate(self):
+        rate = self.converter.current_rate
+        reverse = self.mode.get() == "rub_to_uah"
+        self.invalid = sum(1 for amount in self.amounts if amount is None)
+        self.regular = [
+            (
+                "❌"
+                if amount is None or not rate
+                else str(
+                    format_number(
+                        CurrencyConverterCore.convert_amount(
+                            amount, rate, reverse
+                        )
+                    )
+                )
+            )
+            for amount in self.amounts
+        ]
+        self._stop.set()
+        self._stop = threading.Event()
+        self._generation += 1
+        self.steam = {}
+        self._rows_by_amount = {}
+        if self.steam_enabled.get():
+            # Строки с одинаковой суммой получают одну котировку
+            for index, amount in enumerate(self.amounts):
+                if amount is not None:
+                    self._rows_by_amount.setdefault(amount, []).append(index)
+        self.table.set_row_count(len(self.amounts))
+        self._update_status()
+        if self._rows_by_amount:
+            self._start_pipeline()
+
+    def _start_pipeline(self):
+        self._priority = queue.SimpleQueue()
+        self._prioritize_visible()
+        self._pipeline = threading.Thread(
+            target=self._quote_pipeline,
+            args=(
+                list(self._rows_by_amount),
+                self.mode.get() == "uah_to_rub",
+                self._stop,
+                self._priority,
+                self._generation,
+            ),
+            daemon=True,
+        )
+        self._pipeline.start()
+        self._schedule_drain()
+
+    def _schedule_drain(self):
+        if self._drain_id is None:
+            self._drain_id = self.after(self.DRAIN_INTERVAL, self._drain)
+
+    def _prioritize_visible(self):
+        # Видимые строки запрашиваются раньше остальных
+        if not self._rows_by_amount:
+            return
+        self._priority.put(
+            [
+                self.amounts[index]
+                for index in self.table.visible_range()
+                if self.amounts[index] is not None
+                and self.amounts[index] not in self.steam
+            ]
+        )
+
+    def _quote_pipeline(
+        self,
+        amounts: list[float],
+        from_uah: bool,
+        stop: threading.Event,
+        priority: queue.SimpleQueue,
+        generation: int,
+    ):
+        done: set[float] = set()
+        remaining = iter(amounts)
+        while not stop.is_set():
+            batch: dict[float, None] = {}
+            while not priority.empty():
+                for amount in priority.get():
+                    if amount not in done and len(batch) < self.BATCH_SIZE:
+                        batch[amount] = None
+            while len(batch) < self.BATCH_SIZE:
+                amount = next(remaining, None)
+                if amount is None:
+                    break
+                if amount not in done:
+                    batch[amount] = None
+            if not batch:
+                break
+            batch = list(batch)
+            results = self.converter.convert_to_steam_batch_results(
+                batch, from_uah=from_uah, persist=False
+            )
+            done.update(batch)
+            self._results.put((generation, list(zip(batch, results))))
+        self.converter.cache_manager.save()
+
+    def _drain(self):
+        # Результаты из фонового потока применяются порциями, чтобы не
+        # блокировать цикл Tk
+        self._drain_id = None
+        updated = []
+        deadline = time.perf_counter() + 0.02
+        while time.perf_counter() < deadline:
+            try:
+                generation, items = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                continue
+            for amount, result in items:
+                self.steam[amount] = self._format_steam(result)
+                updated.extend(self._rows_by_amount.get(amount, ()))
+        if updated:
+            self.table.refresh_rows(updated)
+            self._update_status()
+        # После завершения потока опрос идет, пока очередь не опустеет
+        pipeline = self._pipeline
+        if (
+            pipeline is not None and pipeline.is_alive()
+        ) or not self._results.empty():
+            self._schedule_drain()
+
+    @staticmethod
+    def _format_steam(result) -> tuple[str, str]:
+        if isinstance(result, ConversionError):
+            return "❌", result.error
+        return (
+            str(result.steam_result),
+            f"{result.commission_amount} ({result.commission}%)",
+        )
+
+    def _row(self, index: int) -> tuple[str, ...]:
+        amount = self.amounts[index]
+        if amount is None:
+            return str(index + 1), "❌", "", "", ""
+        steam, commission = "", ""
+        if self._rows_by_amount:
+            steam, commission = self.steam.get(amount, ("⏳", ""))
+        return (
+            str(index + 1),
+            str(format_number(amount)),
+            self.regular[index],
+            steam,
+            commission,
+        )
+
+    def _update_status(self):
+        text = f"Строк: {len(self.amounts)} | Ошибок: {self.invalid}"
+        if self._rows_by_amount:
+            text += (
+                f" | Steam: {len(self.steam)} из "
+                f"{len(self._rows_by_amount)} сумм"
+            )
+        self.status_label.configure(text=text)
+
+    def export(self):
+        if not self.amounts:
+            self.status_label.configure(text="❌ Нет данных для экспорта")
+            return
+        path = filedialog.asksaveasfilename(
+            parent=self,
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv")],
+        )
+        if not path:
+            return
+        to_code = "UAH" if self.mode.get() == "rub_to_uah" else "RUB"
+        try:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(
+                    ["amount", to_code, "steam_result", "commission"]
+                )
+                for index in range(len(self.amounts)):
+                    _, amount, regular, steam, commission = self._row(index)
+                    writer.writerow(
+                        [
+                            amount,
+                            regular,
+                            "" if steam == "⏳" else steam,
+                            commission,
+                        ]
+                    )
+        except OSError as e:
+            self.status_label.configure(text=f"❌ Ошибка сохранения: {e}")
+            return
+        self.status_label.configure(text=f"💾 Сохранено: {path}")
+
+    def _on_close(self):
+        self.destroy()
+
+    def destroy(self):
+        # Окно закрывается и вместе с главным окном, минуя _on_close
+        self._stop.set()
+        if self._drain_id is not None:
+            self.after_cancel(self._drain_id)
+            self._drain_id = None
+        super().destroy()
+
+
 class ModernCurrencyConverterGUI:
-    def __init__(self, force_manual_mode=False):
+    # Бюджет запуска в секундах, превышение пишется в лог
+    STARTUP_BUDGET = {"first_paint": 0.5, "interactive": 1.0}
+    STARTUP_PHASES = {
+        "first_paint": "Первая отрисовка",
+        "interactive": "Готов к вводу",
+        "fresh_rate": "Актуальный курс",
+    }
+
+    def __init__(
+        self,
+        force_manual_mode=False,
+        show_timings=False,
+        watchdog=False,
+        memory_budget: Optional[float] = None,
+    ):
+        self.started_at = time.perf_counter()
+        self.startup_timings: dict[str, float] = {}
+        self.show_timings = show_timings
         self.converter = CurrencyConverterCore()
         self.conversion_timer = None
         self.force_manual_mode = force_manual_mode
+        self.steam_frame = None
+        self.manual_rate_button = None
+        self.bulk_window = None
+        self.steam_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="steam"
+        )
+        self._steam_generation = 0
+        self.watchdog = None
+        if watchdog:
+            # Устанавливается до создания окна, чтобы измерять все
+            # обработчики Tk
+            self.watchdog = TkWatchdog()
+            self.watchdog.install()
+        self.memory_watchdog = None
+        if memory_budget:
+            self.memory_watchdog = MemoryWatchdog(
+                self.converter, budget_mb=memory_budget
+            ).start()
 
         self.root = ctk.CTk()
         self.root.title("Конвертер валют")
@@ -116,9 +645,43 @@ class ModernCurrencyConverterGUI:
         self.root.resizable(False, False)
 
         self.setup_ui()
+        if self.watchdog:
+            self.watchdog.start(self.root)
+        self.root.bind("<Expose>", self._on_first_paint, add="+")
         if not self.force_manual_mode:
+            # Окно сразу показывает курс из кэша без проверки сети,
+            # проверка и обновление идут в фоне
+            if self.converter.load_cached_rate(probe_network=False):
+                self._update_rate_label(
+                    self.converter.get_status_info(), is_initial_load=True
+                )
             self.refresh_rates_threaded(is_initial_load=True)
 
+    def _on_first_paint(self, event):
+        if (
+            event.widget is not self.root
+            or "first_paint" in self.startup_timings
+        ):
+            return
+        self._mark_startup("first_paint")
+        self.root.after_idle(self._mark_startup, "interactive")
+
+    def _mark_startup(self, phase: str):
+        elapsed = time.perf_counter() - self.started_at
+        self.startup_timings[phase] = elapsed
+        metrics.observe("gui_startup_seconds", elapsed, phase=phase)
+        budget = self.STARTUP_BUDGET.get(phase)
+        if budget is not None and elapsed > budget:
+            logger.warning(
+                f"Запуск GUI: {self.STARTUP_PHASES[phase]} за "
+                f"{elapsed * 1000:.0f} мс, бюджет {budget * 1000:.0f} мс"
+            )
+        if self.show_timings:
+            print(
+                f"⏱ {self.STARTUP_PHASES[phase]}: {elapsed * 1000:.0f} мс",
+                file=sys.stderr,
+            )
+
     def handle_key_press(self, event):
         if event.state & 4 and event.keysym.lower() == 'a':
             event.widget.select_range(0, 'end')
@@ -138,14 +701,6 @@ class ModernCurrencyConverterGUI:
         )
         self.status_label.pack(pady=(0, 5))
 
-        self.manual_rate_button = ctk.CTkButton(
-            self.root,
-            text="🖊 Ввести курс вручную",
-            command=self.prompt_for_manual_rate,
-            fg_color="#555555",
-            hover_color="#666666",
-        )
-
         input_frame = ctk.CTkFrame(self.root, fg_color="transparent")
         input_frame.pack(fill='x', padx=30, pady=(15, 30))
 
@@ -171,6 +726,18 @@ class ModernCurrencyConverterGUI:
         )
         self.refresh_btn.pack(side='right')
 
+        self.bulk_btn = ctk.CTkButton(
+            input_frame,
+            text="📋",
+            width=50,
+            height=40,
+            command=self.open_bulk_window,
+            font=ctk.CTkFont(size=18),
+            fg_color="#555555",
+            hover_color="#666666",
+        )
+        self.bulk_btn.pack(side='right', padx=(0, 10))
+
         self._setup_conversion_frames()
 
     def _setup_conversion_frames(self):
@@ -218,6 +785,8 @@ class ModernCurrencyConverterGUI:
         )
         self.steam_checkbox.pack(pady=15)
 
+    def _build_steam_frame(self):
+        # Раздел Steam скрыт при запуске и строится при первом включении
         self.steam_frame = ctk.CTkFrame(self.root)
         ctk.CTkLabel(
             self.steam_frame,
@@ -300,15 +869,23 @@ class ModernCurrencyConverterGUI:
     def _perform_steam_conversion(self, amount: float):
         self.steam_result.configure(text="🎮 Steam результат: ⏳")
         self.commission_label.configure(text="💸 Комиссия: ⏳")
+        # Один рабочий поток на все расчеты: запросы, устаревшие к моменту
+        # запуска, пропускаются, а не копятся отдельными потоками
+        self._steam_generation += 1
+        generation = self._steam_generation
+        is_from_uah = self.steam_mode.get() == "uah_to_steam_rub"
 
         def task():
-            is_from_uah = self.steam_mode.get() == "uah_to_steam_rub"
+            if generation != self._steam_generation:
+                return
             res = self.converter.convert_to_steam(amount, from_uah=is_from_uah)
-            self.root.after(0, self._update_steam_ui, res, amount)
+            self.root.after(0, self._update_steam_ui, res, amount, generation)
 
-        threading.Thread(target=task, daemon=True).start()
+        self.steam_executor.submit(task)
 
-    def _update_steam_ui(self, result: dict, amount: float):
+    def _update_steam_ui(self, result: dict, amount: float, generation: int):
+        if generation != self._steam_generation:
+            return
         if "error" in result:
             self.steam_result.configure(
                 text=f"🎮 Steam результат: {result['error']}"
@@ -327,8 +904,15 @@ class ModernCurrencyConverterGUI:
             comm_text += f" | Заплатите: {format_number(amount)}₽"
         self.commission_label.configure(text=comm_text)
 
+    def open_bulk_window(self):
+        if self.bulk_window is None or not self.bulk_window.winfo_exists():
+            self.bulk_window = BulkConversionWindow(self.root, self.converter)
+        self.bulk_window.focus()
+
     def toggle_steam_mode(self):
         if self.steam_checkbox.get():
+            if self.steam_frame is None:
+                self._build_steam_frame()
             self.steam_frame.pack(fill='x', padx=30, pady=(0, 20))
             self.perform_conversion()
         else:
@@ -349,8 +933,39 @@ class ModernCurrencyConverterGUI:
         self.root.after(0, self._update_ui_after_refresh, is_initial_load)
 
     def _update_ui_after_refresh(self, is_initial_load: bool):
+        if is_initial_load and "fresh_rate" not in self.startup_timings:
+            self._mark_startup("fresh_rate")
         status = self.converter.get_status_info()
-        self.manual_rate_button.pack_forget()
+        if self.manual_rate_button is not None:
+            self.manual_rate_button.pack_forget()
+        self._update_rate_label(status, is_initial_load)
+
+        if self.force_manual_mode or status['rate_source'] in [
+            'default',
+            'manual',
+        ]:
+            self._show_manual_rate_button()
+
+        status_text = (
+            "🟢 Онлайн | 📈 Актуальные данные"
+            if status['is_online']
+            else f"🔴 Офлайн | 💾 Кэш ({status.get('cache_age', 'N/A')})"
+        )
+        if status['rate_source'] == 'default':
+            status_text = "🔴 Офлайн | 📌 Данные по умолчанию"
+        elif status['rate_source'] == 'manual':
+            status_text = "🔴 Офлайн | 🖊 Ручной ввод"
+        elif status['rate_source'] == 'bundle' and status['bundle']:
+            status_text = (
+                f"🔴 Офлайн | 📦 Пакет от {status['bundle']['created_at']}"
+            )
+        self.status_label.configure(text=status_text)
+
+        self.perform_conversion()
+        if not is_initial_load:
+            self.refresh_btn.configure(text="🔄", state='normal')
+
+    def _update_rate_label(self, status: dict, is_initial_load: bool):
         default_color = ctk.ThemeManager.theme["CTkLabel"]["text_color"]
 
         if status['rate_source'] == 'api':
@@ -374,33 +989,27 @@ class ModernCurrencyConverterGUI:
             self.rate_label.configure(
                 text=f"🖊 {status['rate_display']}", text_color="#1f9eff"
             )
+        elif status['rate_source'] == 'bundle':
+            self.rate_label.configure(
+                text=f"📦 {status['rate_display']}", text_color="#FF9500"
+            )
         elif status['rate_source'] == 'default':
             self.rate_label.configure(
                 text=f"📌 {status['rate_display']}", text_color="#FF6B6B"
             )
 
-        if self.force_manual_mode or status['rate_source'] in [
-            'default',
-            'manual',
-        ]:
-            self.manual_rate_button.pack(
-                before=self.amount_entry.master, pady=(0, 15)
+    def _show_manual_rate_button(self):
+        if self.manual_rate_button is None:
+            self.manual_rate_button = ctk.CTkButton(
+                self.root,
+                text="🖊 Ввести курс вручную",
+                command=self.prompt_for_manual_rate,
+                fg_color="#555555",
+                hover_color="#666666",
             )
-
-        status_text = (
-            "🟢 Онлайн | 📈 Актуальные данные"
-            if status['is_online']
-            else f"🔴 Офлайн | 💾 Кэш ({status.get('cache_age', 'N/A')})"
+        self.manual_rate_button.pack(
+            before=self.amount_entry.master, pady=(0, 15)
         )
-        if status['rate_source'] == 'default':
-            status_text = "🔴 Офлайн | 📌 Данные по умолчанию"
-        elif status['rate_source'] == 'manual':
-            status_text = "🔴 Офлайн | 🖊 Ручной ввод"
-        self.status_label.configure(text=status_text)
-
-        self.perform_conversion()
-        if not is_initial_load:
-            self.refresh_btn.configure(text="🔄", state='normal')
 
     def prompt_for_manual_rate(self, exit_on_cancel=False):
         dialog = ManualRateDialog(self.root)
@@ -426,18 +1035,45 @@ class ModernCurrencyConverterGUI:
             self.commission_label.configure(text="💸 Комиссия: ✖️")
 
     def run(self):
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.steam_executor.shutdown(wait=False, cancel_futures=True)
+            if self.watchdog:
+                self.watchdog.stop()
+                print(self.watchdog.report(), file=sys.stderr)
+            if self.memory_watchdog:
+                self.memory_watchdog.stop()
+                print(self.memory_watchdog.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
     force_manual_mode = any(arg in ['-m', '--manual-rate'] for arg in sys.argv)
-    app = ModernCurrencyConverterGUI(force_manual_mode=force_manual_mode)
+    show_timings = '--timings' in sys.argv
+    argv = sys.argv[1:]
+    memory_budget = None
+    if '--memory-budget' in argv:
+        index = argv.index('--memory-budget')
+        try:
+            memory_budget = float(argv[index + 1])
+        except (IndexError, ValueError):
+            print("--memory-budget: укажите бюджет в МБ", file=sys.stderr)
+            sys.exit(2)
+        del argv[index : index + 2]
+    app = ModernCurrencyConverterGUI(
+        force_manual_mode=force_manual_mode,
+        show_timings=show_timings,
+        watchdog='--watchdog' in argv,
+        memory_budget=memory_budget,
+    )
 
     if app.force_manual_mode:
         app.prompt_for_manual_rate(exit_on_cancel=True)
 
     other_args = [
-        arg for arg in sys.argv[1:] if arg not in ['-m', '--manual-rate']
+        arg
+        for arg in argv
+        if arg not in ['-m', '--manual-rate', '--timings', '--watchdog']
     ]
 
     for arg in other_args:
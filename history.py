@@ -0,0 +1,229 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from core import APIClient, metrics, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class RateHistory:
+    MAGIC = b"CCRH"
+    # Версия 2 добавляет после серий список дней без курса ЦБ
+    VERSION = 2
+    HEADER = struct.Struct("<4sHI")
+    SERIES_HEADER = struct.Struct("<8sI")
+    COUNT = struct.Struct("<I")
+
+    def __init__(self, path: str = "rate_history.bin"):
+        self.path = path
+        self._lock = threading.Lock()
+        # Колоночное хранение: для каждой валюты отсортированные даты
+        # (порядковый номер дня) и курсы в рублях за единицу валюты
+        self._series: dict[str, tuple[array, array]] = {}
+        # Прошедшие дни, на которые ЦБ курс не устанавливал (выходные и
+        # праздники): при дозагрузке они не запрашиваются повторно
+        self._gaps = array('i')
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    @tracer.traced("history.load")
+    def load(self):
+        series, gaps = {}, array('i')
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with (
+                    open(self.path, 'rb') as f,
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+                ):
+                    series, gaps = self._read_series(mm)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Ошибка загрузки истории курсов: {e}")
+            series, gaps = {}, array('i')
+        with self._lock:
+            self._series = series
+            self._gaps = gaps
+            self._loaded = True
+
+    def _read_series(
+        self, mm: mmap.mmap
+    ) -> tuple[dict[str, tuple[array, array]], array]:
+        magic, version, count = self.HEADER.unpack_from(mm, 0)
+        if magic != self.MAGIC or version not in (1, self.VERSION):
+            raise ValueError("неизвестный формат файла истории")
+        offset = self.HEADER.size
+        series = {}
+        for _ in range(count):
+            raw_code, rows = self.SERIES_HEADER.unpack_from(mm, offset)
+            offset += self.SERIES_HEADER.size
+            days, values = array('i'), array('d')
+            days.frombytes(mm[offset : offset + rows * days.itemsize])
+            offset += rows * days.itemsize
+            values.frombytes(mm[offset : offset + rows * values.itemsize])
+            offset += rows * values.itemsize
+            series[raw_code.rstrip(b"\0").decode('ascii')] = (days, values)
+        gaps = array('i')
+        if version >= 2:
+            (rows,) = self.COUNT.unpack_from(mm, offset)
+            offset += self.COUNT.size
+            gaps.frombytes(mm[offset : offset + rows * gaps.itemsize])
+        return series, gaps
+
+    @tracer.traced("history.save")
+    def save(self):
+        with self._lock:
+            chunks = [
+                self.HEADER.pack(self.MAGIC, self.VERSION, len(self._series))
+            ]
+            for code, (days, values) in sorted(self._series.items()):
+                chunks.append(
+                    self.SERIES_HEADER.pack(code.encode('ascii'), len(days))
+                )
+                chunks.append(days.tobytes())
+                chunks.append(values.tobytes())
+            chunks.append(self.COUNT.pack(len(self._gaps)))
+            chunks.append(self._gaps.tobytes())
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.writelines(chunks)
+        os.replace(tmp_path, self.path)
+
+    def add_many(self, rows: Iterable[tuple[date, dict[str, float]]]):
+        self._ensure_loaded()
+        updates: dict[str, dict[int, float]] = {}
+        for day, rates in rows:
+            ordinal = day.toordinal()
+            for code, value in rates.items():
+                updates.setdefault(code, {})[ordinal] = value
+        with self._lock:
+            for code, new_points in updates.items():
+                days, values = self._series.get(code, (array('i'), array('d')))
+                merged = dict(zip(days, values))
+                merged.update(new_points)
+                ordered = sorted(merged)
+                self._series[code] = (
+                    array('i', ordered),
+                    array('d', (merged[d] for d in ordered)),
+                )
+            # День с появившимся курсом больше не считается пропуском
+            filled = {
+                ordinal for points in updates.values() for ordinal in points
+            }
+            if filled and self._gaps:
+                self._gaps = array(
+                    'i', (day for day in self._gaps if day not in filled)
+                )
+
+    def add_gaps(self, days: Iterable[date]):
+        self._ensure_loaded()
+        with self._lock:
+            merged = set(self._gaps)
+            merged.update(day.toordinal() for day in days)
+            self._gaps = array('i', sorted(merged))
+
+    def add(self, day: date, rates: dict[str, float]):
+        self.add_many([(day, rates)])
+
+    def rate_as_of(
+        self, currency: str, day: date
+    ) -> Optional[tuple[date, float]]:
+        self._ensure_loaded()
+        series = self._series.get(currency)
+        if not series:
+            return None
+        days, values = series
+        index = bisect_right(days, day.toordinal()) - 1
+        if index < 0:
+            return None
+        return date.fromordinal(days[index]), values[index]
+
+    def known_days(self, currency: str = "UAH") -> set[int]:
+        # Дни с курсом и дни, на которые ЦБ курс не устанавливал
+        self._ensure_loaded()
+        days, _ = self._series.get(currency, (array('i'), array('d')))
+        return set(days).union(self._gaps)
+
+    def currencies(self) -> list[str]:
+        self._ensure_loaded()
+        return sorted(self._series)
+
+    def date_range(self, currency: str = "UAH") -> Optional[tuple[date, date]]:
+        self._ensure_loaded()
+        days, _ = self._series.get(currency, (array('i'), array('d')))
+        if not days:
+            return None
+        return date.fromordinal(days[0]), date.fromordinal(days[-1])
+
+    def series_since(self, day: date) -> dict[str, tuple[array, array]]:
+        self._ensure_loaded()
+        since = day.toordinal()
+        with self._lock:
+            result = {}
+            for code, (days, values) in self._series.items():
+                start = bisect_right(days, since - 1)
+                if start < len(days):
+                    result[code] = (days[start:], values[start:])
+            return result
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return sum(len(days) for days, _ in self._series.values())
+
+    @tracer.traced("history.backfill")
+    def backfill(
+        self,
+        api_client: APIClient,
+        start: date,
+        end: date,
+        workers: int = 8,
+        force: bool = False,
+    ) -> dict:
+        known = set() if force else self.known_days()
+        total_days = (end - start).days + 1
+        pending = [
+            day
+            for day in (start + timedelta(days=i) for i in range(total_days))
+            if day.toordinal() not in known
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            fetched = list(
+                zip(pending, pool.map(api_client.get_archive_rates, pending))
+            )
+
+        rows = [(day, rates) for day, rates in fetched if rates]
+        # Пустой ответ за прошедший день - выходной или праздник, его не
+        # нужно запрашивать снова. Курс на сегодня и будущие дни может
+        # появиться позже, а ошибки (None) повторяются при следующем запуске
+        today = date.today()
+        gaps = [
+            day
+            for day, rates in fetched
+            if rates is not None and not rates and day < today
+        ]
+        if rows:
+            self.add_many(rows)
+        if gaps:
+            self.add_gaps(gaps)
+        if rows or gaps:
+            self.save()
+        failed = sum(1 for _, rates in fetched if rates is None)
+        metrics.inc("history_backfill_days_total", len(rows), result="stored")
+        metrics.inc("history_backfill_days_total", failed, result="failed")
+        metrics.inc("history_backfill_days_total", len(gaps), result="no_rate")
+        return {
+            "requested": total_days,
+            "skipped": total_days - len(pending),
+            "stored": len(rows),
+            "no_rate": len(fetched) - len(rows) - failed,
+            "failed": failed,
+        }
@@ -0,0 +1,238 @@
+import gc
+import logging
+import os
+import socket
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Optional
+
+from core import SteamCalculator, metrics, tracer
+
+logger = logging.getLogger(__name__)
+
+
+def open_sockets() -> int:
+    fd_dir = "/proc/self/fd"
+    if os.path.isdir(fd_dir):
+        count = 0
+        for name in os.listdir(fd_dir):
+            try:
+                if os.readlink(os.path.join(fd_dir, name)).startswith(
+                    "socket:"
+                ):
+                    count += 1
+            except OSError:
+                continue
+        return count
+    # Без /proc (Windows) считаются живые незакрытые объекты socket
+    return sum(
+        1
+        for obj in gc.get_objects()
+        if isinstance(obj, socket.socket) and obj.fileno() != -1
+    )
+
+
+class MemoryWatchdog:
+    # Файлы, изменения в которых не интересны при поиске утечек
+    IGNORED = (tracemalloc.__file__, "<frozen importlib._bootstrap>")
+
+    def __init__(
+        self,
+        converter=None,
+        budget_mb: Optional[float] = None,
+        interval: float = 60.0,
+        top: int = 10,
+        frames: int = 1,
+        keep_steam_entries: int = 1_000,
+    ):
+        # Периодически снимает снимок tracemalloc и сравнивает его с
+        # предыдущим по файлам и строкам. При превышении бюджета (память,
+        # отслеживаемая tracemalloc) сжимает кэши
+        self.converter = converter
+        self.budget = budget_mb * 1024 * 1024 if budget_mb else None
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self.keep_steam_entries = keep_steam_entries
+        self.checks = 0
+        self.trims = 0
+        self.history: deque[dict] = deque(maxlen=100)
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+        self._started_at = 0.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "MemoryWatchdog":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._started_at = time.perf_counter()
+        self._previous = self._snapshot()
+        self._thread = threading.Thread(
+            target=self._loop, name="memory-watchdog", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+            # Итоговая проверка, чтобы в отчете было состояние на выходе
+            self.check()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Ошибка проверки памяти: {e}")
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in self.IGNORED]
+        )
+
+    def counters(self) -> dict:
+        fallback = SteamCalculator._fallback_quote.cache_info()
+        counters = {
+            "traced_bytes": tracemalloc.get_traced_memory()[0],
+            "threads": threading.active_count(),
+            "open_sockets": open_sockets(),
+            "fallback_cache": fallback.currsize,
+            "tracer_spans": len(tracer.spans),
+            "metric_series": len(metrics.counters)
+            + len(metrics.gauges)
+            + len(metrics.histograms),
+        }
+        if self.converter is not None:
+            cache = self.converter.cache_manager
+            # Незагруженный раздел не читается ради подсчета
+            counters["steam_rates"] = (
+                len(cache._steam_rates)
+                if cache._steam_rates is not None
+                else 0
+            )
+        return counters
+
+    def check(self) -> dict:
+        snapshot = self._snapshot()
+        by_line = [
+            stat
+            for stat in snapshot.compare_to(self._previous, 'lineno')
+            if stat.size_diff > 0
+        ][: self.top]
+        by_file = [
+            stat
+            for stat in snapshot.compare_to(self._previous, 'filename')
+            if stat.size_diff > 0
+        ][: self.top]
+        self._previous = snapshot
+        self.checks += 1
+
+        counters = self.counters()
+        for name, value in counters.items():
+            metrics.gauge(f"memory_{name}", value)
+        if by_line:
+            logger.info(
+                "Рост памяти по строкам:\n"
+                + "\n".join(
+                    f"   {stat.traceback[0].filename}:"
+                    f"{stat.traceback[0].lineno} "
+                    f"+{stat.size_diff / 1024:.1f} КБ "
+                    f"({stat.count_diff:+d} блоков)"
+                    for stat in by_line
+                )
+            )
+
+        trimmed = None
+        if self.budget and counters["traced_bytes"] > self.budget:
+            logger.warning(
+                f"Превышен бюджет памяти: "
+                f"{counters['traced_bytes'] / 1024 / 1024:.1f} МБ из "
+                f"{self.budget / 1024 / 1024:.1f} МБ, сжатие кэшей"
+            )
+            trimmed = self.trim()
+            counters["traced_bytes"] = tracemalloc.get_traced_memory()[0]
+
+        entry = {
+            "time": time.time(),
+            "counters": counters,
+            "growth_by_file": [
+                (stat.traceback[0].filename, stat.size_diff)
+                for stat in by_file
+            ],
+            "growth_by_line": [
+                (
+                    f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    stat.size_diff,
+                )
+                for stat in by_line
+            ],
+            "trimmed": trimmed,
+        }
+        self.history.append(entry)
+        return entry
+
+    def trim(self) -> dict:
+        removed = 0
+        if self.converter is not None:
+            removed = self.converter.cache_manager.trim_steam_cache(
+                self.keep_steam_entries
+            )
+        fallback = SteamCalculator._fallback_quote.cache_info().currsize
+        SteamCalculator.clear_fallback_cache()
+        spans = len(tracer.spans)
+        tracer.reset()
+        collected = gc.collect()
+        self.trims += 1
+        metrics.inc("memory_trims_total")
+        return {
+            "steam_rates": removed,
+            "fallback_cache": fallback,
+            "tracer_spans": spans,
+            "gc_collected": collected,
+        }
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self._started_at
+        lines = [f"🧠 Отчет по памяти за {elapsed:.0f} с:"]
+        if not self.history:
+            lines.append("   Проверок не было")
+            return "\n".join(lines)
+        first = self.history[0]["counters"]
+        last = self.history[-1]["counters"]
+        for name, value in last.items():
+            delta = value - first.get(name, value)
+            if name == "traced_bytes":
+                lines.append(
+                    f"   Память (tracemalloc): {value / 1024 / 1024:.1f} МБ "
+                    f"({delta / 1024 / 1024:+.1f} МБ)"
+                )
+            else:
+                lines.append(f"   {name}: {value} ({delta:+d})")
+        growth: dict[str, int] = {}
+        for entry in self.history:
+            for filename, size in entry["growth_by_file"]:
+                growth[filename] = growth.get(filename, 0) + size
+        if growth:
+            lines.append("   Наибольший рост по файлам:")
+            for filename, size in sorted(
+                growth.items(), key=lambda item: item[1], reverse=True
+            )[:5]:
+                lines.append(f"      {filename}: +{size / 1024:.1f} КБ")
+        lines.append(f"   Проверок: {self.checks}, сжатий кэшей: {self.trims}")
+        return "\n".join(lines)
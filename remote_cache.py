@@ -0,0 +1,540 @@
+import json
+import logging
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Callable, Optional
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteCacheError(Exception):
+    pass
+
+
+class KVBackend:
+    # Хранилище ключ-значение для общего кэша узлов. Значения - байты,
+    # время жизни в секундах задается при записи
+    def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        raise NotImplementedError
+
+    def set_many(self, items: list[tuple[str, bytes, float]]):
+        raise NotImplementedError
+
+    def add_many(self, items: list[tuple[str, bytes, float]]) -> list[bool]:
+        # Запись только отсутствующих ключей, основа аренды
+        raise NotImplementedError
+
+    def delete_if_equal_many(
+        self, items: list[tuple[str, bytes]]
+    ) -> list[bool]:
+        # Атомарное удаление ключей, значение которых не изменилось
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(KVBackend):
+    # Хранилище в памяти процесса: для одного узла и для RESPServer
+    def __init__(self):
+        self._data: dict[str, tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key: str, now: float) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, deadline = entry
+        if deadline is not None and now >= deadline:
+            del self._data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _deadline(ttl: Optional[float], now: float) -> Optional[float]:
+        return now + ttl if ttl else None
+
+    def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        now = time.monotonic()
+        with self._lock:
+            return [self._alive(key, now) for key in keys]
+
+    def set_many(self, items: list[tuple[str, bytes, float]]):
+        now = time.monotonic()
+        with self._lock:
+            for key, value, ttl in items:
+                self._data[key] = (value, self._deadline(ttl, now))
+
+    def add_many(self, items: list[tuple[str, bytes, float]]) -> list[bool]:
+        now = time.monotonic()
+        added = []
+        with self._lock:
+            for key, value, ttl in items:
+                if self._alive(key, now) is not None:
+                    added.append(False)
+                    continue
+                self._data[key] = (value, self._deadline(ttl, now))
+                added.append(True)
+        return added
+
+    def delete(self, keys: list[str]) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def delete_if_equal_many(
+        self, items: list[tuple[str, bytes]]
+    ) -> list[bool]:
+        now = time.monotonic()
+        deleted = []
+        with self._lock:
+            for key, value in items:
+                if self._alive(key, now) != value:
+                    deleted.append(False)
+                    continue
+                del self._data[key]
+                deleted.append(True)
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(
+                1
+                for _, deadline in self._data.values()
+                if deadline is None or now < deadline
+            )
+
+
+def encode_command(*args) -> bytes:
+    chunks = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        chunks.append(f"${len(arg)}\r\n".encode())
+        chunks.append(arg)
+        chunks.append(b"\r\n")
+    return b"".join(chunks)
+
+
+def read_reply(stream):
+    # Ответ с ошибкой возвращается, а не выбрасывается, чтобы дочитать
+    # остальные ответы конвейера
+    line = stream.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("соединение закрыто")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RemoteCacheError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size == -1:
+            return None
+        data = stream.read(size + 2)
+        if len(data) != size + 2:
+            raise ConnectionError("соединение закрыто")
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        if size == -1:
+            return None
+        return [read_reply(stream) for _ in range(size)]
+    raise RemoteCacheError(f"неизвестный ответ {line!r}")
+
+
+# Сравнение и удаление одним скриптом: между GET и DEL другой узел мог
+# бы взять освободившуюся аренду
+DELETE_IF_EQUAL_SCRIPT = (
+    "if redis.call('get',KEYS[1])==ARGV[1] then "
+    "return redis.call('del',KEYS[1]) end return 0"
+)
+
+
+class RESPBackend(KVBackend):
+    # Клиент протокола Redis (RESP2): одно соединение, команды
+    # отправляются конвейером
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        timeout: float = 0.5,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._stream = sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            try:
+                self._send(setup)
+            except RemoteCacheError:
+                self._disconnect()
+                raise
+
+    def _disconnect(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _send(self, commands: list[tuple]) -> list:
+        self._sock.sendall(b"".join(encode_command(*c) for c in commands))
+        replies = [read_reply(self._stream) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RemoteCacheError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands: list[tuple]) -> list:
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._send(commands)
+            except (OSError, ConnectionError, ValueError) as e:
+                self._disconnect()
+                raise RemoteCacheError(f"{self.host}:{self.port}: {e}") from e
+
+    @staticmethod
+    def _ttl_ms(ttl: float) -> int:
+        return max(1, int(ttl * 1000))
+
+    def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        return self.pipeline([("MGET", *keys)])[0]
+
+    def set_many(self, items: list[tuple[str, bytes, float]]):
+        self.pipeline(
+            [
+                ("SET", key, value, "PX", self._ttl_ms(ttl))
+                for key, value, ttl in items
+            ]
+        )
+
+    def add_many(self, items: list[tuple[str, bytes, float]]) -> list[bool]:
+        replies = self.pipeline(
+            [
+                ("SET", key, value, "NX", "PX", self._ttl_ms(ttl))
+                for key, value, ttl in items
+            ]
+        )
+        return [reply == "OK" for reply in replies]
+
+    def delete_if_equal_many(
+        self, items: list[tuple[str, bytes]]
+    ) -> list[bool]:
+        replies = self.pipeline(
+            [
+                ("EVAL", DELETE_IF_EQUAL_SCRIPT, 1, key, value)
+                for key, value in items
+            ]
+        )
+        return [reply == 1 for reply in replies]
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class RESPServer:
+    # Заменитель Redis в процессе для тестов и бенчмарков: GET, MGET,
+    # SET (EX, PX, NX), DEL, PING, DBSIZE, FLUSHDB и EVAL только для
+    # DELETE_IF_EQUAL_SCRIPT. Данные в MemoryBackend
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.store = MemoryBackend()
+        self.commands = 0
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(
+            (host, port), self._make_handler()
+        )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="resp-server", daemon=True
+        )
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.server.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"redis://{host}:{port}"
+
+    def start(self) -> "RESPServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.connection.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+                )
+                while True:
+                    try:
+                        request = read_reply(self.rfile)
+                    except (OSError, ConnectionError, ValueError):
+                        return
+                    if not isinstance(request, list) or not request:
+                        self.wfile.write(b"-ERR protocol error\r\n")
+                        return
+                    self.wfile.write(server.execute(request))
+
+        return Handler
+
+    def execute(self, request: list[bytes]) -> bytes:
+        with self._lock:
+            self.commands += 1
+        name = request[0].decode().upper()
+        args = request[1:]
+        store = self.store
+        try:
+            if name == "PING":
+                return b"+PONG\r\n"
+            if name in ("AUTH", "SELECT"):
+                return b"+OK\r\n"
+            if name == "GET":
+                return self._bulk(store.get_many([args[0].decode()])[0])
+            if name == "MGET":
+                values = store.get_many([arg.decode() for arg in args])
+                return f"*{len(values)}\r\n".encode() + b"".join(
+                    self._bulk(value) for value in values
+                )
+            if name == "SET":
+                return self._set(args)
+            if name == "DEL":
+                removed = store.delete([arg.decode() for arg in args])
+                return f":{removed}\r\n".encode()
+            if name == "EVAL":
+                return self._eval(args)
+            if name == "DBSIZE":
+                return f":{len(store)}\r\n".encode()
+            if name in ("FLUSHDB", "FLUSHALL"):
+                store.clear()
+                return b"+OK\r\n"
+        except (IndexError, ValueError) as e:
+            return f"-ERR {name}: {e}\r\n".encode()
+        return f"-ERR unknown command '{name}'\r\n".encode()
+
+    def _set(self, args: list[bytes]) -> bytes:
+        key, value = args[0].decode(), args[1]
+        ttl, only_new = None, False
+        options = iter(args[2:])
+        for option in options:
+            option = option.decode().upper()
+            if option == "PX":
+                ttl = int(next(options)) / 1000
+            elif option == "EX":
+                ttl = int(next(options))
+            elif option == "NX":
+                only_new = True
+            else:
+                raise ValueError(f"неизвестный параметр {option}")
+        if only_new:
+            if not self.store.add_many([(key, value, ttl)])[0]:
+                return b"$-1\r\n"
+        else:
+            self.store.set_many([(key, value, ttl)])
+        return b"+OK\r\n"
+
+    def _eval(self, args: list[bytes]) -> bytes:
+        script, keys = args[0].decode(), int(args[1])
+        if script != DELETE_IF_EQUAL_SCRIPT or keys != 1:
+            raise ValueError("поддерживается только DELETE_IF_EQUAL_SCRIPT")
+        key, value = args[2].decode(), args[3]
+        deleted = self.store.delete_if_equal_many([(key, value)])[0]
+        return f":{int(deleted)}\r\n".encode()
+
+    @staticmethod
+    def _bulk(value: Optional[bytes]) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        return f"${len(value)}\r\n".encode() + value + b"\r\n"
+
+
+class RemoteCache:
+    # Общий для узлов уровень кэша за CacheManager. Запись хранит значение
+    # и время получения, чтобы срок годности считался от исходного
+    # запроса на любом узле. Аренда (lease:ключ) дает обновить ключ
+    # только одному узлу, остальные ждут его результата
+    def __init__(
+        self,
+        backend: KVBackend,
+        namespace: str = "converter",
+        lease_ttl: float = 10.0,
+        lease_wait: float = 3.0,
+        poll_interval: float = 0.05,
+        retry_after: float = 30.0,
+    ):
+        self.backend = backend
+        self.namespace = namespace
+        self.lease_ttl = lease_ttl
+        self.lease_wait = lease_wait
+        self.poll_interval = poll_interval
+        self.retry_after = retry_after
+        self.token = uuid.uuid4().hex.encode()
+        self._down_until = 0.0
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RemoteCache":
+        # redis://[:пароль@]хост:порт[/база] или просто хост:порт
+        if "://" not in url:
+            url = f"redis://{url}"
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != "redis":
+            raise ValueError(f"Неподдерживаемая схема {parts.scheme}")
+        backend = RESPBackend(
+            parts.hostname or "127.0.0.1",
+            parts.port or 6379,
+            db=int(parts.path.strip("/") or 0),
+            password=parts.password,
+        )
+        return cls(backend, **kwargs)
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _name(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _call(self, op: str, fn, *args, default=None):
+        # Недоступный кэш не должен замедлять каждый расчет: после ошибки
+        # обращения к нему пропускаются retry_after секунд
+        if not self.available:
+            return default
+        try:
+            with metrics.timer("remote_cache_seconds", op=op):
+                return fn(*args)
+        except RemoteCacheError as e:
+            logger.warning(f"Общий кэш недоступен ({op}): {e}")
+            metrics.inc("remote_cache_errors_total", op=op)
+            self._down_until = time.monotonic() + self.retry_after
+            return default
+
+    def get_many(self, keys: list[str]) -> dict[str, tuple[float, float]]:
+        if not keys:
+            return {}
+        values = self._call(
+            "get", self.backend.get_many, [self._name(key) for key in keys]
+        )
+        entries = {}
+        for key, raw in zip(keys, values or []):
+            if raw is None:
+                continue
+            try:
+                value, timestamp = json.loads(raw)
+            except (ValueError, TypeError):
+                continue
+            entries[key] = (value, timestamp)
+        return entries
+
+    def set_many(self, entries: dict[str, tuple[float, float, float]]):
+        # ключ -> (значение, время получения, время жизни)
+        if not entries:
+            return
+        self._call(
+            "set",
+            self.backend.set_many,
+            [
+                (self._name(key), json.dumps([value, timestamp]).encode(), ttl)
+                for key, (value, timestamp, ttl) in entries.items()
+            ],
+        )
+
+    def acquire(self, keys: list[str]) -> list[str]:
+        # Без общего кэша каждый узел обновляет ключи сам
+        if not keys:
+            return []
+        added = self._call(
+            "lease",
+            self.backend.add_many,
+            [
+                (self._name(f"lease:{key}"), self.token, self.lease_ttl)
+                for key in keys
+            ],
+        )
+        if added is None:
+            return list(keys)
+        acquired = [key for key, ok in zip(keys, added) if ok]
+        metrics.inc("remote_leases_total", len(acquired), result="acquired")
+        metrics.inc(
+            "remote_leases_total", len(keys) - len(acquired), result="busy"
+        )
+        return acquired
+
+    def release(self, keys: list[str]):
+        if not keys:
+            return
+        self._call(
+            "release",
+            self.backend.delete_if_equal_many,
+            [(self._name(f"lease:{key}"), self.token) for key in keys],
+        )
+
+    def wait(
+        self, keys: list[str], accept: Optional[Callable] = None
+    ) -> dict[str, tuple[float, float]]:
+        # Ожидание ключей, которые обновляет другой узел. accept(ключ,
+        # запись) отсеивает записи, устаревшие по меркам этого узла
+        deadline = time.monotonic() + self.lease_wait
+        pending = list(keys)
+        found = {}
+        while pending and self.available:
+            entries = {
+                key: entry
+                for key, entry in self.get_many(pending).items()
+                if accept is None or accept(key, entry)
+            }
+            found.update(entries)
+            pending = [key for key in pending if key not in entries]
+            if not pending or time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+        return found
+
+    def close(self):
+        self.backend.close()
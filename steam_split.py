@@ -0,0 +1,232 @@
+import math
+import time
+from itertools import repeat
+from operator import add
+from typing import NamedTuple, Optional, Union
+
+from core import (
+    RATE_UNAVAILABLE,
+    ConversionError,
+    CurrencyConverterCore,
+    SteamCalculator,
+    format_number,
+    metrics,
+    tracer,
+)
+
+
+class SplitResult(NamedTuple):
+    amount: float
+    currency: str
+    payments: tuple
+    steam_result: Union[int, float]
+    single_result: Union[int, float]
+    saving: Union[int, float]
+    commission: Union[int, float]
+    live_quotes: int
+    upstream_calls: int
+    elapsed_ms: float
+
+    def to_dict(self) -> dict:
+        return {**self._asdict(), "payments": list(self.payments)}
+
+
+class SplitOptimizer:
+    # Кривая комиссий нелинейна, поэтому несколько небольших платежей
+    # иногда выгоднее одного. Разбиение ищется динамическим
+    # программированием по сетке сумм: все платежи, кроме одного, кратны
+    # шагу сетки, последний добирает остаток точно
+    MAX_STATES = 1_000
+    # Мелкие платежи перебираются по всей сетке: на них сильнее всего
+    # сказывается округление зачисления вниз
+    GRID_CANDIDATES = 64
+
+    def __init__(
+        self,
+        converter: CurrencyConverterCore,
+        max_payments: int = 5,
+        max_quotes: int = 10,
+    ):
+        self.converter = converter
+        self.max_payments = max(1, max_payments)
+        self.max_quotes = max_quotes
+
+    def curve_points(
+        self, currency: str, cached: Optional[dict[float, float]] = None
+    ) -> dict[float, float]:
+        # Опорные точки: откалиброванная кривая офлайн-пакета или
+        # встроенная, поверх них свежие котировки из кэша
+        bundle = self.converter.bundle
+        base = bundle.curve(currency) if bundle is not None else None
+        points = dict(base or SteamCalculator.FALLBACK_CURVES[currency])
+        if cached is None:
+            cached = self.converter.cache_manager.fresh_steam_amounts()
+            cached = cached.get(currency, {})
+        points.update(cached)
+        return points
+
+    @staticmethod
+    def _credited(quote: float, digits: int) -> Union[int, float]:
+        return int(quote) if digits == 0 else round(quote, digits)
+
+    def _solve(
+        self, amount: float, points: dict[float, float], currency: str
+    ) -> tuple[tuple, Union[int, float]]:
+        digits = SteamCalculator.RESULT_PRECISION.get(currency, 0)
+        curve = sorted(points.items())
+        minimum = curve[0][0]
+
+        def credited(pay: float) -> Union[int, float]:
+            quote = points.get(pay)
+            if quote is None:
+                quote = SteamCalculator.interpolate(curve, pay, digits)
+            return self._credited(quote, digits)
+
+        unit = 10**-digits
+        step = unit * max(1, math.ceil(amount / unit / self.MAX_STATES))
+        states = int(amount // step)
+        lowest = math.ceil(round(minimum / step, 6))
+        weights = set(range(lowest, lowest + self.GRID_CANDIDATES))
+        weights.update(round(pay / step) for pay in points if pay >= minimum)
+        candidates = {
+            weight: credited(round(weight * step, digits))
+            for weight in sorted(weights)
+            if 1 <= weight <= states
+        }
+
+        # layers[k][b] - лучшая сумма зачисления не больше чем k платежами
+        # по сетке на сумму b * step
+        first = [0.0] + [-math.inf] * states
+        layers = [first]
+        if candidates and self.max_payments > 1:
+            # Один платеж по сетке - это сами кандидаты
+            single = first[:]
+            for weight, value in candidates.items():
+                single[weight] = value
+            layers.append(single)
+        for _ in range(self.max_payments - 2 if candidates else 0):
+            previous = layers[-1]
+            # Один вызов max на состояние по всем кандидатам сразу
+            shifted = [
+                [-math.inf] * weight
+                + list(
+                    map(add, previous[: states + 1 - weight], repeat(value))
+                )
+                for weight, value in candidates.items()
+            ]
+            layers.append(list(map(max, previous, *shifted)))
+
+        top = layers[-1]
+        best_total, best_b, best_rest = -math.inf, 0, amount
+        for b in range(states + 1):
+            if top[b] == -math.inf:
+                continue
+            rest = round(amount - b * step, 6)
+            if rest == 0:
+                total = top[b]
+            elif rest >= minimum or b == 0:
+                total = top[b] + credited(rest)
+            else:
+                continue
+            if total > best_total:
+                best_total, best_b, best_rest = total, b, rest
+
+        payments = [best_rest] if best_rest else []
+        b, value = best_b, top[best_b]
+        for k in range(len(layers) - 1, 0, -1):
+            below = layers[k - 1]
+            if below[b] == value:
+                continue
+            for weight, credit in candidates.items():
+                if weight <= b and below[b - weight] + credit == value:
+                    payments.append(round(weight * step, digits))
+                    b, value = b - weight, below[b - weight]
+                    break
+        payments.sort(reverse=True)
+        return tuple(format_number(p) for p in payments), format_number(
+            round(best_total, digits)
+        )
+
+    @tracer.traced("steam.split")
+    def optimize(
+        self, amount: float, currency: str = "RUB", from_uah: bool = False
+    ) -> Union[SplitResult, ConversionError]:
+        converter = self.converter
+        if not converter.current_rate:
+            return RATE_UNAVAILABLE
+        error = converter.steam_wallet_error(currency, from_uah)
+        if error is not None:
+            return error
+        start = time.perf_counter()
+        pay_amount = converter._steam_pay_amount(amount, from_uah, currency)
+        online = converter._is_effectively_online()
+        cached = converter.cache_manager.fresh_steam_amounts()
+        cached = cached.get(currency, {})
+        points = self.curve_points(currency, cached)
+
+        # Живые котировки запрашиваются только для сумм лучшего разбиения
+        # и всей суммы целиком, пока не исчерпан бюджет max_quotes. Суммы
+        # со свежей котировкой в кэше уже известны точно. quoted нужен
+        # только для остановки цикла: в кривую попадают лишь котировки,
+        # действительно полученные от API, а не резервный расчет
+        quoted: set[float] = set()
+        live = calls = 0
+        while True:
+            payments, credited = self._solve(pay_amount, points, currency)
+            wanted = [
+                pay
+                for pay in dict.fromkeys((pay_amount, *payments))
+                if pay not in quoted and pay not in cached
+            ][: self.max_quotes - len(quoted)]
+            if not wanted or not online:
+                break
+            plan, quotes = converter.steam_calculator.quote_plan(
+                [(pay, currency) for pay in wanted], online
+            )
+            calls += plan.fetched
+            quoted.update(wanted)
+            for item, quote in quotes.items():
+                if plan.canonical[item][1] in plan.live:
+                    points[item[0]] = quote
+                    live += 1
+
+        digits = SteamCalculator.RESULT_PRECISION.get(currency, 0)
+        single = self._credited(
+            points.get(pay_amount)
+            or SteamCalculator.interpolate(
+                sorted(points.items()), pay_amount, digits
+            ),
+            digits,
+        )
+        elapsed = time.perf_counter() - start
+        metrics.inc("steam_splits_total", currency=currency)
+        metrics.inc("steam_split_upstream_calls_total", calls)
+        return SplitResult(
+            format_number(pay_amount),
+            currency,
+            payments,
+            credited,
+            single,
+            format_number(round(credited - single, digits)),
+            format_number(
+                round((pay_amount - credited) / pay_amount * 100, 2)
+                if pay_amount > 0
+                else 0
+            ),
+            live,
+            calls,
+            round(elapsed * 1000, 2),
+        )
+
+
+def optimize_split(
+    converter: CurrencyConverterCore,
+    amount: float,
+    currency: str = "RUB",
+    from_uah: bool = False,
+    max_payments: int = 5,
+    max_quotes: int = 10,
+) -> Union[SplitResult, ConversionError]:
+    return SplitOptimizer(converter, max_payments, max_quotes).optimize(
+        amount, currency, from_uah
+    )
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+from core import ConversionError, CurrencyConverterCore, SteamConversionResult
+from steam_split import optimize_split
+
+
+class SteamWalletFromUAHTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.converter = CurrencyConverterCore(
+            cache_file=os.path.join(self.workdir.name, "cache.json"),
+            history_file=os.path.join(self.workdir.name, "history.bin"),
+            bundle_file=os.path.join(self.workdir.name, "bundle.bin"),
+        )
+        # Офлайн по кэшу: расчет идет по встроенной кривой без сети
+        self.converter.current_rate = 2.5
+        self.converter.rate_source = "cache"
+        self.converter.is_online = False
+
+    def tearDown(self):
+        self.converter.api_client.close()
+        self.workdir.cleanup()
+
+    def test_kzt_wallet_rejects_uah_amount(self):
+        result = self.converter.convert_to_steam_result(
+            100, from_uah=True, currency="KZT"
+        )
+        self.assertIsInstance(result, ConversionError)
+        self.assertIn("KZT", result.error)
+
+    def test_kzt_wallet_in_batch(self):
+        kzt, rub = self.converter.convert_to_steam_batch_results(
+            [(100, "KZT"), (100, "RUB")], from_uah=True
+        )
+        self.assertIsInstance(kzt, ConversionError)
+        self.assertIsInstance(rub, SteamConversionResult)
+        self.assertEqual(rub.rub_amount, 250)
+
+    def test_uah_wallet_keeps_amount(self):
+        result = self.converter.convert_to_steam_result(
+            100, from_uah=True, currency="UAH"
+        )
+        self.assertIsInstance(result, SteamConversionResult)
+        self.assertEqual(result.from_currency, "UAH")
+        self.assertEqual(result.steam_currency, "UAH")
+        self.assertLessEqual(result.steam_result, 100)
+
+    def test_kzt_wallet_without_uah(self):
+        result = self.converter.convert_to_steam_result(100, currency="KZT")
+        self.assertIsInstance(result, SteamConversionResult)
+        self.assertEqual(result.amount, 100)
+
+    def test_split_rejects_uah_amount_for_kzt(self):
+        result = optimize_split(
+            self.converter, 5000, currency="KZT", from_uah=True
+        )
+        self.assertIsInstance(result, ConversionError)
+
+
+if __name__ == "__main__":
+    unittest.main()
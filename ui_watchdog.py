@@ -0,0 +1,216 @@
+import logging
+import sys
+import threading
+import time
+import tkinter
+import traceback
+from collections import deque
+from typing import Optional
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _callback_name(func) -> str:
+    # root.after оборачивает функцию в callit, настоящая лежит в замыкании
+    if getattr(func, '__qualname__', '').endswith('after.<locals>.callit'):
+        for cell in func.__closure__ or ():
+            try:
+                candidate = cell.cell_contents
+            except ValueError:
+                continue
+            if callable(candidate) and not isinstance(candidate, tkinter.Misc):
+                func = candidate
+                break
+    return getattr(func, '__qualname__', None) or repr(func)
+
+
+class _TimedCallWrapper(tkinter.CallWrapper):
+    watchdog: Optional["TkWatchdog"] = None
+
+    def __call__(self, *args):
+        watchdog = self.watchdog
+        if watchdog is None:
+            return super().__call__(*args)
+        watchdog._callback_started(self.func)
+        try:
+            return super().__call__(*args)
+        finally:
+            watchdog._callback_finished()
+
+
+class TkWatchdog:
+    def __init__(
+        self,
+        threshold: float = 0.2,
+        interval: float = 0.1,
+        sample_interval: float = 0.05,
+        max_samples: int = 3,
+        stack_depth: int = 12,
+    ):
+        # Пульс через root.after показывает задержку цикла событий, а
+        # обертка над обработчиками Tk - кто именно ее вызвал. Если пульса
+        # нет дольше threshold, фоновый поток снимает стек потока Tk
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.max_samples = max_samples
+        self.stack_depth = stack_depth
+        self.root = None
+        self.beats = 0
+        self.lags: deque[float] = deque(maxlen=10_000)
+        self.loop_stalls: list[float] = []
+        # имя -> [вызовы, всего, максимум, медленные]
+        self.callbacks: dict[str, list] = {}
+        self.samples: list[dict] = []
+        self._stack: list[tuple[Optional[str], float, int]] = []
+        self._thread_id: Optional[int] = None
+        self._started_at = 0.0
+        self._last_beat = 0.0
+        self._next_due = 0.0
+        self._after_id = None
+        self._sampled: dict[int, int] = {}
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._original_wrapper = None
+
+    def install(self):
+        # Обработчики, зарегистрированные до установки, не измеряются,
+        # поэтому вызывается до создания окна
+        if self._original_wrapper is None:
+            self._original_wrapper = tkinter.CallWrapper
+            tkinter.CallWrapper = _TimedCallWrapper
+        _TimedCallWrapper.watchdog = self
+
+    def start(self, root):
+        self.install()
+        self.root = root
+        self._thread_id = threading.get_ident()
+        self._started_at = self._last_beat = time.perf_counter()
+        self._next_due = self._last_beat + self.interval
+        self._after_id = root.after(int(self.interval * 1000), self._beat)
+        self._sampler = threading.Thread(
+            target=self._sample_loop, name="tk-watchdog", daemon=True
+        )
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self.root is not None and self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except tkinter.TclError:
+                pass
+            self._after_id = None
+        if _TimedCallWrapper.watchdog is self:
+            _TimedCallWrapper.watchdog = None
+        if self._original_wrapper is not None:
+            tkinter.CallWrapper = self._original_wrapper
+            self._original_wrapper = None
+
+    def _beat(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._next_due)
+        self.lags.append(lag)
+        metrics.observe("gui_loop_lag_seconds", lag)
+        if lag > self.threshold:
+            self.loop_stalls.append(lag)
+        self.beats += 1
+        self._last_beat = now
+        self._next_due = now + self.interval
+        if not self._stopped.is_set():
+            self._after_id = self.root.after(
+                int(self.interval * 1000), self._beat
+            )
+
+    def _callback_started(self, func):
+        name = None if func == self._beat else _callback_name(func)
+        self._stack.append((name, time.perf_counter(), self.beats))
+
+    def _callback_finished(self):
+        name, start, beats = self._stack.pop()
+        if name is None:
+            return
+        duration = time.perf_counter() - start
+        metrics.observe("gui_callback_seconds", duration)
+        stats = self.callbacks.setdefault(name, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        # Пульс во время обработчика значит, что он крутил вложенный цикл
+        # событий (модальный диалог), и окно не зависало
+        if duration > self.threshold and self.beats == beats:
+            stats[3] += 1
+            metrics.inc("gui_stalls_total", callback=name)
+            logger.warning(
+                f"Обработчик {name} занял {duration * 1000:.0f} мс "
+                f"в потоке интерфейса"
+            )
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.sample_interval):
+            blocked = time.perf_counter() - self._last_beat - self.interval
+            if blocked < self.threshold:
+                continue
+            beats = self.beats
+            if self._sampled.get(beats, 0) >= self.max_samples:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = "".join(
+                traceback.format_stack(frame, limit=self.stack_depth)
+            )
+            del frame
+            running = self._stack[-1][0] if self._stack else None
+            self._sampled[beats] = self._sampled.get(beats, 0) + 1
+            self.samples.append(
+                {
+                    "callback": running,
+                    "blocked": blocked,
+                    "stack": stack,
+                }
+            )
+            logger.warning(
+                f"Интерфейс не отвечает {blocked * 1000:.0f} мс "
+                f"(обработчик {running or 'неизвестен'}):\n{stack}"
+            )
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self._started_at
+        lines = [f"⏱ Отчет watchdog интерфейса за {elapsed:.0f} с:"]
+        if self.lags:
+            ordered = sorted(self.lags)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            lines.append(
+                f"   Задержка цикла событий: p50 {p50 * 1000:.0f} мс, "
+                f"p95 {p95 * 1000:.0f} мс, макс {ordered[-1] * 1000:.0f} мс"
+            )
+        lines.append(
+            f"   Зависаний дольше {self.threshold * 1000:.0f} мс: "
+            f"{len(self.loop_stalls)}"
+        )
+        slow = sorted(
+            (
+                (name, stats)
+                for name, stats in self.callbacks.items()
+                if stats[3]
+            ),
+            key=lambda item: item[1][2],
+            reverse=True,
+        )
+        if slow:
+            lines.append("   Медленные обработчики:")
+            for name, (calls, total, longest, count) in slow:
+                lines.append(
+                    f"      {name}: {count} из {calls}, "
+                    f"макс {longest * 1000:.0f} мс, "
+                    f"всего {total * 1000:.0f} мс"
+                )
+        else:
+            lines.append("   Медленных обработчиков нет")
+        if self.samples:
+            lines.append(f"   Снято стеков: {len(self.samples)} (см. лог)")
+        return "\n".join(lines)